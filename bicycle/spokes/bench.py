@@ -0,0 +1,222 @@
+"""Builds the spoke animations on the host and times each one's per-frame cost.
+
+animations.cpp is compiled against host/FastLED.h, a stand-in with the parts of FastLED it uses,
+and driven by host/bench.cpp. Each animation is called like loop() calls it and every call is timed,
+and the frames are kept as (frame, LED, RGB) arrays, which can be saved for previewing.
+
+Host times are scaled to the ESP32 to estimate how late drawing makes each frame at each CPU clock,
+as a fraction of the delay the animation asked for. Each animation is run a few times and the
+fastest time of each frame is kept, so the host's scheduler doesn't show up as slow frames.
+FastLED.show() also adds to every frame, but takes as long at any clock. Note that loop() spins in
+RemoteXY_Handler() until the next frame is due, so the CPU is never idle; a lower clock saves power,
+and only the drawing time gets longer.
+
+Usage: python3 bench.py [--frames N] [--speed N] [--output frames.npz]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import typing
+
+import numpy
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+HOST_DIRECTORY = os.path.join(DIRECTORY, "host")
+# The sketch builds with -Os
+CXXFLAGS = ["-std=c++17", "-Os", "-Wall", "-Wextra"]
+# CPU frequencies the ESP32 Arduino core offers with Bluetooth on
+CLOCKS_MHZ = (240, 160, 80)
+# A rough guess of how many times slower a 240 MHz ESP32 core is than a desktop core, for integer
+# code like this. Calibrate by timing an animation with micros() on the board.
+DEFAULT_ESP32_SLOWDOWN = 40.0
+# WS2812B: 24 bits at 800 kHz per LED, then a 50 us latch
+SHOW_US_PER_LED = 30.0
+SHOW_LATCH_US = 50.0
+DEFAULT_SPEED = 100
+DEFAULT_REPEATS = 5
+DEFAULT_MAX_LATE_FRACTION = 0.1
+
+
+class Layout(typing.NamedTuple):
+    led_count: int
+    ring_count: int
+    spoke_count: int
+    # LED index of each ring and spoke, -1 if there isn't one
+    index: numpy.ndarray
+
+
+class Result(typing.NamedTuple):
+    name: str
+    delay_ms: numpy.ndarray  # What each call returned
+    elapsed_ns: numpy.ndarray  # How long each call took on the host, the fastest of the repeats
+    leds: numpy.ndarray  # (frame, LED, RGB)
+
+
+def build(build_directory: str, compiler: str) -> str:
+    binary = os.path.join(build_directory, "bench")
+    command = [
+        compiler,
+        *CXXFLAGS,
+        "-I",
+        HOST_DIRECTORY,
+        "-I",
+        DIRECTORY,
+        os.path.join(DIRECTORY, "animations.cpp"),
+        os.path.join(HOST_DIRECTORY, "bench.cpp"),
+        "-o",
+        binary,
+    ]
+    subprocess.run(command, check=True)
+    return binary
+
+
+def list_animations(binary: str) -> typing.List[str]:
+    result = subprocess.run([binary, "list"], stdout=subprocess.PIPE, check=True, text=True)
+    return result.stdout.split()
+
+
+def read_layout(binary: str) -> Layout:
+    result = subprocess.run([binary, "layout"], stdout=subprocess.PIPE, check=True, text=True)
+    lines = result.stdout.splitlines()
+    led_count, ring_count, spoke_count = (int(value) for value in lines[0].split())
+    index = numpy.array([[int(value) for value in line.split()] for line in lines[1:]], dtype=numpy.intp)
+    return Layout(led_count, ring_count, spoke_count, index)
+
+
+def run(binary: str, name: str, frames: int, layout: Layout, repeats: int) -> Result:
+    """Runs an animation repeats times. Every run starts from the same state, so draws the same
+    frames.
+    """
+    frame_dtype = numpy.dtype(
+        [("delay_ms", "<i4"), ("elapsed_ns", "<i4"), ("leds", "u1", (layout.led_count, 3))]
+    )
+    elapsed_ns = numpy.full(frames, numpy.iinfo(numpy.int32).max, dtype=numpy.int32)
+    for _ in range(repeats):
+        result = subprocess.run([binary, "run", name, str(frames)], stdout=subprocess.PIPE, check=True)
+        records = numpy.frombuffer(result.stdout, dtype=frame_dtype)
+        elapsed_ns = numpy.minimum(elapsed_ns, records["elapsed_ns"])
+    return Result(name, records["delay_ms"].copy(), elapsed_ns, records["leds"].copy())
+
+
+def to_grid(leds: numpy.ndarray, layout: Layout) -> numpy.ndarray:
+    """Rearranges (frame, LED, RGB) frames to (frame, ring, spoke, RGB), black where a ring and spoke
+    has no LED.
+    """
+    padded = numpy.concatenate([leds, numpy.zeros_like(leds[:, :1])], axis=1)
+    # -1 picks the black pixel on the end
+    return padded[:, layout.index]
+
+
+def speed_multiplier(speed: int) -> float:
+    """What loop() multiplies each animation's delay by, from the speed slider."""
+    return 20.0 / (speed + 5.0)
+
+
+def show_us(led_count: int) -> float:
+    return led_count * SHOW_US_PER_LED + SHOW_LATCH_US
+
+
+def esp32_us(host_ns: numpy.ndarray, slowdown: float, clock_mhz: float) -> numpy.ndarray:
+    return host_ns / 1000 * slowdown * CLOCKS_MHZ[0] / clock_mhz
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Times the spoke animations on the host and estimates their cost on the ESP32.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--frames", "-n", type=int, default=2000, help="Frames to time per animation")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Runs per animation")
+    parser.add_argument("--animation", "-a", action="append", help="Only run these animations")
+    parser.add_argument("--speed", type=int, default=DEFAULT_SPEED, help="Speed slider, 0-100")
+    parser.add_argument(
+        "--esp32-slowdown",
+        type=float,
+        default=DEFAULT_ESP32_SLOWDOWN,
+        help="How many times slower a 240 MHz ESP32 is than this machine",
+    )
+    parser.add_argument(
+        "--max-late",
+        type=float,
+        default=DEFAULT_MAX_LATE_FRACTION,
+        help="Largest fraction of a frame's delay that drawing may add",
+    )
+    parser.add_argument("--output", "-o", type=str, help="Save the frames to this .npz, for previewing")
+    parser.add_argument("--compiler", type=str, default=os.environ.get("CXX", "c++"), help="C++ compiler")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.frames < 1 or args.repeats < 1:
+        print_error("Frames and repeats should be positive")
+    if not 0 <= args.speed <= 100:
+        print_error(f"Speed should be 0-100, got {args.speed}")
+    if shutil.which(args.compiler) is None:
+        print_error(f"No compiler {args.compiler}")
+
+    with tempfile.TemporaryDirectory() as build_directory:
+        binary = build(build_directory, args.compiler)
+        names = list_animations(binary)
+        for name in args.animation or []:
+            if name not in names:
+                print_error(f"Unknown animation {name}, should be one of {', '.join(names)}")
+        layout = read_layout(binary)
+        results = [run(binary, name, args.frames, layout, args.repeats) for name in args.animation or names]
+
+    multiplier = speed_multiplier(args.speed)
+    show = show_us(layout.led_count)
+    print(
+        f"show() adds ~{show:0.0f} us to every frame for {layout.led_count} LEDs;"
+        f" speed {args.speed} multiplies delays by {multiplier:0.2f}"
+    )
+    clock_columns = " ".join(f"{f'{clock} MHz':>10}" for clock in CLOCKS_MHZ)
+    print(f"{'animation':>20} {'delay ms':>8} {'host ns':>8} {'max ns':>8} {clock_columns}   (slowest frame, us / % late)")
+
+    lowest_clock: typing.Dict[str, int] = {}
+    for result in results:
+        # loop() truncates the delay to whole ms
+        interval_ms = numpy.floor(result.delay_ms * multiplier)
+        worst = int(numpy.argmax(result.elapsed_ns / numpy.maximum(interval_ms, 1)))
+        columns = []
+        for clock in CLOCKS_MHZ:
+            draw_us = float(esp32_us(result.elapsed_ns[worst], args.esp32_slowdown, clock))
+            late = draw_us / 1000 / max(interval_ms[worst], 1)
+            columns.append(f"{draw_us:5.0f}/{late * 100:3.0f}%")
+            if late <= args.max_late:
+                lowest_clock[result.name] = clock
+        print(
+            f"{result.name:>20} {int(numpy.min(result.delay_ms)):>8}"
+            f" {numpy.median(result.elapsed_ns):8.0f} {numpy.max(result.elapsed_ns):8.0f}"
+            f" {' '.join(f'{column:>10}' for column in columns)}"
+        )
+
+    too_slow = [result.name for result in results if result.name not in lowest_clock]
+    if too_slow:
+        print(f"Late by more than {args.max_late:.0%} even at {CLOCKS_MHZ[0]} MHz: {', '.join(too_slow)}")
+    else:
+        print(f"Lowest clock with every frame within {args.max_late:.0%}: {max(lowest_clock.values())} MHz")
+
+    if args.output:
+        numpy.savez_compressed(
+            args.output,
+            **{result.name: to_grid(result.leds, layout) for result in results},
+            **{f"{result.name}_delay_ms": result.delay_ms for result in results},
+        )
+        print(f"Saved (frame, ring, spoke, RGB) frames to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
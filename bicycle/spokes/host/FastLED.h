@@ -0,0 +1,58 @@
+// Just enough of FastLED to build animations.cpp on the host, for bench.py.
+#ifndef HOST_FASTLED_H
+#define HOST_FASTLED_H
+
+#include <cstdint>
+
+void hsvToRgb(std::uint8_t hue, std::uint8_t saturation, std::uint8_t value, std::uint8_t *red,
+              std::uint8_t *green, std::uint8_t *blue);
+
+struct CHSV {
+  std::uint8_t h, s, v;
+  CHSV(std::uint8_t hue, std::uint8_t saturation, std::uint8_t value)
+      : h(hue), s(saturation), v(value) {}
+};
+
+struct CRGB {
+  std::uint8_t r, g, b;
+  CRGB() : r(0), g(0), b(0) {}
+  CRGB(std::uint8_t red, std::uint8_t green, std::uint8_t blue) : r(red), g(green), b(blue) {}
+  // FastLED converts with hsv2rgb_rainbow. This uses the sketch's hsvToRgb, like the SDL demo, so
+  // hues are a little off, but the cost is about the same.
+  CRGB(const CHSV &hsv) : r(0), g(0), b(0) { hsvToRgb(hsv.h, hsv.s, hsv.v, &r, &g, &b); }
+};
+static_assert(sizeof(CRGB) == 3, "bench.py reads leds as packed RGB");
+
+// Same as FastLED's sin8_C, copied from the demo
+inline std::uint8_t sin8(std::uint8_t theta) {
+  static const std::uint8_t b_m16_interleave[] = {0, 49, 49, 41, 90, 27, 117, 10};
+  std::uint8_t offset = theta;
+  if (theta & 0x40) {
+    offset = (std::uint8_t)255 - offset;
+  }
+  offset &= 0x3F; // 0..63
+
+  std::uint8_t secoffset = offset & 0x0F; // 0..15
+  if (theta & 0x40)
+    secoffset++;
+
+  std::uint8_t section = offset >> 4; // 0..3
+  std::uint8_t s2 = section * 2;
+  const std::uint8_t *p = b_m16_interleave;
+  p += s2;
+  std::uint8_t b = *p;
+  p++;
+  std::uint8_t m16 = *p;
+
+  std::uint8_t mx = (m16 * secoffset) >> 4;
+
+  std::int8_t y = mx + b;
+  if (theta & 0x80)
+    y = -y;
+
+  y += 128;
+
+  return y;
+}
+
+#endif
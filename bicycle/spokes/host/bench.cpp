@@ -0,0 +1,113 @@
+// Runs the spoke animations on the host, for bench.py.
+// Usage:
+//   bench list           Prints the animation names, in spokes.ino order
+//   bench layout         Prints LED_COUNT RING_COUNT SPOKE_COUNT, then the LED index of each ring
+//                        and spoke, -1 if there isn't one
+//   bench run NAME N     Calls the animation 20 times to settle, like setup(), then N more times,
+//                        and writes an int32 delay_ms, an int32 elapsed_ns and LED_COUNT RGB
+//                        bytes to stdout for each of those calls
+
+#include <FastLED.h>
+
+#include <chrono>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+
+#include "animations.hpp"
+
+CRGB leds[LED_COUNT];
+
+struct Animation {
+  const char *name;
+  int (*function)();
+};
+
+// spokes.ino's animations, then the ones it doesn't use
+const Animation animations[] = {
+  {"outerHue", outerHue},
+  {"outerRipple", outerRipple},
+  {"orbit", orbit},
+  {"triadOrbits", triadOrbits},
+  {"blurredSpiral", blurredSpiral},
+  {"blurredSpiralHues", blurredSpiralHues},
+  {"fadingRainbowRings", fadingRainbowRings},
+  {"cometsShort", cometsShort},
+  {"comets", comets},
+  {"outwardRipple", outwardRipple},
+  {"outwardRippleHue", outwardRippleHue},
+  {"singleSpiral", singleSpiral},
+  {"spiral", spiral},
+  {"fastOutwardHue", fastOutwardHue},
+  {"fastInwardHue", fastInwardHue},
+  {"lightAll", lightAll},
+  {"spinSingle", spinSingle},
+};
+
+static void clear() {
+  for (int i = 0; i < LED_COUNT; ++i) {
+    leds[i] = CRGB();
+  }
+}
+
+static void printLayout() {
+  printf("%d %d %d\n", LED_COUNT, RING_COUNT, SPOKE_COUNT);
+  for (int ring = 0; ring < RING_COUNT; ++ring) {
+    for (int spoke = 0; spoke < SPOKE_COUNT; ++spoke) {
+      clear();
+      setLed(ring, spoke, 255, 255, 255);
+      int index = -1;
+      for (int i = 0; i < LED_COUNT; ++i) {
+        if (leds[i].r == 255) {
+          index = i;
+        }
+      }
+      printf("%d%c", index, spoke == SPOKE_COUNT - 1 ? '\n' : ' ');
+    }
+  }
+}
+
+static int run(int (*const function)(), const int frames) {
+  using Clock = std::chrono::steady_clock;
+  for (int i = 0; i < 20; ++i) {
+    function();
+  }
+  for (int i = 0; i < frames; ++i) {
+    // loop() clears before every frame
+    clear();
+    const auto start = Clock::now();
+    const std::int32_t delay_ms = function();
+    const auto end = Clock::now();
+    const std::int32_t elapsed_ns =
+      std::chrono::duration_cast<std::chrono::nanoseconds>(end - start).count();
+    fwrite(&delay_ms, sizeof(delay_ms), 1, stdout);
+    fwrite(&elapsed_ns, sizeof(elapsed_ns), 1, stdout);
+    fwrite(leds, sizeof(leds), 1, stdout);
+  }
+  return 0;
+}
+
+int main(int argc, char **argv) {
+  if (argc == 2 && strcmp(argv[1], "list") == 0) {
+    for (const auto &animation : animations) {
+      printf("%s\n", animation.name);
+    }
+    return 0;
+  }
+  if (argc == 2 && strcmp(argv[1], "layout") == 0) {
+    printLayout();
+    return 0;
+  }
+  if (argc == 4 && strcmp(argv[1], "run") == 0) {
+    for (const auto &animation : animations) {
+      if (strcmp(argv[2], animation.name) == 0) {
+        return run(animation.function, atoi(argv[3]));
+      }
+    }
+    fprintf(stderr, "Unknown animation %s\n", argv[2]);
+    return 1;
+  }
+  fprintf(stderr, "Usage: %s list | layout | run NAME FRAMES\n", argv[0]);
+  return 1;
+}
@@ -0,0 +1,241 @@
+"""Compiles images and videos to persistence of vision columns for the spokes.
+
+As the wheel turns, each spoke sweeps through every angle, so a frame is stored as one column of
+LED colors per angle slot. The polar resampling, which pixel each slot and LED shows, is computed
+once per input size as an index table, and then every frame is converted with a single gather.
+
+Columns are stored by absolute angle, with slot 0 pointing up and slots going clockwise. With
+evenly spaced spokes, spoke k shows column (slot + k * slot_count / spoke_count) % slot_count when
+spoke 0 is at slot, so the slot count should be a multiple of the spoke count. LED 0 is nearest the
+hub; the firmware handles spokes that are wired outside in.
+
+File format: uint16 slot count, uint8 LEDs per spoke, uint8 format (0 RGB888, 1 RGB565), uint16
+ms per frame, then the frames, each slot_count x LEDs pixels, little endian.
+
+Usage: python3 pov.py image.gif [--slots N] [--rpm N]
+"""
+
+import argparse
+import enum
+import pathlib
+import sys
+import time
+import typing
+
+import numpy
+
+has_cv2 = False
+try:
+    import cv2
+
+    has_cv2 = True
+except:
+    pass
+
+# Spokes with LEDs, every other one of 18, each with RING_COUNT LEDs. See ringSpokeToIndex.
+DEFAULT_SPOKE_COUNT = 9
+DEFAULT_LEDS_PER_SPOKE = 5
+DEFAULT_SLOT_COUNT = 180
+# Radius of the innermost LED, as a fraction of the outermost
+DEFAULT_INNER_RADIUS = 0.2
+DEFAULT_SUPERSAMPLE = 2
+# About 15 mph on a 26" wheel
+DEFAULT_RPM = 200
+BATCH_SIZE = 64
+
+
+class PixelFormat(enum.Enum):
+    RGB888 = 0
+    RGB565 = 1
+
+    @property
+    def byte_count(self) -> int:
+        return 3 if self == PixelFormat.RGB888 else 2
+
+
+class Geometry(typing.NamedTuple):
+    slot_count: int
+    leds_per_spoke: int
+    spoke_count: int
+    inner_radius: float
+
+    def spoke_column(self, slot: int, spoke: int) -> int:
+        """The column spoke shows when spoke 0 is at slot."""
+        return (slot + spoke * self.slot_count // self.spoke_count) % self.slot_count
+
+
+def make_index_table(geometry: Geometry, height: int, width: int, supersample: int) -> numpy.ndarray:
+    """Returns the flat pixel index of each (slot, LED, sample) for height x width frames. Each slot
+    and LED is averaged over a supersample x supersample grid across its angle and radius. The wheel
+    is centered on the frame and touches its shorter sides.
+    """
+    # Sample positions at the centers of sub-cells, in units of slots and LEDs
+    offsets = (numpy.arange(supersample) + 0.5) / supersample
+    angles = (numpy.arange(geometry.slot_count)[:, None] + offsets) / geometry.slot_count * 2 * numpy.pi
+    # LED centers run from inner_radius to 1, with cells half a spacing either side
+    spacing = (1 - geometry.inner_radius) / max(geometry.leds_per_spoke - 1, 1)
+    leds = numpy.arange(geometry.leds_per_spoke)[:, None] + offsets - 0.5
+    radii = geometry.inner_radius + leds * spacing
+
+    # (slot, LED, angle sample, radius sample)
+    angles = angles[:, None, :, None]
+    radii = numpy.clip(radii, 0.0, 1.0)[None, :, None, :]
+    scale = (min(height, width) - 1) / 2
+    rows = numpy.rint((height - 1) / 2 - numpy.cos(angles) * radii * scale).astype(numpy.intp)
+    columns = numpy.rint((width - 1) / 2 + numpy.sin(angles) * radii * scale).astype(numpy.intp)
+    return (rows * width + columns).reshape(geometry.slot_count, geometry.leds_per_spoke, -1)
+
+
+def compile_frames(frames: numpy.ndarray, index_table: numpy.ndarray) -> numpy.ndarray:
+    """Converts (frame, row, column, RGB) frames to (frame, slot, LED, RGB) columns."""
+    samples = frames.reshape(len(frames), -1, 3)[:, index_table]
+    sample_count = index_table.shape[-1]
+    if sample_count == 1:
+        return samples[:, :, :, 0]
+    # Round to nearest. Sum as uint32, since 255 * sample_count overflows uint16 from supersample 17
+    return ((samples.sum(axis=3, dtype=numpy.uint32) + sample_count // 2) // sample_count).astype(numpy.uint8)
+
+
+def encode(columns: numpy.ndarray, pixel_format: PixelFormat) -> bytes:
+    if pixel_format == PixelFormat.RGB888:
+        return columns.tobytes()
+    red, green, blue = (columns[..., channel].astype(numpy.uint16) for channel in range(3))
+    packed = (red >> 3) << 11 | (green >> 2) << 5 | blue >> 3
+    return packed.astype("<u2").tobytes()
+
+
+def write_header(file: typing.BinaryIO, geometry: Geometry, pixel_format: PixelFormat, frame_ms: int) -> None:
+    file.write(geometry.slot_count.to_bytes(2, "little"))
+    file.write(geometry.leds_per_spoke.to_bytes(1, "little"))
+    file.write(pixel_format.value.to_bytes(1, "little"))
+    file.write(frame_ms.to_bytes(2, "little"))
+
+
+def read_batches(path: str) -> typing.Iterator[typing.Tuple[numpy.ndarray, float]]:
+    """Yields batches of RGB frames and the frame rate. Images are one frame, with a frame rate of 0."""
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    batch = []
+    while True:
+        success, image = capture.read()
+        if success:
+            # OpenCV stores pixels as BGR
+            batch.append(image[:, :, ::-1])
+        if batch and (not success or len(batch) == BATCH_SIZE):
+            yield numpy.stack(batch), fps
+            batch = []
+        if not success:
+            return
+
+
+def print_budget(geometry: Geometry, pixel_format: PixelFormat, rpm: float, frame_ms: int, frame_count: int) -> None:
+    frame_bytes = geometry.slot_count * geometry.leds_per_spoke * pixel_format.byte_count
+    revolutions_per_s = rpm / 60
+    slot_us = 1e6 / revolutions_per_s / geometry.slot_count
+    print(f"{frame_count} frames of {frame_bytes} bytes, {frame_count * frame_bytes / 1024:0.1f} KiB")
+    print(
+        f"At {rpm:g} rpm a slot lasts {slot_us:0.0f} us, and each of the {geometry.spoke_count} spokes"
+        f" reads {geometry.leds_per_spoke * pixel_format.byte_count} bytes per slot,"
+        f" {frame_bytes * geometry.spoke_count * revolutions_per_s / 1024:0.1f} KiB/s from the current frame"
+    )
+    if frame_ms > 0:
+        print(f"Streaming a new frame every {frame_ms} ms reads {frame_bytes * 1000 / frame_ms / 1024:0.1f} KiB/s from flash")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Compiles images and videos to persistence of vision columns for the spokes.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("input", nargs="?", help="Image or video to compile")
+    parser.add_argument("--out", "-o", type=str, help="Output file name, defaults to the input with .pov")
+    parser.add_argument("--slots", type=int, default=DEFAULT_SLOT_COUNT, help="Angle slots per revolution")
+    parser.add_argument("--spokes", type=int, default=DEFAULT_SPOKE_COUNT, help="Spokes with LEDs")
+    parser.add_argument("--leds", type=int, default=DEFAULT_LEDS_PER_SPOKE, help="LEDs per spoke")
+    parser.add_argument(
+        "--inner-radius", type=float, default=DEFAULT_INNER_RADIUS, help="Innermost LED radius, as a fraction of the outermost"
+    )
+    parser.add_argument(
+        "--supersample", type=int, default=DEFAULT_SUPERSAMPLE, help="Samples averaged per slot and LED, in each direction"
+    )
+    parser.add_argument("--rgb565", action="store_true", help="Store 2 byte RGB565 pixels instead of RGB888")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="Wheel speed to budget for")
+    parser.add_argument(
+        "--benchmark", type=int, metavar="FRAMES", help="Time compiling this many random frames instead of reading input"
+    )
+    parser.add_argument("--size", type=int, default=480, help="Frame height and width for --benchmark")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if min(args.slots, args.spokes, args.leds, args.supersample) < 1:
+        print_error("Slots, spokes, LEDs and supersample should be positive")
+    if args.slots % args.spokes != 0:
+        print_error(f"Slots should be a multiple of spokes, {args.spokes}")
+    if not 0 <= args.inner_radius <= 1:
+        print_error(f"Inner radius should be 0-1, got {args.inner_radius}")
+    geometry = Geometry(args.slots, args.leds, args.spokes, args.inner_radius)
+    pixel_format = PixelFormat.RGB565 if args.rgb565 else PixelFormat.RGB888
+
+    if args.benchmark is not None:
+        rng = numpy.random.default_rng(0)
+        frames = rng.integers(0, 256, (min(args.benchmark, BATCH_SIZE), args.size, args.size, 3), dtype=numpy.uint8)
+        start = time.perf_counter()
+        index_table = make_index_table(geometry, args.size, args.size, args.supersample)
+        table_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for done in range(0, args.benchmark, len(frames)):
+            encode(compile_frames(frames[: args.benchmark - done], index_table), pixel_format)
+        elapsed_s = time.perf_counter() - start
+        print(f"Index table: {table_s * 1000:0.1f} ms")
+        print(
+            f"Compiled {args.benchmark} {args.size}x{args.size} frames in {elapsed_s:0.3f} s,"
+            f" {args.benchmark / elapsed_s:0.0f} frames/s"
+        )
+        print_budget(geometry, pixel_format, args.rpm, 0, args.benchmark)
+        return
+
+    if args.input is None:
+        print_error("Input is required, unless benchmarking")
+    if not has_cv2:
+        print_error("Reading images needs OpenCV: pip3 install opencv-python")
+    if not pathlib.Path(args.input).exists():
+        print_error(f"No file {args.input}")
+    output = pathlib.Path(args.out) if args.out else pathlib.Path(args.input).with_suffix(".pov")
+    if output.exists():
+        print_error(f"{output} already exists")
+
+    frame_count = 0
+    frame_ms = 0
+    index_table = None
+    start = time.perf_counter()
+    try:
+        with open(output, "wb") as file:
+            for frames, fps in read_batches(args.input):
+                if index_table is None:
+                    index_table = make_index_table(geometry, frames.shape[1], frames.shape[2], args.supersample)
+                    frame_ms = int(1000 / fps) if fps > 0 else 0
+                    write_header(file, geometry, pixel_format, frame_ms)
+                file.write(encode(compile_frames(frames, index_table), pixel_format))
+                frame_count += len(frames)
+    except Exception:
+        output.unlink()
+        raise
+    if frame_count == 0:
+        output.unlink()
+        print_error(f"Couldn't read any frames from {args.input}")
+    print(f"Wrote {output} in {time.perf_counter() - start:0.2f} s")
+    print_budget(geometry, pixel_format, args.rpm, frame_ms, frame_count)
+
+
+if __name__ == "__main__":
+    main()
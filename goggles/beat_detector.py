@@ -0,0 +1,272 @@
+"""Python port of the beat detector from beatDetector.cpp, for tuning it offline.
+
+Runs the bass, envelope and beat filters over whole recordings at once with lfilter, carrying the
+filter state between calls so recordings can also be fed in chunks. The peak tracking from
+_beatDetected only runs once per FILTER_SAMPLES samples, so it stays a plain loop. Uses scipy if
+it's installed, otherwise falls back to a much slower pure Python filter.
+"""
+
+import argparse
+import dataclasses
+import subprocess
+import sys
+import typing
+
+import numpy
+
+has_scipy = False
+try:
+    import scipy.signal
+
+    has_scipy = True
+except:
+    pass
+
+# These match beatDetector.cpp
+SAMPLE_RATE_HZ = 5000
+FILTER_SAMPLES = 200
+THRESHOLD = 5
+MINIMUM_PEAK_INTERVAL = 9
+MAXIMUM_PEAK_INTERVAL = 18
+MISSES_BEFORE_RESET = 5
+DEFAULT_PEAK_INTERVAL = 14
+# analogRead is 10 bits, centered around 503
+ADC_MAX_VALUE = 512
+BEATS_PER_SECOND = SAMPLE_RATE_HZ / FILTER_SAMPLES
+
+# (b, a) lfilter coefficients for each difference equation
+# 20 - 200 hz bandpass
+BASS_FILTER = ([1 / 3, 0.0, -1 / 3], [1.0, -1.7903124146, 0.7960060012])
+# 10 hz lowpass
+ENVELOPE_FILTER = ([1 / 50, 1 / 50], [1.0, -0.9875119299])
+# 1.7 - 3.0 hz bandpass
+BEAT_FILTER = ([1 / 2.7, 0.0, -1 / 2.7], [1.0, -1.4453653501, 0.7169861741])
+
+
+def interval_to_bpm(interval: float) -> float:
+    """Converts a peak interval in beat levels to BPM."""
+    return BEATS_PER_SECOND * 60 / interval
+
+
+def python_lfilter(
+    b: typing.Sequence[float], a: typing.Sequence[float], x: numpy.ndarray, zi: numpy.ndarray
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Same as scipy.signal.lfilter with a normalized a and zi, one sample at a time."""
+    order = len(zi)
+    b = list(b) + [0.0] * (order + 1 - len(b))
+    a = list(a) + [0.0] * (order + 1 - len(a))
+    z = zi.tolist()
+    output = []
+    for sample in x.tolist():
+        y = b[0] * sample + z[0]
+        for i in range(order - 1):
+            z[i] = b[i + 1] * sample + z[i + 1] - a[i + 1] * y
+        z[order - 1] = b[order] * sample - a[order] * y
+        output.append(y)
+    return numpy.array(output), numpy.array(z)
+
+
+def lfilter(
+    coefficients: typing.Tuple[typing.List[float], typing.List[float]],
+    x: numpy.ndarray,
+    zi: numpy.ndarray,
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Filters x starting from the state zi. Returns the output and the final state."""
+    b, a = coefficients
+    if has_scipy:
+        return scipy.signal.lfilter(b, a, x, zi=zi)
+    return python_lfilter(b, a, x, zi)
+
+
+@dataclasses.dataclass
+class FilterState:
+    """The state that the filters keep in statics between samples."""
+    bass_zi: numpy.ndarray
+    envelope_zi: numpy.ndarray
+    beat_zi: numpy.ndarray
+    # How many samples into the current block of FILTER_SAMPLES the next sample is
+    block_offset: int = 0
+
+
+def init_filters() -> FilterState:
+    """Returns filters that haven't seen any samples yet, like after boot."""
+    return FilterState(
+        bass_zi=numpy.zeros(len(BASS_FILTER[1]) - 1),
+        envelope_zi=numpy.zeros(len(ENVELOPE_FILTER[1]) - 1),
+        beat_zi=numpy.zeros(len(BEAT_FILTER[1]) - 1),
+    )
+
+
+def beat_levels(state: FilterState, samples: numpy.ndarray) -> numpy.ndarray:
+    """Batched getBeat. samples are ADC values already centered around 0, at SAMPLE_RATE_HZ.
+    Returns one int16 beat level for every FILTER_SAMPLES samples. Any samples left over at the
+    end are carried into the next call.
+    """
+    bass, state.bass_zi = lfilter(BASS_FILTER, samples.astype(numpy.float64), state.bass_zi)
+    envelope, state.envelope_zi = lfilter(ENVELOPE_FILTER, numpy.abs(bass), state.envelope_zi)
+
+    # Only the envelope at the end of each block goes through the beat filter
+    first_end = FILTER_SAMPLES - 1 - state.block_offset
+    block_envelopes = envelope[first_end::FILTER_SAMPLES]
+    state.block_offset = (state.block_offset + len(samples)) % FILTER_SAMPLES
+    beat, state.beat_zi = lfilter(BEAT_FILTER, block_envelopes, state.beat_zi)
+
+    # static_cast<beatLevel_t> truncates toward 0
+    limits = numpy.iinfo(numpy.int16)
+    return numpy.clip(numpy.trunc(beat), limits.min, limits.max).astype(numpy.int16)
+
+
+@dataclasses.dataclass
+class DetectorState:
+    """The state that _beatDetected and beatDetected keep in statics and globals."""
+    previous_beat: int = 0
+    increasing: bool = False
+    peak_interval: int = DEFAULT_PEAK_INTERVAL
+    samples_since_last_peak: int = MINIMUM_PEAK_INTERVAL
+    missed_peaks: int = MISSES_BEFORE_RESET
+    looking_for_next_peak: bool = False
+    beats_since_last_detected: int = 0
+
+
+def _beat_detected(state: DetectorState, current_beat: int, threshold: int) -> bool:
+    """Port of _beatDetected, including the uint8_t wraparound."""
+    state.samples_since_last_peak = (state.samples_since_last_peak + 1) & 0xFF
+
+    if state.missed_peaks >= MISSES_BEFORE_RESET:
+        # Missed too many peaks - start over
+        if state.increasing and current_beat < state.previous_beat and current_beat >= threshold:
+            if state.looking_for_next_peak:
+                state.peak_interval = state.samples_since_last_peak
+                state.looking_for_next_peak = False
+                state.samples_since_last_peak = 0
+                state.missed_peaks = 0
+                return True
+            elif MINIMUM_PEAK_INTERVAL <= state.samples_since_last_peak <= MAXIMUM_PEAK_INTERVAL:
+                state.peak_interval = state.samples_since_last_peak
+                state.looking_for_next_peak = True
+                state.samples_since_last_peak = 0
+                return True
+        elif state.looking_for_next_peak and state.samples_since_last_peak > MAXIMUM_PEAK_INTERVAL:
+            state.looking_for_next_peak = False
+            state.samples_since_last_peak = 0
+        return False
+
+    # We only check for peaks around peakInterval
+    if state.peak_interval - 2 <= state.samples_since_last_peak <= state.peak_interval + 3:
+        if state.increasing and current_beat < state.previous_beat:
+            state.missed_peaks = 0
+            if state.peak_interval < state.samples_since_last_peak:
+                state.peak_interval += 1
+            elif state.peak_interval > state.samples_since_last_peak:
+                state.peak_interval -= 1
+            state.samples_since_last_peak = 1
+            return True
+        return False
+    elif state.samples_since_last_peak > state.peak_interval + 3:
+        state.samples_since_last_peak = 4
+
+    # If we miss a peak, just pretend we found one
+    if state.samples_since_last_peak == state.peak_interval:
+        state.missed_peaks += 1
+        return True
+    return False
+
+
+def detect_beats(
+    state: DetectorState, levels: numpy.ndarray, threshold: int = THRESHOLD
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """Batched beatDetected. Returns whether a beat was detected for each beat level, and the
+    peak interval that the detector was tracking after each one.
+    """
+    detected = numpy.zeros(len(levels), dtype=bool)
+    peak_intervals = numpy.zeros(len(levels), dtype=numpy.uint8)
+    for i, current_beat in enumerate(levels.tolist()):
+        found = _beat_detected(state, current_beat, threshold)
+        state.increasing = current_beat > state.previous_beat
+        state.previous_beat = current_beat
+
+        # Avoid double counting optimistic beats that are followed by a real peak
+        if found and state.beats_since_last_detected >= MINIMUM_PEAK_INTERVAL:
+            state.beats_since_last_detected = 0
+            detected[i] = True
+        else:
+            state.beats_since_last_detected = (state.beats_since_last_detected + 1) & 0xFFFF
+        peak_intervals[i] = state.peak_interval
+    return detected, peak_intervals
+
+
+def estimate_bpm(detected: numpy.ndarray) -> typing.Optional[float]:
+    """Returns the BPM from the median interval between detected beats, ignoring intervals
+    outside of MINIMUM_PEAK_INTERVAL and MAXIMUM_PEAK_INTERVAL. None if there aren't any.
+    """
+    intervals = numpy.diff(numpy.flatnonzero(detected))
+    intervals = intervals[(MINIMUM_PEAK_INTERVAL <= intervals) & (intervals <= MAXIMUM_PEAK_INTERVAL)]
+    if len(intervals) == 0:
+        return None
+    return interval_to_bpm(float(numpy.median(intervals)))
+
+
+def load_audio(path: str) -> numpy.ndarray:
+    """Decodes any audio file via ffmpeg, and scales it to centered ADC values."""
+    command = [
+        "ffmpeg", "-loglevel", "error", "-i", path, "-f", "s16le", "-ar", str(SAMPLE_RATE_HZ), "-ac", "1", "-"
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    if len(result.stdout) == 0:
+        raise ValueError(f"ffmpeg produced no output for: {path}")
+    samples = numpy.frombuffer(result.stdout, dtype=numpy.int16)
+    return samples * (ADC_MAX_VALUE / 32768)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Runs the goggles beat detector over audio files.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("audio_files", nargs="+", help="Audio files, anything ffmpeg can decode")
+    parser.add_argument(
+        "--threshold",
+        "-t",
+        type=int,
+        nargs="+",
+        default=[THRESHOLD],
+        help="Beat level thresholds to try",
+    )
+    parser.add_argument(
+        "--gain",
+        "-g",
+        type=float,
+        default=1.0,
+        help="Multiplier for the audio, for microphones that are louder or quieter than a full scale recording",
+    )
+    parser.add_argument("--beats", "-b", action="store_true", help="Print the time of every beat")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+    if not has_scipy:
+        sys.stderr.write("Warning: scipy isn't installed, so filtering will be slow\n")
+
+    for audio_file in args.audio_files:
+        samples = load_audio(audio_file) * args.gain
+        levels = beat_levels(init_filters(), samples)
+        seconds = len(samples) / SAMPLE_RATE_HZ
+        for threshold in args.threshold:
+            detected, peak_intervals = detect_beats(DetectorState(), levels, threshold)
+            bpm = estimate_bpm(detected)
+            bpm_text = f"{bpm:0.1f} BPM" if bpm is not None else "no BPM"
+            tracked_bpm = interval_to_bpm(float(numpy.median(peak_intervals))) if len(levels) > 0 else 0
+            print(
+                f"{audio_file}: threshold {threshold}, {detected.sum()} beats in {seconds:0.1f} s,"
+                f" {bpm_text}, {tracked_bpm:0.1f} BPM tracked"
+            )
+            if args.beats:
+                for index in numpy.flatnonzero(detected):
+                    print(f"  {(index + 1) / BEATS_PER_SECOND:0.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Python reference for the ArtNet packet parsing in artnetReceiver.cpp, with a fuzz and throughput
+harness.
+
+ArtDmx data is copied straight from the packet into a preallocated pixel buffer with memoryview
+slices, like handleArtDmx copies into artnetPixels. The harness fires well formed and malformed
+packets through the parser, checks that each one changes exactly the pixels it should, and reports
+packets per second, to budget for more universes or higher frame rates.
+
+Usage: python3 artnet_parser.py [--packets N] [--malformed FRACTION] [--fps N]
+"""
+
+import argparse
+import collections
+import enum
+import struct
+import sys
+import time
+import typing
+
+import numpy
+
+from artnet_test import LEDS_PER_STRIP, STRIP_COUNT, artdmx_packet
+
+ARTNET_ID = b"Art-Net\x00"
+OPCODE_POLL = 0x2000
+OPCODE_DMX = 0x5000
+OPCODE_SYNC = 0x5200
+# artnetReceiverFunction reads into a 530 byte buffer, the largest valid ArtDmx, so anything
+# longer is truncated
+MAX_PACKET_SIZE = 18 + 512
+DMX_HEADER_SIZE = 18
+ARTNET_UNIVERSE_OFFSET = 0
+
+
+class Result(enum.Enum):
+    DMX = "dmx"
+    POLL = "poll"
+    SYNC = "sync"
+    NOT_ARTNET = "not artnet"
+    SHORT = "short"
+    BAD_UNIVERSE = "bad universe"
+    TRUNCATED = "truncated"
+    UNKNOWN_OPCODE = "unknown opcode"
+
+
+class Parser:
+    """Parses packets like artnetReceiverFunction and handleArtDmx. ArtSync is recognized, but like
+    the firmware, frames aren't held until one arrives.
+    """
+
+    def __init__(self, strip_count: int = STRIP_COUNT, leds_per_strip: int = LEDS_PER_STRIP) -> None:
+        self.strip_count = strip_count
+        self.leds_per_strip = leds_per_strip
+        # Row-major like artnetPixels: [strip * LEDS_PER_STRIP + led]
+        self.pixels = bytearray(strip_count * leds_per_strip * 3)
+        self.pixel_view = memoryview(self.pixels)
+        self.counts: typing.Counter[Result] = collections.Counter()
+
+    def parse(self, packet: bytes) -> Result:
+        result = self.parse_packet(memoryview(packet)[:MAX_PACKET_SIZE])
+        self.counts[result] += 1
+        return result
+
+    def parse_packet(self, view: memoryview) -> Result:
+        length = len(view)
+        if length < 10 or view[:8] != ARTNET_ID:
+            return Result.NOT_ARTNET
+        opcode = view[8] | view[9] << 8
+        if opcode == OPCODE_DMX:
+            if length < DMX_HEADER_SIZE:
+                return Result.SHORT
+            return self.parse_dmx(view)
+        if opcode == OPCODE_POLL:
+            return Result.POLL
+        if opcode == OPCODE_SYNC:
+            return Result.SYNC
+        return Result.UNKNOWN_OPCODE
+
+    def parse_dmx(self, view: memoryview) -> Result:
+        universe = view[14] | view[15] << 8
+        dmx_length = view[16] << 8 | view[17]
+        strip = universe - ARTNET_UNIVERSE_OFFSET
+        if not 0 <= strip < self.strip_count:
+            return Result.BAD_UNIVERSE
+        if len(view) < DMX_HEADER_SIZE + dmx_length:
+            return Result.TRUNCATED
+        byte_count = min(dmx_length // 3, self.leds_per_strip) * 3
+        start = strip * self.leds_per_strip * 3
+        self.pixel_view[start : start + byte_count] = view[DMX_HEADER_SIZE : DMX_HEADER_SIZE + byte_count]
+        return Result.DMX
+
+    def pixel_array(self) -> numpy.ndarray:
+        """The pixels as a (strip, LED, RGB) array, sharing memory with the buffer."""
+        return numpy.frombuffer(self.pixels, dtype=numpy.uint8).reshape(self.strip_count, self.leds_per_strip, 3)
+
+
+class Case(typing.NamedTuple):
+    packet: bytes
+    result: Result
+    # The strip and bytes it should write, for DMX
+    strip: int = -1
+    data: bytes = b""
+
+
+def header(opcode: int) -> bytes:
+    return ARTNET_ID + struct.pack("<H", opcode) + struct.pack(">H", 14)
+
+
+def dmx_with_length(universe: int, data: bytes, length: int) -> bytes:
+    """An ArtDmx packet whose Length field says length, whatever data actually is."""
+    return header(OPCODE_DMX) + b"\x00\x00" + struct.pack("<H", universe) + struct.pack(">H", length) + data
+
+
+def make_cases(count: int, malformed_fraction: float, rng: numpy.random.Generator) -> typing.List[Case]:
+    """Random packets, each with what the parser should do with it."""
+    max_bytes = LEDS_PER_STRIP * 3
+
+    def well_formed() -> Case:
+        universe = int(rng.integers(STRIP_COUNT))
+        length = int(rng.integers(0, 257)) * 2
+        data = rng.integers(0, 256, length, dtype=numpy.uint8).tobytes()
+        return Case(artdmx_packet(universe, data), Result.DMX, universe, data[: length // 3 * 3][:max_bytes])
+
+    def too_short() -> Case:
+        return Case(ARTNET_ID[: int(rng.integers(0, 10))], Result.NOT_ARTNET)
+
+    def bad_id() -> Case:
+        packet = bytearray(artdmx_packet(0, bytes(6)))
+        packet[int(rng.integers(8))] ^= 0xFF
+        return Case(bytes(packet), Result.NOT_ARTNET)
+
+    def short_dmx() -> Case:
+        return Case(artdmx_packet(0, b"")[: int(rng.integers(10, DMX_HEADER_SIZE))], Result.SHORT)
+
+    def bad_universe() -> Case:
+        universe = int(rng.integers(STRIP_COUNT, 1 << 15))
+        return Case(artdmx_packet(universe, bytes(30)), Result.BAD_UNIVERSE)
+
+    def length_too_long() -> Case:
+        data = bytes(int(rng.integers(0, 256)) * 2)
+        length = len(data) + int(rng.integers(1, 0x10000 - len(data)))
+        return Case(dmx_with_length(int(rng.integers(STRIP_COUNT)), data, length), Result.TRUNCATED)
+
+    def oversized() -> Case:
+        # More than 530 bytes are cut off by the receive buffer, so the Length no longer fits
+        data = bytes(int(rng.integers(513, 1400)))
+        return Case(dmx_with_length(int(rng.integers(STRIP_COUNT)), data, len(data)), Result.TRUNCATED)
+
+    def odd_length() -> Case:
+        # Odd and short lengths are allowed, and only whole pixels are copied
+        universe = int(rng.integers(STRIP_COUNT))
+        length = int(rng.integers(0, 512)) | 1
+        data = rng.integers(0, 256, length, dtype=numpy.uint8).tobytes()
+        return Case(dmx_with_length(universe, data, length), Result.DMX, universe, data[: length // 3 * 3][:max_bytes])
+
+    def poll() -> Case:
+        return Case(header(OPCODE_POLL) + b"\x00\x00", Result.POLL)
+
+    def sync() -> Case:
+        return Case(header(OPCODE_SYNC) + b"\x00\x00", Result.SYNC)
+
+    def unknown_opcode() -> Case:
+        opcode = int(rng.choice([0x2100, 0x5100, 0x9700, int(rng.integers(0x10000)) | 1]))
+        return Case(header(opcode) + bytes(int(rng.integers(0, 20))), Result.UNKNOWN_OPCODE)
+
+    malformed = (too_short, bad_id, short_dmx, bad_universe, length_too_long, oversized, odd_length, poll, sync, unknown_opcode)
+    cases = []
+    for is_malformed in rng.random(count) < malformed_fraction:
+        make = malformed[int(rng.integers(len(malformed)))] if is_malformed else well_formed
+        cases.append(make())
+    return cases
+
+
+def validate(cases: typing.List[Case]) -> typing.List[str]:
+    """Runs each case through a fresh parser state and checks that exactly the right pixels
+    changed. Returns a description of each failure.
+    """
+    parser = Parser()
+    pixels = parser.pixel_array()
+    failures = []
+    rng = numpy.random.default_rng(1)
+    for index, case in enumerate(cases):
+        # Random contents, so a copy of zeros over zeros isn't missed
+        pixels[:] = rng.integers(0, 256, pixels.shape, dtype=numpy.uint8)
+        expected = pixels.copy()
+        if case.result == Result.DMX:
+            expected.reshape(STRIP_COUNT, -1)[case.strip, : len(case.data)] = numpy.frombuffer(case.data, dtype=numpy.uint8)
+        try:
+            result = parser.parse(case.packet)
+        except Exception as error:
+            # e.g. memoryview refuses a copy that would run past the buffer
+            failures.append(f"case {index}: raised {error!r}")
+            continue
+        if result != case.result:
+            failures.append(f"case {index}: got {result.value}, expected {case.result.value}")
+        elif not numpy.array_equal(pixels, expected):
+            changed = numpy.argwhere(pixels != expected)
+            failures.append(f"case {index}: {len(changed)} wrong pixel bytes, first at {tuple(changed[0])}")
+    return failures
+
+
+def measure(cases: typing.List[Case], packet_count: int) -> typing.Tuple[float, typing.Counter[Result]]:
+    """Parses packet_count packets, cycling through cases. Returns packets per second."""
+    parser = Parser()
+    parse = parser.parse
+    packets = [case.packet for case in cases]
+    start = time.perf_counter()
+    for index in range(packet_count):
+        parse(packets[index % len(packets)])
+    return packet_count / (time.perf_counter() - start), parser.counts
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Fuzzes and times the reference ArtNet parser.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--packets", "-n", type=int, default=2_000_000, help="Packets to time")
+    parser.add_argument("--cases", type=int, default=20_000, help="Distinct packets to generate and validate")
+    parser.add_argument("--malformed", type=float, default=0.2, help="Fraction of malformed packets")
+    parser.add_argument("--fps", type=float, default=40, help="Frame rate to budget for")
+    parser.add_argument("--universes", type=int, default=STRIP_COUNT, help="Universes per frame to budget for")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if not 0 <= args.malformed <= 1:
+        print_error(f"Malformed fraction should be 0-1, got {args.malformed}")
+    if args.cases < 1 or args.packets < 1:
+        print_error("Cases and packets should be positive")
+
+    cases = make_cases(args.cases, args.malformed, numpy.random.default_rng(args.seed))
+    failures = validate(cases)
+    print(f"Validated {len(cases)} packets: {len(failures)} failures")
+    for failure in failures[:10]:
+        print(f"  {failure}")
+
+    packets_per_s, counts = measure(cases, args.packets)
+    print(f"Parsed {args.packets} packets: {packets_per_s:,.0f} packets/s, {1e6 / packets_per_s:0.2f} us/packet")
+    for result, count in counts.most_common():
+        print(f"  {result.value}: {count}")
+    needed = args.fps * args.universes
+    print(
+        f"{args.universes} universes at {args.fps:g} fps need {needed:,.0f} packets/s,"
+        f" a budget of {1e6 / needed:0.0f} us/packet, {packets_per_s / needed:0.0f}x headroom here"
+    )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,9 @@ const char kServiceUuid[] = "4ae65b9a-08d7-4f46-a6af-541ff52a4303";
 const char kConfigCharUuid[] = "e0edd272-e8d1-44d6-b594-58ad0382a5bf";
 
 // Wire message for a single-attribute update. Packed so its layout is exactly 3 bytes and matches
-// what the control page writes with DataView (no compiler-inserted padding to worry about).
+// what the control page writes with DataView (no compiler-inserted padding to worry about). A write
+// can carry several of these back to back, which are applied all-or-nothing, so a whole preset
+// lands in one write.
 #pragma pack(push, 1)
 struct BleConfigUpdate_t {
   uint8_t field; // BleConfigField
@@ -19,6 +21,12 @@ struct BleConfigUpdate_t {
 };
 #pragma pack(pop)
 
+// Without a bigger negotiated MTU, writes are limited to 20 bytes, i.e. 6 updates. Must stay in sync
+// with MAX_UPDATES_PER_WRITE in phonic-bloom-control.html and ble_config.py.
+constexpr int kMaxUpdatesPerWrite = 16;
+// ATT adds 3 bytes of header to each write
+constexpr uint16_t kMtu = kMaxUpdatesPerWrite * sizeof(BleConfigUpdate_t) + 3;
+
 portMUX_TYPE bleConfigMux = portMUX_INITIALIZER_UNLOCKED;
 // Holds the merged, last-known-good value of every attribute. Single-field writes update this in
 // place rather than replacing it wholesale, so fields the client hasn't sent yet keep their value.
@@ -91,24 +99,44 @@ bool applyFieldUpdate(uint8_t field, uint16_t value, BleConfigMessage_t& config)
 
 class ConfigWriteCallbacks : public BLECharacteristicCallbacks {
   void onWrite(BLECharacteristic* characteristic) override {
-    if (characteristic->getLength() != sizeof(BleConfigUpdate_t)) {
+    const size_t length = characteristic->getLength();
+    if (length == 0 || length % sizeof(BleConfigUpdate_t) != 0
+        || length > kMaxUpdatesPerWrite * sizeof(BleConfigUpdate_t)) {
       Serial.printf(
-        "Wrong BLE config message size: %d, expected %d\n",
-        characteristic->getLength(),
-        sizeof(BleConfigUpdate_t));
+        "Wrong BLE config message size: %d, expected a multiple of %d up to %d\n",
+        length,
+        sizeof(BleConfigUpdate_t),
+        kMaxUpdatesPerWrite * sizeof(BleConfigUpdate_t));
       return;
     }
 
-    BleConfigUpdate_t update;
-    memcpy(&update, characteristic->getData(), sizeof(BleConfigUpdate_t));
+    BleConfigUpdate_t updates[kMaxUpdatesPerWrite];
+    const int count = length / sizeof(BleConfigUpdate_t);
+    memcpy(updates, characteristic->getData(), length);
 
+    // Apply to a copy first, so a bad update leaves every field untouched
+    int rejected = -1;
     portENTER_CRITICAL(&bleConfigMux);
-    const bool applied = applyFieldUpdate(update.field, update.value, currentConfig);
-    if (applied) messagePending = true;
+    BleConfigMessage_t merged = currentConfig;
+    for (int i = 0; i < count; ++i) {
+      if (!applyFieldUpdate(updates[i].field, updates[i].value, merged)) {
+        rejected = i;
+        break;
+      }
+    }
+    if (rejected < 0) {
+      currentConfig = merged;
+      messagePending = true;
+    }
     portEXIT_CRITICAL(&bleConfigMux);
 
-    if (!applied) {
-      Serial.printf("Rejected BLE config update: field=%d value=%d\n", update.field, update.value);
+    if (rejected >= 0) {
+      Serial.printf(
+        "Rejected BLE config update %d of %d: field=%d value=%d\n",
+        rejected + 1,
+        count,
+        updates[rejected].field,
+        updates[rejected].value);
     }
   }
 };
@@ -119,6 +147,8 @@ ConfigWriteCallbacks configWriteCallbacks;
 
 void setupBleConfigService() {
   BLEDevice::init("Phonic Bloom config");
+  // Lets the client negotiate an MTU big enough for a full batch of updates
+  BLEDevice::setMTU(kMtu);
   BLEServer* server = BLEDevice::createServer();
   server->setCallbacks(&configServerCallbacks);
   BLEService* service = server->createService(kServiceUuid);
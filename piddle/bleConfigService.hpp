@@ -1,7 +1,7 @@
 #pragma once
 #include <stdint.h>
 
-// Identifies which single attribute a BLE config write is updating. Values must stay in sync with
+// Identifies which attribute a BLE config update is for. Values must stay in sync with
 // the FIELD map in phonic-bloom-control.html.
 enum class BleConfigField : uint8_t {
   Brightness = 0,
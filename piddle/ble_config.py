@@ -0,0 +1,518 @@
+"""Configures Phonic Bloom units over BLE, like phonic-bloom-control.html does.
+
+Each write is one or more packed 3 byte BleConfigUpdate_t {uint8 field, uint16 value} (see
+bleConfigService.cpp), which the unit applies all-or-nothing. Rapid changes to the same field are
+coalesced so only the latest value is sent, pending fields are batched into as few writes as the MTU
+allows, writes are pipelined instead of waiting for each one to finish, and presets are pushed to
+many units at once.
+
+Usage:
+    python3 ble_config.py scan                                   List nearby units, needs bleak
+    python3 ble_config.py set ADDRESS... brightness=40 rainbow=1
+    python3 ble_config.py push preset.json ADDRESS...            Preset saved by the control page
+    python3 ble_config.py fake-server --port 9000                Local stand in for a unit
+Addresses like tcp:127.0.0.1:9000 connect to a fake server instead of a BLE unit.
+"""
+
+import abc
+import argparse
+import asyncio
+import collections
+import json
+import struct
+import sys
+import time
+import typing
+
+has_bleak = False
+try:
+    import bleak
+
+    has_bleak = True
+except:
+    pass
+
+SERVICE_UUID = "4ae65b9a-08d7-4f46-a6af-541ff52a4303"
+CONFIG_CHAR_UUID = "e0edd272-e8d1-44d6-b594-58ad0382a5bf"
+UPDATE_STRUCT = struct.Struct("<BH")
+# Must stay in sync with kMaxUpdatesPerWrite in bleConfigService.cpp
+MAX_UPDATES_PER_WRITE = 16
+# ATT adds 3 bytes of header to each write
+ATT_HEADER_SIZE = 3
+
+# Must stay in sync with BleConfigField in bleConfigService.hpp, and the ranges with
+# applyFieldUpdate: name -> (field, min, max)
+FIELDS = {
+    "brightness": (0, 0, 100),
+    "sensitivity": (1, 0, 100),
+    "speed": (2, 0, 100),
+    "patternLength": (3, 5, 100),
+    "tileOffset": (4, 0, 100),
+    "rainbow": (5, 0, 1),
+    "normalizeBands": (6, 0, 1),
+    "rgbButton": (7, 0, 1),
+    "rgb": (8, 0, 0xFFFF),
+    "showConverterLeds": (9, 0, 1),
+}
+FIELD_NAMES = {field: name for name, (field, _minimum, _maximum) in FIELDS.items()}
+# Fields that make up a saved preset, the same as CONFIG_KEYS in the control page
+CONFIG_KEYS = (
+    "brightness",
+    "sensitivity",
+    "speed",
+    "patternLength",
+    "tileOffset",
+    "rainbow",
+    "normalizeBands",
+    "rgb",
+    "showConverterLeds",
+)
+# Same as currentConfig in bleConfigService.cpp
+DEFAULT_CONFIG = {
+    "brightness": 25,
+    "sensitivity": 25,
+    "speed": 60,
+    "patternLength": 70,
+    "tileOffset": 0,
+    "rainbow": 0,
+    "normalizeBands": 1,
+    "rgbButton": 0,
+    "rgb": 0,
+    "showConverterLeds": 0,
+}
+# The control page waits this long between writes
+DEFAULT_INTERVAL_S = 0.04
+DEFAULT_MAX_IN_FLIGHT = 4
+CONNECT_TIMEOUT_S = 10.0
+
+
+def validate(name: str, value: int) -> None:
+    if name not in FIELDS:
+        raise ValueError(f"Unknown field {name}, should be one of {', '.join(FIELDS)}")
+    _field, minimum, maximum = FIELDS[name]
+    if not minimum <= value <= maximum:
+        raise ValueError(f"{name} should be {minimum}-{maximum}, got {value}")
+
+
+def encode_update(name: str, value: int) -> bytes:
+    validate(name, value)
+    return UPDATE_STRUCT.pack(FIELDS[name][0], value)
+
+
+def encode_updates(updates: typing.List[typing.Tuple[str, int]]) -> bytes:
+    """Encodes (name, value) pairs as one write."""
+    if not 1 <= len(updates) <= MAX_UPDATES_PER_WRITE:
+        raise ValueError(f"A write should have 1-{MAX_UPDATES_PER_WRITE} updates, got {len(updates)}")
+    return b"".join(encode_update(name, value) for name, value in updates)
+
+
+def decode_updates(data: bytes) -> typing.List[typing.Tuple[int, int]]:
+    """Returns the (field, value) pairs in a write. Raises ValueError if data is the wrong size."""
+    if len(data) == 0 or len(data) % UPDATE_STRUCT.size or len(data) > MAX_UPDATES_PER_WRITE * UPDATE_STRUCT.size:
+        raise ValueError(
+            f"Wrong BLE config message size: {len(data)}, expected a multiple of {UPDATE_STRUCT.size}"
+            f" up to {MAX_UPDATES_PER_WRITE * UPDATE_STRUCT.size}"
+        )
+    return list(UPDATE_STRUCT.iter_unpack(data))
+
+
+def apply_field_update(field: int, value: int, config: typing.Dict[str, int]) -> bool:
+    """Same as applyFieldUpdate in bleConfigService.cpp. Returns False, and leaves config alone, if
+    the field is unknown or the value is out of range.
+    """
+    name = FIELD_NAMES.get(field)
+    if name is None:
+        return False
+    _field, minimum, maximum = FIELDS[name]
+    if not minimum <= value <= maximum:
+        return False
+    config[name] = value
+    return True
+
+
+def apply_updates(updates: typing.List[typing.Tuple[int, int]], config: typing.Dict[str, int]) -> bool:
+    """Same as the onWrite merge into currentConfig in bleConfigService.cpp: either every update is
+    applied, in order, or none are.
+    """
+    merged = dict(config)
+    for field, value in updates:
+        if not apply_field_update(field, value, merged):
+            return False
+    config.update(merged)
+    return True
+
+
+def load_preset(path: str) -> typing.Dict[str, int]:
+    """Loads a preset, a JSON object like the one the control page saves."""
+    with open(path) as file:
+        preset = json.load(file)
+    if not isinstance(preset, dict):
+        raise ValueError(f"{path} should contain a JSON object")
+    unknown = set(preset) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown preset keys: {', '.join(sorted(unknown))}")
+    for name, value in preset.items():
+        if not isinstance(value, int):
+            raise ValueError(f"{name} should be an integer, got {value!r}")
+        validate(name, value)
+    return preset
+
+
+class Transport(abc.ABC):
+    """How a client reaches one unit. write may be called again before earlier writes finish."""
+
+    # How many updates fit in one write, which can depend on the MTU once connected
+    max_updates_per_write = MAX_UPDATES_PER_WRITE
+
+    @abc.abstractmethod
+    async def connect(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def write(self, data: bytes) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def disconnect(self) -> None:
+        pass
+
+
+class BleakTransport(Transport):
+    """A unit over BLE, with writes without response, like the control page."""
+
+    def __init__(self, address: str) -> None:
+        self.client = bleak.BleakClient(address, timeout=CONNECT_TIMEOUT_S)
+
+    async def connect(self) -> None:
+        await self.client.connect()
+        mtu_updates = (self.client.mtu_size - ATT_HEADER_SIZE) // UPDATE_STRUCT.size
+        self.max_updates_per_write = max(1, min(MAX_UPDATES_PER_WRITE, mtu_updates))
+
+    async def write(self, data: bytes) -> None:
+        await self.client.write_gatt_char(CONFIG_CHAR_UUID, data, response=False)
+
+    async def disconnect(self) -> None:
+        await self.client.disconnect()
+
+
+class SocketTransport(Transport):
+    """A fake server from run_fake_server over TCP. Each write is sent with a length byte and
+    acknowledged in order, so many can be outstanding at once.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self.acknowledgements: typing.Deque[asyncio.Future] = collections.deque()
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT_S
+        )
+        self.read_task = asyncio.get_running_loop().create_task(self.read_acknowledgements())
+
+    async def read_acknowledgements(self) -> None:
+        try:
+            while True:
+                status = await self.reader.readexactly(1)
+                self.acknowledgements.popleft().set_result(status == b"\x01")
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            while self.acknowledgements:
+                self.acknowledgements.popleft().set_exception(ConnectionError(str(error)))
+
+    async def write(self, data: bytes) -> None:
+        acknowledgement = asyncio.get_running_loop().create_future()
+        self.acknowledgements.append(acknowledgement)
+        self.writer.write(bytes([len(data)]) + data)
+        await self.writer.drain()
+        if not await acknowledgement:
+            raise ValueError(f"Rejected BLE config updates: {decode_updates(data)}")
+
+    async def disconnect(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.read_task.cancel()
+
+
+def make_transport(address: str) -> Transport:
+    if address.startswith("tcp:"):
+        host, port = address[len("tcp:") :].rsplit(":", 1)
+        return SocketTransport(host, int(port))
+    if not has_bleak:
+        raise RuntimeError("bleak is required for BLE addresses")
+    return BleakTransport(address)
+
+
+class ConfigClient:
+    """Sends field updates to one unit. Setting a field that hasn't been sent yet replaces the
+    pending value, so only the latest one goes out. Pending fields are batched into writes of up to
+    max_updates_per_write, which is 1 for firmware from before batching. Writes are pipelined, up to
+    max_in_flight at a time, but a field is never written again while its last write is still in
+    flight, so updates can't arrive out of order.
+    """
+
+    def __init__(
+        self,
+        transport: Transport,
+        interval_s: float = DEFAULT_INTERVAL_S,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_updates_per_write: int = MAX_UPDATES_PER_WRITE,
+    ) -> None:
+        self.transport = transport
+        self.interval_s = interval_s
+        self.max_updates_per_write = max_updates_per_write
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.pending: typing.Dict[str, int] = {}
+        self.in_flight: typing.Set[str] = set()
+        self.tasks: typing.Set[asyncio.Task] = set()
+        self.errors: typing.List[BaseException] = []
+        self.flush_task: typing.Optional[asyncio.Task] = None
+        self.writes = 0
+        self.updates = 0
+        self.coalesced = 0
+
+    async def __aenter__(self) -> "ConfigClient":
+        await self.transport.connect()
+        return self
+
+    async def __aexit__(self, *exception_info) -> None:
+        try:
+            if exception_info[0] is None:
+                await self.flush()
+        finally:
+            await self.transport.disconnect()
+
+    def set(self, name: str, value: int) -> None:
+        validate(name, value)
+        if name in self.pending:
+            self.coalesced += 1
+        self.pending[name] = value
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush_later())
+
+    def update(self, config: typing.Dict[str, int]) -> None:
+        for name, value in config.items():
+            self.set(name, value)
+
+    async def flush_later(self) -> None:
+        """Batches up changes for interval_s, like scheduleWrite in the control page."""
+        await asyncio.sleep(self.interval_s)
+        await self.send_pending()
+
+    async def send_pending(self) -> None:
+        while True:
+            ready = [name for name in self.pending if name not in self.in_flight]
+            if not ready:
+                return
+            await self.slots.acquire()
+            # Another flush may have sent some of them while we waited
+            batch_size = min(self.max_updates_per_write, self.transport.max_updates_per_write)
+            names = [name for name in self.pending if name not in self.in_flight][:batch_size]
+            if not names:
+                self.slots.release()
+                return
+            updates = [(name, self.pending.pop(name)) for name in names]
+            self.in_flight.update(names)
+            task = asyncio.get_running_loop().create_task(self.send(updates))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, updates: typing.List[typing.Tuple[str, int]]) -> None:
+        try:
+            await self.transport.write(encode_updates(updates))
+            self.writes += 1
+            self.updates += len(updates)
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            self.in_flight.difference_update(name for name, _value in updates)
+            self.slots.release()
+
+    async def flush(self) -> None:
+        """Sends everything that's pending and waits for it. Raises the first write error."""
+        while self.pending or self.tasks:
+            await self.send_pending()
+            if self.tasks:
+                await asyncio.wait(set(self.tasks))
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+        if self.errors:
+            error, self.errors = self.errors[0], []
+            raise error
+
+
+async def configure(address: str, config: typing.Dict[str, int], **client_options) -> ConfigClient:
+    async with ConfigClient(make_transport(address), **client_options) as client:
+        client.update(config)
+    return client
+
+
+async def push(
+    addresses: typing.List[str], config: typing.Dict[str, int], **client_options
+) -> typing.List[typing.Union[ConfigClient, BaseException]]:
+    """Sends config to every unit at once. Returns each unit's client, or what went wrong."""
+    return await asyncio.gather(
+        *(configure(address, config, **client_options) for address in addresses),
+        return_exceptions=True,
+    )
+
+
+async def scan(timeout_s: float) -> None:
+    devices = await bleak.BleakScanner.discover(timeout=timeout_s, service_uuids=[SERVICE_UUID])
+    for device in devices:
+        print(f"{device.address} {device.name or ''}")
+    if not devices:
+        print("No units found")
+
+
+async def run_fake_server(host: str, port: int, latency_s: float) -> None:
+    """Accepts writes like bleConfigService.cpp does, and acknowledges each one after latency_s,
+    like a BLE round trip.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        config = dict(DEFAULT_CONFIG)
+        peer = writer.get_extra_info("peername")
+        print(f"{peer} connected")
+        previous = asyncio.sleep(0)
+
+        async def acknowledge(status: bytes, previous: typing.Awaitable) -> None:
+            await asyncio.sleep(latency_s)
+            # Acknowledgements have to go out in order
+            await previous
+            writer.write(status)
+
+        try:
+            while True:
+                length = (await reader.readexactly(1))[0]
+                data = await reader.readexactly(length)
+                try:
+                    updates = decode_updates(data)
+                    applied = apply_updates(updates, config)
+                    if not applied:
+                        print(f"Rejected BLE config updates: {updates}")
+                except ValueError as error:
+                    print(error)
+                    applied = False
+                previous = asyncio.ensure_future(acknowledge(b"\x01" if applied else b"\x00", previous))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        await previous
+        print(f"{peer} disconnected, config: {json.dumps(config)}")
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Fake unit listening on tcp:{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_assignment(text: str) -> typing.Tuple[str, int]:
+    name, _, value = text.partition("=")
+    if not value:
+        raise ValueError(f"Expected field=value, got {text}")
+    value_int = int(value, 0)
+    validate(name, value_int)
+    return name, value_int
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Configures Phonic Bloom units over BLE.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_S, help="Seconds to batch changes for")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Writes to pipeline per unit")
+    parser.add_argument(
+        "--max-updates-per-write",
+        type=int,
+        default=MAX_UPDATES_PER_WRITE,
+        help="Fields to batch into each write, 1 for firmware from before batching",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="List nearby units")
+    scan_parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to scan for")
+
+    set_parser = subparsers.add_parser("set", help="Set fields on units")
+    set_parser.add_argument("addresses", nargs="+", help="Unit addresses, then field=value assignments")
+
+    push_parser = subparsers.add_parser("push", help="Send a saved preset to units")
+    push_parser.add_argument("preset", help="JSON preset, as saved by the control page")
+    push_parser.add_argument("addresses", nargs="+", help="Unit addresses")
+
+    fake_parser = subparsers.add_parser("fake-server", help="Run a local stand in for a unit")
+    fake_parser.add_argument("--host", type=str, default="127.0.0.1")
+    fake_parser.add_argument("--port", type=int, default=9000)
+    fake_parser.add_argument("--latency-ms", type=float, default=30, help="Delay before acknowledging each write")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.interval < 0:
+        print_error(f"Interval should not be negative, got {args.interval}")
+    if args.max_in_flight < 1:
+        print_error(f"Max in flight should be positive, got {args.max_in_flight}")
+    if not 1 <= args.max_updates_per_write <= MAX_UPDATES_PER_WRITE:
+        print_error(f"Max updates per write should be 1-{MAX_UPDATES_PER_WRITE}, got {args.max_updates_per_write}")
+
+    if args.command == "fake-server":
+        try:
+            asyncio.run(run_fake_server(args.host, args.port, args.latency_ms / 1000))
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.command == "scan":
+        if not has_bleak:
+            print_error("bleak is required for scanning")
+        asyncio.run(scan(args.timeout))
+        return
+
+    if args.command == "set":
+        addresses = [argument for argument in args.addresses if "=" not in argument]
+        try:
+            config = dict(parse_assignment(argument) for argument in args.addresses if "=" in argument)
+        except ValueError as error:
+            print_error(str(error))
+        if not addresses or not config:
+            print_error("Specify at least one address and one field=value")
+    else:
+        addresses = args.addresses
+        try:
+            config = load_preset(args.preset)
+        except (OSError, ValueError) as error:
+            print_error(str(error))
+
+    start = time.time()
+    results = asyncio.run(
+        push(
+            addresses,
+            config,
+            interval_s=args.interval,
+            max_in_flight=args.max_in_flight,
+            max_updates_per_write=args.max_updates_per_write,
+        )
+    )
+    failed = False
+    for address, result in zip(addresses, results):
+        if isinstance(result, BaseException):
+            print(f"{address}: failed, {result}")
+            failed = True
+        else:
+            print(f"{address}: ok, {result.updates} updates in {result.writes} writes")
+    print(f"Configured {len(addresses)} units in {time.time() - start:0.2f} s")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Fits power_sim.py's hand picked constants to a voltage log from the voltage monitor.
+
+The log is read from a store made by voltageMonitor/telemetry.py and averaged per minute. Each
+candidate set of constants is simulated with the recorded relay state, so the fit only has to
+explain the battery, not the controller, and scored by the RMS error between simulated and recorded
+state of charge, as the monitor reports it. Candidates are simulated as numpy arrays, in chunks
+spread over processes, and refined with the cross-entropy method: each round samples around the
+best candidates of the last.
+
+Usage: python3 calibrate.py ../voltageMonitor/telemetry --battery-wh 2560
+"""
+
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+import typing
+
+import numpy
+
+import power_sim
+
+# The constants that are fit, with their power_sim defaults and search bounds
+PARAMETERS = {
+    "std_dev": (power_sim.DEFAULT_STD_DEV, (1.0, 4.0)),
+    "solar_derate": (power_sim.SOLAR_DERATE, (0.3, 1.1)),
+    "a_per_strip": (power_sim.DEFAULT_A_PER_STRIP, (0.1, 1.0)),
+    "arduino_w": (power_sim.ARDUINO_W, (0.0, 5.0)),
+    "internal_resistance_ohm": (power_sim.DEFAULT_INTERNAL_RESISTANCE_OHM, (0.0, 0.1)),
+}
+# Same as DEFAULT_W
+STRIP_COUNT = 15
+STRIP_V = 12
+DEFAULT_POPULATION = 256
+DEFAULT_ROUNDS = 10
+ELITE_FRACTION = 0.1
+CHUNK_SIZE = 64
+
+
+@dataclasses.dataclass
+class Recording:
+    """A voltage log, one value per minute."""
+
+    start_s: float
+    hours: numpy.ndarray  # Hour of the day, with fractions
+    on: numpy.ndarray  # Whether the strips were on
+    percent: numpy.ndarray  # State of charge reported by the monitor, NaN for missing minutes
+
+
+def load_recording(store_directory: str) -> Recording:
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "voltageMonitor"))
+    import telemetry
+
+    store = telemetry.Store(store_directory)
+    samples = store.samples.read()
+    events = store.events.read()
+    if len(samples["time_s"]) == 0:
+        raise ValueError(f"No readings in {store_directory}")
+
+    times = numpy.asarray(samples["time_s"])
+    start_s = times[0] // 60 * 60
+    minutes = ((times - start_s) // 60).astype(numpy.intp)
+    counts = numpy.bincount(minutes)
+    sums = numpy.bincount(minutes, weights=samples["battery_v"])
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        voltages = sums / counts
+    minute_s = start_s + numpy.arange(len(counts)) * 60
+    on = telemetry.relay_on_at({"time_s": minute_s + 30}, events)
+    return Recording(
+        start_s=start_s,
+        hours=minute_s % telemetry.SECONDS_PER_DAY / 3600,
+        on=on,
+        percent=numpy.where(counts > 0, power_sim.voltage_to_percent_array(voltages), numpy.nan),
+    )
+
+
+def simulate_errors(
+    recording: Recording, candidates: numpy.ndarray, battery_wh: float, rated_solar_w: float, max_charge_w: float
+) -> numpy.ndarray:
+    """Simulates every candidate, a row of PARAMETERS values, over the recording. Returns the RMS
+    error in percent for each.
+    """
+    std_dev, solar_derate, a_per_strip, arduino_w, internal_resistance_ohm = candidates.T
+    project_w = a_per_strip * STRIP_COUNT * STRIP_V
+    solar_w = rated_solar_w * solar_derate
+
+    valid = ~numpy.isnan(recording.percent)
+    # Start from what the monitor said, ignoring any sag in the first reading
+    battery_wh_now = numpy.full(len(candidates), recording.percent[valid][0] / 100 * battery_wh)
+    squared_error = numpy.zeros(len(candidates))
+    for minute in range(len(recording.hours)):
+        load_w = (project_w if recording.on[minute] else 0.0) + arduino_w
+        charge_w = numpy.minimum(
+            power_sim.sunlight_percentage_array(recording.hours[minute], std_dev) * solar_w, max_charge_w
+        )
+        net_load_w = load_w - charge_w
+        battery_wh_now = numpy.clip(battery_wh_now - net_load_w / 60, 0.0, battery_wh)
+        if not valid[minute]:
+            continue
+        open_circuit_v = power_sim.percent_to_voltage_array(battery_wh_now / battery_wh * 100)
+        voltage = open_circuit_v - net_load_w / open_circuit_v * internal_resistance_ohm
+        squared_error += (power_sim.voltage_to_percent_array(voltage) - recording.percent[minute]) ** 2
+    return numpy.sqrt(squared_error / valid.sum())
+
+
+# Per worker state, set by init_worker
+_worker_state: typing.Dict[str, typing.Any] = {}
+
+
+def init_worker(recording: Recording, battery_wh: float, rated_solar_w: float, max_charge_w: float) -> None:
+    _worker_state["arguments"] = (recording, battery_wh, rated_solar_w, max_charge_w)
+
+
+def evaluate_chunk(candidates: numpy.ndarray) -> numpy.ndarray:
+    recording, battery_wh, rated_solar_w, max_charge_w = _worker_state["arguments"]
+    return simulate_errors(recording, candidates, battery_wh, rated_solar_w, max_charge_w)
+
+
+def fit(
+    recording: Recording,
+    battery_wh: float,
+    rated_solar_w: float,
+    max_charge_w: float,
+    population: int,
+    rounds: int,
+    processes: int,
+    seed: int = 0,
+) -> typing.Tuple[numpy.ndarray, float]:
+    """Returns the best candidate and its error."""
+    rng = numpy.random.default_rng(seed)
+    low, high = numpy.array([bounds for _default, bounds in PARAMETERS.values()]).T
+    defaults = numpy.array([default for default, _bounds in PARAMETERS.values()])
+    candidates = rng.uniform(low, high, (population, len(PARAMETERS)))
+    candidates[0] = defaults
+    elite_count = max(2, int(population * ELITE_FRACTION))
+    best, best_error = defaults, numpy.inf
+
+    initargs = (recording, battery_wh, rated_solar_w, max_charge_w)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=initargs)
+        evaluate = pool.map
+    else:
+        init_worker(*initargs)
+        pool = None
+        evaluate = lambda function, chunks: list(map(function, chunks))
+    try:
+        for round_index in range(rounds):
+            start = time.time()
+            chunks = [candidates[i : i + CHUNK_SIZE] for i in range(0, len(candidates), CHUNK_SIZE)]
+            errors = numpy.concatenate(evaluate(evaluate_chunk, chunks))
+            order = numpy.argsort(errors)
+            if errors[order[0]] < best_error:
+                best, best_error = candidates[order[0]], float(errors[order[0]])
+            print(f"Round {round_index + 1}: best error {best_error:0.3f}% in {time.time() - start:0.2f} s")
+
+            elite = candidates[order[:elite_count]]
+            candidates = rng.normal(elite.mean(axis=0), elite.std(axis=0) + 1e-6, (population, len(PARAMETERS)))
+            candidates = numpy.clip(candidates, low, high)
+            candidates[0] = best
+    finally:
+        if pool is not None:
+            pool.close()
+    return best, best_error
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Fits power_sim constants to a voltage monitor log.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("store", help="Store directory from voltageMonitor/telemetry.py")
+    parser.add_argument("--battery-wh", "-b", type=float, default=12.8 * 100 * 2, help="Battery capacity in Wh")
+    parser.add_argument("--rated-solar-w", type=float, default=power_sim.RATED_SOLAR_W, help="Rated solar panel power")
+    parser.add_argument("--max-charge-w", type=float, default=290, help="Max charge in W")
+    parser.add_argument("--population", "-n", type=int, default=DEFAULT_POPULATION, help="Candidates per round")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Refinement rounds")
+    parser.add_argument("--processes", "-j", type=int, default=os.cpu_count() or 1, help="Processes to simulate with")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--json", type=str, help="Also save the fitted constants as JSON")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.population < 2:
+        print_error(f"Population should be at least 2, got {args.population}")
+    if args.rounds < 1:
+        print_error(f"Rounds should be positive, got {args.rounds}")
+    if args.processes < 1:
+        print_error(f"Processes should be positive, got {args.processes}")
+    if not os.path.isdir(args.store):
+        print_error(f"No store at {args.store}")
+
+    try:
+        recording = load_recording(args.store)
+    except ValueError as error:
+        print_error(str(error))
+    valid_minutes = int((~numpy.isnan(recording.percent)).sum())
+    print(f"{valid_minutes} minutes of readings over {len(recording.hours) / 60:0.1f} hours")
+
+    simulation_arguments = (args.battery_wh, args.rated_solar_w, args.max_charge_w)
+    defaults = numpy.array([[default for default, _bounds in PARAMETERS.values()]])
+    default_error = float(simulate_errors(recording, defaults, *simulation_arguments)[0])
+    best, best_error = fit(
+        recording, *simulation_arguments, args.population, args.rounds, args.processes, args.seed
+    )
+
+    print(f"{'':>24} {'default':>8} {'fitted':>8}")
+    for name, default, value in zip(PARAMETERS, defaults[0], best):
+        print(f"{name:>24} {default:8.3f} {value:8.3f}")
+    print(f"{'RMS error %':>24} {default_error:8.3f} {best_error:8.3f}")
+    fitted = dict(zip(PARAMETERS, best.tolist()))
+    print(
+        "power_sim.py arguments:"
+        f" --std-dev {fitted['std_dev']:0.2f}"
+        f" --solar-w {args.rated_solar_w * fitted['solar_derate']:0.0f}"
+        f" -w {fitted['a_per_strip'] * STRIP_COUNT * STRIP_V:0.1f}"
+        f" --arduino-w {fitted['arduino_w']:0.2f}"
+        # The internal resistance only matters to the voltage model
+        f" --voltage-model --internal-resistance {fitted['internal_resistance_ohm']:0.3f}"
+    )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({**fitted, "rms_error_percent": best_error}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""NumPy port of the Phonic Bloom DSP pipeline, from sim/dsp.cpp and spectrumAnalyzer.cpp.
+
+Processes whole songs at once as a 2-D batch of frames instead of one SAMPLE_COUNT window at a
+time, so tuning can be run over hours of audio. Uses float32 like the ESP32 so the results match
+sim/dsp.cpp to within rounding.
+"""
+
+import argparse
+import dataclasses
+import subprocess
+import sys
+import time
+import typing
+
+import numpy
+
+from steps import make_note_buckets
+
+# These match sim/sim_constants.h
+SAMPLE_COUNT = 2048
+SAMPLE_RATE = 44100
+NOTE_TO_OUTPUT_INDEX = numpy.array(
+    make_note_buckets(SAMPLE_COUNT, SAMPLE_RATE, True).note_to_output_index, dtype=numpy.intp
+)
+NOTE_COUNT = len(NOTE_TO_OUTPUT_INDEX)
+# How many frames to run through the FFT at once. Bigger batches are faster, up to a point, but
+# use SAMPLE_COUNT * 16 bytes of memory per frame.
+DEFAULT_BATCH_SIZE = 1024
+
+
+def square(value):
+    return value * value
+
+
+def a_weighting_multiplier(frequency: numpy.ndarray, dtype: typing.Type = numpy.float32) -> numpy.ndarray:
+    """Returns the A-weighting power multiplier for each frequency. Computed in float32 like the
+    ESP32 unless another dtype is given.
+    """
+    frequency = frequency.astype(dtype)
+    freq_2 = square(frequency)
+    denom1 = freq_2 + square(dtype(20.6))
+    denom2 = numpy.sqrt((freq_2 + square(dtype(107.7))) * (freq_2 + square(dtype(737.9))))
+    denom3 = freq_2 + square(dtype(12194.0))
+    denom = denom1 * denom2 * denom3
+    enumer = square(freq_2) * square(dtype(12194.0))
+    ra = enumer / denom
+    a_weighting_db = dtype(2.0) + dtype(20.0) * numpy.log(ra) / numpy.log(dtype(10.0))
+    return numpy.power(dtype(10.0), a_weighting_db / dtype(10.0))
+
+
+def windowing_multiplier(
+    offset: numpy.ndarray, sample_count: int, dtype: typing.Type = numpy.float32
+) -> numpy.ndarray:
+    """Returns the Hamming window multiplier for each sample offset."""
+    a0 = dtype(0.53836)
+    angle = dtype(2.0 * numpy.pi) * offset.astype(dtype) / dtype(sample_count)
+    return a0 - (dtype(1.0) - a0) * numpy.cos(angle)
+
+
+@dataclasses.dataclass
+class DSPState:
+    sample_count: int
+    sample_rate: int
+    note_to_output_index: numpy.ndarray
+    windowing_constants: numpy.ndarray
+    weighting_constants: numpy.ndarray
+
+
+def init_dsp(
+    sample_count: int = SAMPLE_COUNT,
+    sample_rate: int = SAMPLE_RATE,
+    note_to_output_index: typing.Optional[numpy.ndarray] = None,
+) -> DSPState:
+    """Precomputes the window and A-weighting constants."""
+    if note_to_output_index is None:
+        note_to_output_index = numpy.array(
+            make_note_buckets(sample_count, sample_rate, True).note_to_output_index,
+            dtype=numpy.intp,
+        )
+    offsets = numpy.arange(sample_count)
+    # The ESP32 uses the frequency of the bucket above for weighting, so match it
+    frequencies = numpy.float32(sample_rate) / numpy.float32(sample_count) * (offsets + 1).astype(numpy.float32)
+    return DSPState(
+        sample_count=sample_count,
+        sample_rate=sample_rate,
+        note_to_output_index=note_to_output_index,
+        windowing_constants=windowing_multiplier(offsets, sample_count),
+        weighting_constants=a_weighting_multiplier(frequencies),
+    )
+
+
+def compute_power_spectra(state: DSPState, frames: numpy.ndarray) -> numpy.ndarray:
+    """Windows, FFTs and squares each frame. frames is (frame count, sample_count) int16. Returns
+    (frame count, sample_count) float32 in the same layout as output[] on the ESP32 before
+    weighting, which is power for the first half, followed by the raw FFT values from the second
+    half of output[] that powerOfTwo doesn't overwrite.
+    """
+    sample_count = state.sample_count
+    half = sample_count // 2
+    windowed = frames.astype(numpy.float32) * state.windowing_constants
+    spectrum = numpy.fft.rfft(windowed, axis=1)
+
+    # esp32-fft packs the real FFT as [DC, Nyquist, re(1), im(1), ..., re(n/2 - 1), im(n/2 - 1)]
+    output = numpy.empty((len(frames), sample_count), dtype=numpy.float32)
+    output[:, 0] = 0.0
+    output[:, 1] = 0.0
+    output[:, 2::2] = spectrum[:, 1:half].real
+    output[:, 3::2] = spectrum[:, 1:half].imag
+    output[:, sample_count - 1] = 0.0
+
+    # powerOfTwo only overwrites the first half
+    output[:, :half] = square(output[:, 0::2]) + square(output[:, 1::2])
+    return output
+
+
+def compute_spectra(state: DSPState, frames: numpy.ndarray) -> numpy.ndarray:
+    """compute_power_spectra, A-weighted. This is the same as output[] on the ESP32 right before
+    normalizeTo0_1.
+    """
+    output = compute_power_spectra(state, frames)
+    output *= state.weighting_constants
+    return output
+
+
+def minimum_divisor(sensitivity_p: int) -> numpy.float32:
+    return square(numpy.float32((130 - sensitivity_p) * 6000.0))
+
+
+def normalize_and_pool(
+    state: DSPState, spectra: numpy.ndarray, sensitivity_p: int
+) -> numpy.ndarray:
+    """Normalizes spectra from compute_spectra to [0..1] and takes the max of the buckets for each
+    note. Returns (frame count, note count) float32.
+    """
+    spectra = spectra - spectra.min(axis=1, keepdims=True)
+    divisor = numpy.maximum(spectra.max(axis=1, keepdims=True), minimum_divisor(sensitivity_p))
+    spectra *= numpy.float32(1.0) / divisor
+
+    # Each note is the max of its buckets up to the next note's first bucket. The last note only
+    # uses its first bucket, so cut the output off after it.
+    indexes = state.note_to_output_index
+    return numpy.maximum.reduceat(spectra[:, : indexes[-1] + 1], indexes, axis=1)
+
+
+def process_dsp(state: DSPState, frames: numpy.ndarray, sensitivity_p: int) -> numpy.ndarray:
+    """Batched processDSP. frames is (frame count, sample_count) int16. Returns (frame count,
+    note count) float32 note values in [0..1].
+    """
+    return normalize_and_pool(state, compute_spectra(state, frames), sensitivity_p)
+
+
+def load_audio(path: str, sample_rate: int = SAMPLE_RATE) -> numpy.ndarray:
+    """Decodes any audio file to 16-bit signed mono via ffmpeg, the same as sim/audio.cpp."""
+    command = [
+        "ffmpeg", "-loglevel", "error", "-i", path, "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-"
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    if len(result.stdout) == 0:
+        raise ValueError(f"ffmpeg produced no output for: {path}")
+    return numpy.frombuffer(result.stdout, dtype=numpy.int16)
+
+
+def frame_audio(samples: numpy.ndarray, hop: int, sample_count: int = SAMPLE_COUNT) -> numpy.ndarray:
+    """Returns a (frame count, sample_count) view of overlapping windows, hop samples apart. Like
+    the sim, each frame is the most recent sample_count samples.
+    """
+    if len(samples) < sample_count:
+        return numpy.empty((0, sample_count), dtype=samples.dtype)
+    windows = numpy.lib.stride_tricks.sliding_window_view(samples, sample_count)
+    return windows[::hop]
+
+
+def iterate_batches(
+    frames: numpy.ndarray, batch_size: int = DEFAULT_BATCH_SIZE
+) -> typing.Iterator[typing.Tuple[int, numpy.ndarray]]:
+    """Yields (first frame index, frames) batches, to bound the FFT memory use."""
+    for start in range(0, len(frames), batch_size):
+        yield start, frames[start : start + batch_size]
+
+
+def analyze(
+    state: DSPState,
+    samples: numpy.ndarray,
+    hop: int,
+    sensitivity_p: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> numpy.ndarray:
+    """Returns the (frame count, note count) note values for a whole song."""
+    frames = frame_audio(samples, hop, state.sample_count)
+    note_values = numpy.empty((len(frames), len(state.note_to_output_index)), dtype=numpy.float32)
+    for start, batch in iterate_batches(frames, batch_size):
+        note_values[start : start + len(batch)] = process_dsp(state, batch, sensitivity_p)
+    return note_values
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Runs the Phonic Bloom DSP pipeline over audio files.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("audio_files", nargs="+", help="Audio files, anything ffmpeg can decode")
+    parser.add_argument("--hop", type=int, default=1024, help="Samples between frames")
+    parser.add_argument("--sensitivity", "-s", type=int, default=50, help="Sensitivity, 0-100")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Frames per FFT batch")
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Save the note values as .npy. With multiple files, the file name is appended.",
+    )
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+    if not 0 <= args.sensitivity <= 100:
+        sys.stderr.write(f"Error: sensitivity should be 0-100, got {args.sensitivity}\n")
+        sys.exit(1)
+
+    state = init_dsp()
+    for audio_file in args.audio_files:
+        samples = load_audio(audio_file)
+        start = time.time()
+        note_values = analyze(state, samples, args.hop, args.sensitivity, args.batch_size)
+        elapsed = time.time() - start
+        song_seconds = len(samples) / SAMPLE_RATE
+        print(
+            f"{audio_file}: {len(note_values)} frames, {song_seconds:0.1f} s of audio in"
+            f" {elapsed:0.2f} s ({song_seconds / max(elapsed, 1e-9):0.0f}x real time)"
+        )
+        if args.output:
+            output = args.output
+            if len(args.audio_files) > 1:
+                output = f"{output}.{audio_file.replace('/', '_')}.npy"
+            numpy.save(output, note_values)
+
+
+if __name__ == "__main__":
+    main()
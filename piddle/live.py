@@ -0,0 +1,358 @@
+"""Drives the dome over ArtNet from live audio, with the NumPy DSP and renderer.
+
+Capture, DSP/rendering and sending run as separate threads connected by bounded queues. When a
+queue is full, the oldest item is dropped instead of blocking, so a slow network never stalls
+capture, and the dome always shows the most recent audio.
+
+Usage: python3 live.py [host] [--wav FILE | --pipe | --device N]
+The pipe reads 16-bit signed mono at 44100 Hz from stdin, e.g.:
+    arecord -f S16_LE -r 44100 -c 1 | python3 live.py --pipe
+"""
+
+import argparse
+import queue
+import socket
+import sys
+import threading
+import time
+import typing
+import wave
+
+import numpy
+
+import dsp
+import renderer
+from artnet_test import ARTNET_PORT, artdmx_packet, strip_to_universe
+
+has_sounddevice = False
+try:
+    import sounddevice
+
+    has_sounddevice = True
+except:
+    pass
+
+# 20 ms between frames, like the default speed on the ESP32
+DEFAULT_HOP = dsp.SAMPLE_RATE // 50
+DEFAULT_QUEUE_SIZE = 4
+STATS_SECONDS = 5.0
+
+
+def put_latest(destination: queue.Queue, item: typing.Any) -> bool:
+    """Puts item without blocking, dropping the oldest item if the queue is full. Returns whether
+    anything was dropped.
+    """
+    dropped = False
+    while True:
+        try:
+            destination.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                destination.get_nowait()
+                dropped = True
+            except queue.Empty:
+                pass
+
+
+class RingBuffer:
+    """Keeps the most recent samples, for overlapping windows."""
+
+    def __init__(self, size: int) -> None:
+        self.samples = numpy.zeros(size * 2, dtype=numpy.int16)
+        self.size = size
+        self.end = size
+        self.total = 0
+
+    def write(self, samples: numpy.ndarray) -> None:
+        samples = samples[-self.size :]
+        if self.end + len(samples) > len(self.samples):
+            # Move the newest samples to the front, so windows are always contiguous
+            self.samples[: self.size] = self.samples[self.end - self.size : self.end]
+            self.end = self.size
+        self.samples[self.end : self.end + len(samples)] = samples
+        self.end += len(samples)
+        self.total += len(samples)
+
+    def windows(self, count: int, hop: int, sample_count: int) -> numpy.ndarray:
+        """Returns the last count windows of sample_count samples, hop samples apart, oldest
+        first. Window k ends where the kth last write did, so every write should be hop samples.
+        """
+        ends = self.end - hop * numpy.arange(count - 1, -1, -1)
+        return self.samples[ends[:, numpy.newaxis] - sample_count + numpy.arange(sample_count)]
+
+
+def open_wav(path: str) -> wave.Wave_read:
+    """Opens a WAV file, checking that it's 16-bit 44100 Hz."""
+    file = wave.open(path, "rb")
+    if file.getframerate() != dsp.SAMPLE_RATE or file.getsampwidth() != 2:
+        file.close()
+        raise ValueError(f"{path} should be 16-bit {dsp.SAMPLE_RATE} Hz")
+    return file
+
+
+def read_wav(file: wave.Wave_read, hop: int, stop: threading.Event) -> typing.Iterator[numpy.ndarray]:
+    """Yields hop samples at a time from a WAV file from open_wav, paced like live audio. A short
+    block at the end is dropped.
+    """
+    with file:
+        channels = file.getnchannels()
+        next_time = time.monotonic()
+        while not stop.is_set():
+            data = file.readframes(hop)
+            if len(data) < hop * channels * 2:
+                return
+            samples = numpy.frombuffer(data, dtype=numpy.int16).reshape(-1, channels)
+            yield samples.mean(axis=1).astype(numpy.int16)
+            next_time += hop / dsp.SAMPLE_RATE
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+
+def read_pipe(hop: int, stop: threading.Event) -> typing.Iterator[numpy.ndarray]:
+    """Yields hop samples at a time from 16-bit mono on stdin. A short block at the end is dropped."""
+    while not stop.is_set():
+        # Only short at the end of the input
+        data = sys.stdin.buffer.read(hop * 2)
+        if len(data) < hop * 2:
+            return
+        yield numpy.frombuffer(data, dtype=numpy.int16)
+
+
+def open_device(device: int, hop: int) -> "sounddevice.InputStream":
+    """Opens a capture device, which starts recording once it's read."""
+    return sounddevice.InputStream(
+        device=device, channels=1, samplerate=dsp.SAMPLE_RATE, dtype="int16", blocksize=hop
+    )
+
+
+def read_device(
+    stream: "sounddevice.InputStream", hop: int, stop: threading.Event
+) -> typing.Iterator[numpy.ndarray]:
+    """Yields hop samples at a time from a capture device from open_device."""
+    with stream:
+        while not stop.is_set():
+            samples, _overflowed = stream.read(hop)
+            yield samples[:, 0].copy()
+
+
+class Stats:
+    """Counts frames, drops and analysis latency, shared between the threads. error is set if
+    capture fails.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.error: typing.Optional[Exception] = None
+        self.frames = 0
+        self.dropped_audio = 0
+        self.dropped_frames = 0
+        self.latencies_ms: typing.List[float] = []
+
+    def report(self) -> str:
+        with self.lock:
+            latencies = numpy.array(self.latencies_ms or [0.0])
+            text = (
+                f"{self.frames} frames, analysis latency median {numpy.median(latencies):0.2f} ms"
+                f" max {latencies.max():0.2f} ms, dropped {self.dropped_audio} audio blocks"
+                f" and {self.dropped_frames} frames"
+            )
+            self.frames = self.dropped_audio = self.dropped_frames = 0
+            self.latencies_ms = []
+        return text
+
+
+def capture_stage(
+    source: typing.Iterator[numpy.ndarray], audio: queue.Queue, stats: Stats
+) -> None:
+    """Reads audio blocks into the audio queue. The queue always ends with None, so the later
+    stages stop even if reading fails.
+    """
+    try:
+        for block in source:
+            if put_latest(audio, (time.monotonic(), block)):
+                with stats.lock:
+                    stats.dropped_audio += 1
+    except Exception as exc:
+        with stats.lock:
+            stats.error = exc
+    finally:
+        audio.put(None)
+
+
+def dsp_stage(
+    audio: queue.Queue,
+    frames: queue.Queue,
+    stats: Stats,
+    args: argparse.Namespace,
+) -> None:
+    """Runs the DSP and renderer over every hop of audio, catching up in a batch if it falls
+    behind.
+    """
+    dsp_state = dsp.init_dsp()
+    renderer_state = renderer.init_renderer(args.leds_per_strip)
+    ring = RingBuffer(dsp.SAMPLE_COUNT + args.hop * args.queue_size)
+    start = time.monotonic()
+    done = False
+    while not done:
+        blocks = [audio.get()]
+        while True:
+            try:
+                blocks.append(audio.get_nowait())
+            except queue.Empty:
+                break
+        if blocks[-1] is None:
+            done = True
+            blocks.pop()
+        if not blocks:
+            continue
+
+        for _, block in blocks:
+            ring.write(block)
+        available = (min(ring.total, ring.size) - dsp.SAMPLE_COUNT) // args.hop + 1
+        count = min(len(blocks), max(0, available))
+        if count == 0:
+            continue
+        windows = ring.windows(count, args.hop, dsp.SAMPLE_COUNT)
+        note_values = dsp.process_dsp(dsp_state, windows, args.sensitivity)
+        captured = numpy.array([captured for captured, _ in blocks[-count:]])
+        millis = ((captured - start) * 1000).astype(numpy.uint32)
+        leds = renderer.render_fft(
+            renderer_state,
+            note_values,
+            args.rainbow,
+            args.normalize_bands,
+            millis,
+            args.pattern_length,
+            args.tile_offset,
+        )
+        leds = renderer.scale_brightness(leds, args.brightness)
+
+        rendered = time.monotonic()
+        with stats.lock:
+            stats.latencies_ms.extend(((rendered - captured) * 1000).tolist())
+        # Only the newest frame matters when catching up
+        if put_latest(frames, leds[-1]):
+            with stats.lock:
+                stats.dropped_frames += 1
+    frames.put(None)
+
+
+def send_stage(
+    frames: queue.Queue, sock: socket.socket, ip: str, stats: Stats
+) -> None:
+    """Sends each frame as one ArtDMX packet per strip."""
+    while True:
+        leds = frames.get()
+        if leds is None:
+            return
+        for strip in range(renderer.STRIP_COUNT):
+            packet = artdmx_packet(strip_to_universe(strip), leds[strip].tobytes())
+            sock.sendto(packet, (ip, ARTNET_PORT))
+        with stats.lock:
+            stats.frames += 1
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Drives Phonic Bloom over ArtNet from live audio.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("host", nargs="?", default="piddle.local")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--wav", type=str, help="Play a 16-bit 44100 Hz WAV file in real time")
+    source.add_argument("--pipe", action="store_true", help="Read 16-bit mono 44100 Hz from stdin")
+    source.add_argument("--device", type=int, help="Capture device index, needs sounddevice")
+    parser.add_argument("--hop", type=int, default=DEFAULT_HOP, help="Samples between frames")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Items each stage can fall behind")
+    parser.add_argument("--brightness", "-b", type=int, default=100, help="brightness_p, 0-100")
+    parser.add_argument("--sensitivity", "-s", type=int, default=50, help="sensitivity_p, 0-100")
+    parser.add_argument("--pattern-length", "-l", type=int, default=24, help="LEDs per repeating tile")
+    parser.add_argument("--tile-offset", "-t", type=int, default=2, help="History positions each tile shifts")
+    parser.add_argument("--rainbow", "-r", action="store_true", help="Rainbow mode")
+    parser.add_argument("--normalize-bands", "-n", action="store_true", help="Normalize bands")
+    parser.add_argument("--leds-per-strip", type=int, default=151, help="LEDs per strip")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.wav is None and not args.pipe and args.device is None:
+        print_error("Specify one of --wav, --pipe or --device")
+    if args.device is not None and not has_sounddevice:
+        print_error("sounddevice is required for --device")
+    if not 0 < args.hop <= dsp.SAMPLE_COUNT:
+        print_error(f"Hop should be 1-{dsp.SAMPLE_COUNT}, got {args.hop}")
+    if args.queue_size < 1:
+        print_error(f"Queue size should be positive, got {args.queue_size}")
+    if not 0 <= args.brightness <= 100:
+        print_error(f"Brightness should be 0-100, got {args.brightness}")
+    if not 0 <= args.sensitivity <= 100:
+        print_error(f"Sensitivity should be 0-100, got {args.sensitivity}")
+    if not 5 <= args.pattern_length <= args.leds_per_strip:
+        print_error(f"Pattern length should be 5-{args.leds_per_strip}, got {args.pattern_length}")
+    if not 0 <= args.tile_offset < args.pattern_length:
+        print_error(f"Tile offset should be 0-{args.pattern_length - 1}, got {args.tile_offset}")
+
+    try:
+        ip = socket.gethostbyname(args.host)
+    except socket.gaierror:
+        print_error(f"Could not resolve '{args.host}'. Try passing the IP directly.")
+
+    # Open the source before starting the threads, so that a bad one is reported here
+    stop = threading.Event()
+    if args.wav is not None:
+        try:
+            wav_file = open_wav(args.wav)
+        except (OSError, EOFError, wave.Error, ValueError) as exc:
+            # EOFError has no message
+            print_error(f"Couldn't read {args.wav}: {str(exc) or 'file is truncated'}")
+        source = read_wav(wav_file, args.hop, stop)
+    elif args.pipe:
+        source = read_pipe(args.hop, stop)
+    else:
+        try:
+            stream = open_device(args.device, args.hop)
+        except (sounddevice.PortAudioError, ValueError) as exc:
+            print_error(f"Couldn't open device {args.device}: {exc}")
+        source = read_device(stream, args.hop, stop)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    audio: queue.Queue = queue.Queue(maxsize=args.queue_size)
+    frames: queue.Queue = queue.Queue(maxsize=args.queue_size)
+    stats = Stats()
+    threads = [
+        threading.Thread(target=capture_stage, args=(source, audio, stats), daemon=True),
+        threading.Thread(target=dsp_stage, args=(audio, frames, stats, args), daemon=True),
+        threading.Thread(target=send_stage, args=(frames, sock, ip, stats), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    print(f"Sending to {ip}:{ARTNET_PORT} at {dsp.SAMPLE_RATE / args.hop:0.1f} fps")
+    print("Ctrl-C to stop")
+    try:
+        while threads[-1].is_alive():
+            threads[-1].join(STATS_SECONDS)
+            print(stats.report())
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        print("Clearing all strips...")
+        blank = bytes(args.leds_per_strip * 3)
+        for strip in range(renderer.STRIP_COUNT):
+            sock.sendto(artdmx_packet(strip_to_universe(strip), blank), (ip, ARTNET_PORT))
+        sock.close()
+    if stats.error is not None:
+        print_error(f"Capture failed: {stats.error}")
+
+
+if __name__ == "__main__":
+    main()
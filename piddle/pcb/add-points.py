@@ -6,290 +6,154 @@ Create a board with COUNT (i.e. 15) elements, anywhere on the PCB, e.g.:
 - 15 LED through holes
 - 30 mounting holes
 Save the file as piddle.kicad_pcb.backup, then run this. It will then create a
-15-sided board, and arrange the elements.
+COUNT-sided board, and arrange the elements. The placement math is in
+radial_layout.py, and the file is indexed and edited with kicad_sexpr.py.
 python add-points.py -l 70 -x 100 -y 100 seems to work well.
 """
 
 import argparse
-import itertools
-import math
-import re
+import mmap
+import os
+import time
 import typing
 
-COUNT = 15
-RESISTOR_HEADER = '(footprint "PCM_JLCPCB:R_1206"'
-PIN_HEADER = '(footprint "Connector_PinHeader_2.54mm:PinHeader_1x03_P2.54mm_Vertical"'
-LED_HEADER = '(footprint "PCM_JLCPCB:LED_WS2812B_PLCC4_5.0x5.0mm_P3.2mm"'
+import numpy
 
+from kicad_sexpr import Edit, Index, Node, apply_edits
+from radial_layout import Placements, RadialLayout, place
 
-def clamp_d(angle_d):
-    """Clamp an angle to -180..180"""
-    while angle_d > 180:
-        angle_d -= 360
-    while angle_d < -180:
-        angle_d += 360
-    return angle_d
+HOLE_FOOTPRINT = "MountingHole:MountingHole_3.2mm_M3"
+# Footprints that are placed by their reference number, e.g. R3 is the third resistor
+FOOTPRINT_TO_PART = {
+    "PCM_JLCPCB:R_1206": ("resistors", "R"),
+    "Connector_PinHeader_2.54mm:PinHeader_1x03_P2.54mm_Vertical": ("pin_headers", "J"),
+    "PCM_JLCPCB:LED_WS2812B_PLCC4_5.0x5.0mm_P3.2mm": ("leds", "D"),
+}
 
 
-def sort_lines(lines: typing.List[str]) -> typing.List[str]:
-    """Put the component lines in order."""
-    # The LEDs, resistors, and through holes are all out of order? So just reorder them.
-    iterator = iter(lines)
+def format_d(angle_d: float) -> str:
+    return f"{angle_d:g}"
 
-    def get_block(iterator2, first_line: str) -> typing.List[str]:
-        block_lines = [first_line]
-        parenthesis_count = first_line.count("(") - first_line.count(")")
-        while parenthesis_count > 0:
-            line = next(iterator2)
-            block_lines.append(line)
-            parenthesis_count += line.count("(") - line.count(")")
 
-        return block_lines
-
-    new_lines = []
-    resistors = []
-    leds = []
-    pin_headers = []
-
-    resistor_index = None
+def is_number(atom: str) -> bool:
     try:
-        while True:
-            line = next(iterator)
-            if line.strip() == RESISTOR_HEADER:
-                if len(resistors) == 0:
-                    resistor_index = len(new_lines)
-                resistors.append(get_block(iterator, line))
-            elif line.strip() == PIN_HEADER:
-                pin_headers.append(get_block(iterator, line))
-            elif line.strip() == LED_HEADER:
-                leds.append(get_block(iterator, line))
-            else:
-                new_lines.append(line)
-
-    except StopIteration:
-        pass
-
-    if resistor_index is None:
-        raise ValueError("No resistors found?")
-
-    regex = re.compile(r'"R(\d+)"')
-    # Looking for lines like '(property "Reference" "R2"'
-    resistors.sort(key=lambda array: int(regex.search(array[6]).groups()[0]))
-    regex = re.compile(r'"J(\d+)"')
-    pin_headers.sort(key=lambda array: int(regex.search(array[6]).groups()[0]))
-    regex = re.compile(r'"D(\d+)"')
-    leds.sort(key=lambda array: int(regex.search(array[6]).groups()[0]))
-
-    assert COUNT == len(resistors) == len(leds)
-    # I have more pin headers than just the LED connections
-    assert len(pin_headers) >= COUNT
-    return (
-        new_lines[:resistor_index]
-        # I think we can put all of these right after one another
-        + list(itertools.chain.from_iterable(resistors))
-        + list(itertools.chain.from_iterable(leds))
-        + list(itertools.chain.from_iterable(pin_headers))
-        + new_lines[resistor_index:]
-    )
+        float(atom)
+    except ValueError:
+        return False
+    return True
+
+
+def move_footprint(
+    footprint: Node, x: float, y: float, rotation_d: typing.Optional[int]
+) -> typing.List[Edit]:
+    """Returns the edits that move a footprint. KiCad stores the angles of pads and text as
+    absolute, so they're turned by as much as the footprint is.
+    """
+    at = footprint.find("at")
+    if at is None:
+        raise ValueError(f"No (at ...) in footprint {footprint.atoms[:1]}")
+    if rotation_d is None:
+        return [Edit(at.start, at.end, f"(at {x:0.4f} {y:0.4f})")]
+    edits = [Edit(at.start, at.end, f"(at {x:0.4f} {y:0.4f} {rotation_d})")]
+
+    delta_d = rotation_d - float(at.atoms[2] if len(at.atoms) > 2 else 0)
+    if delta_d == 0:
+        return edits
+    for node in footprint.walk():
+        if node.name == "at" and node is not at and len(node.atoms) in (2, 3) and all(map(is_number, node.atoms)):
+            # KiCad leaves the angle out when it's 0
+            child_x, child_y, child_rotation_d = (node.atoms + ["0"])[:3]
+            # KiCad writes these as 0..360
+            new_rotation_d = format_d((float(child_rotation_d) + delta_d) % 360)
+            edits.append(Edit(node.start, node.end, f"(at {child_x} {child_y} {new_rotation_d})"))
+    return edits
+
+
+def replace_points(index: Index, pts: Node, points: Placements) -> Edit:
+    """Replaces a (pts ...) list with points, one per line."""
+    indent = index.line_indent(pts)
+    lines = ["(pts"] + [f"{indent}\t(xy {x:0.4f} {y:0.4f})" for x, y in zip(points.x, points.y)] + [f"{indent})"]
+    return Edit(pts.start, pts.end, "\n".join(lines))
+
+
+def is_edge_cut(node: Node) -> bool:
+    layer = node.find("layer")
+    return layer is not None and layer.atoms[:1] == ["Edge.Cuts"]
 
 
 def arrange_components(
-    lines: typing.List[str], length: float, center_x: float, center_y: float
-) -> typing.Tuple[typing.List[str], bool]:
-    """Arrange the components."""
-    PART_R = math.radians(360 / COUNT)
-    hole_count = 0
-    ground_plane_count = 0
-    edge_cut_count = 0
-    resistor_count = 0
-    pin_header_count = 0
-    led_count = 0
-
-    skipped_xy_line_count = 0
-
-    new_lines = []
-
-    # Calculate the points for edge cut and ground plane
-    polygon_points = []
-    for i in range(COUNT):
-        angle_r = PART_R * i
-        x = math.sin(angle_r) * length + center_x
-        y = math.cos(angle_r) * length + center_y
-        polygon_points.append((x, y))
-
-    iterator = iter(lines)
-    line = None
-
-    def skip_lines(count: int, append: bool, assertion=None) -> typing.List[str]:
-        lines = []
-        nonlocal line
-        for _ in range(count):
-            line = next(iterator)
-            lines.append(line)
-            if assertion is not None:
-                assert assertion(line), line
-            if append:
-                new_lines.append(line)
-        return lines
-
-    try:
-        while True:
-            line = next(iterator)
-            # Mounting holes
-            if line.strip() == '(footprint "MountingHole:MountingHole_3.2mm_M3"':
-                new_lines.append(line)
-                skip_lines(1, True, lambda l: l.strip().startswith('(layer "F.Cu")'))
-                skip_lines(1, True, lambda l: l.strip().startswith('(uuid "'))
-                skip_lines(1, False, lambda l: l.strip().startswith("(at"))
-                angle_r_spread = 4
-                if hole_count % 2 == 0:
-                    angle_r = PART_R * (hole_count + 1) - math.radians(angle_r_spread)
-                else:
-                    angle_r = PART_R * (hole_count + 1) + math.radians(angle_r_spread)
-
-                x = math.sin(angle_r) * (length - 10) + center_x
-                y = math.cos(angle_r) * (length - 10) + center_y
-                new_lines.append(f"    (at {x:0.4f} {y:0.4f})\n")
-                hole_count += 1
-
-            # Edge cut
-            elif line.strip() == "(gr_poly":
-                new_lines.append(line)
-                skip_lines(1, True, lambda l: "(pts" in l)
-                line = next(iterator)
-                # Skip the points. The points are a bunch of e.g. "(xy 100 170)", but there are
-                # several on each line
-                assert "(xy" in line, f"Expected '(xy' in line: '{line}'"
-                while "(xy" in line:
-                    skipped_xy_line_count += 1
-                    line = next(iterator)
-                for point in polygon_points:
-                    new_lines.append(f"      (xy {point[0]:0.4f} {point[1]:0.4f})\n")
-                    edge_cut_count += 1
-                new_lines.append(line)
-
-            # Resistors
-            elif line.strip() == RESISTOR_HEADER:
-                new_lines.append(line)
-                skip_lines(
-                    1, True, lambda line: line.strip().startswith('(layer "F.Cu")')
-                )
-                skip_lines(1, True, lambda line: line.strip().startswith('(uuid "'))
-                skip_lines(1, False, lambda line: line.strip().startswith("(at"))
-                angle_r = PART_R * (resistor_count + 1)
-                resistor_length = length - 28
-                x = math.sin(angle_r) * resistor_length + center_x
-                y = math.cos(angle_r) * resistor_length + center_y
-                print(f"{x=} {y=}")
-                angle_d = clamp_d(math.degrees(angle_r) + 90 + 180)
-                new_lines.append(f"    (at {x:0.4f} {y:0.4f} {int(angle_d)})\n")
-                resistor_count += 1
-
-            # Pin headers
-            elif line.strip() == PIN_HEADER:
-                # We have a problem. I have a bunch of pin headers, but I only want to do this line
-                # for the LED pin headers. I don't know of an easy way to do this, so what I will
-                # do is, read ahead until I hit the line:
-                # (property "Reference" "J7"
-                # If the J# is <= COUNT, then I know it's an LED
-                new_lines.append(line)
-                skip_lines(
-                    1, True, lambda line: line.strip().startswith('(layer "F.Cu")')
+    index: Index, layout: RadialLayout, keep_outline: bool = False
+) -> typing.Tuple[typing.List[Edit], bool]:
+    """Returns the edits that arrange the components."""
+    placements = place(layout)
+    # How many times each part was placed
+    placed = {name: numpy.zeros(len(placement.x), dtype=int) for name, placement in placements.items()}
+    messages = []
+    edits = []
+
+    # Mounting holes all have the same reference, so go in the order they're found
+    holes = index.footprints_of(HOLE_FOOTPRINT)
+    if len(holes) > len(placed["holes"]):
+        messages.append(f"Found {len(holes) - len(placed['holes'])} more holes than the {len(placed['holes'])} expected")
+    for hole, footprint in enumerate(holes[: len(placed["holes"])]):
+        edits += move_footprint(footprint, placements["holes"].x[hole], placements["holes"].y[hole], None)
+        placed["holes"][hole] += 1
+
+    # Edge cut. Only a polygon outline can be replaced; an outline drawn as separate lines and arcs,
+    # e.g. after rounding the corners, has to be redrawn as a polygon or kept.
+    if keep_outline:
+        placed["outline"] += 1
+    else:
+        for poly in index.board.find_all("gr_poly"):
+            pts = poly.find("pts")
+            if is_edge_cut(poly) and pts is not None:
+                edits.append(replace_points(index, pts, placements["outline"]))
+                placed["outline"] += 1
+        if placed["outline"][0] == 0:
+            segment_count = sum(
+                is_edge_cut(node) for node in index.board.children if node.name in ("gr_line", "gr_arc")
+            )
+            if segment_count:
+                messages.append(
+                    f"The Edge.Cuts outline is {segment_count} gr_line/gr_arc segments, not a gr_poly, so it"
+                    " can't be replaced. Draw it as a polygon, or pass --keep-outline to leave it as is"
                 )
-                skip_lines(1, True, lambda line: line.strip().startswith('(uuid "'))
-                temp_lines = skip_lines(4, False)
-                match = re.search(r'property "Reference" "J(\d+)"', temp_lines[-1])
-                if not match:
-                    raise ValueError(
-                        f"No J# reference found for pin header: {temp_lines[-1]}"
-                    )
-                number = int(match.groups()[0])
-                if number > COUNT:
-                    new_lines += temp_lines
-                    continue
-
-                angle_r = PART_R * (pin_header_count + 1) + PART_R / 2
-                # The position of the headers is one of the side pins, not the center, so we need
-                # to bump it a bit more to keep it centered
-                projection_angle_r = angle_r + PART_R / 8
-                resistor_length = length - 20
-                x = math.sin(projection_angle_r) * resistor_length + center_x
-                y = math.cos(projection_angle_r) * resistor_length + center_y
-                angle_d = clamp_d(math.degrees(angle_r) - 90)
-                temp_lines[0] = f"    (at {x:0.4f} {y:0.4f} {int(angle_d)})\n"
-                new_lines += temp_lines
-                pin_header_count += 1
-
-            # LEDs
-            elif line.strip() == LED_HEADER:
-                new_lines.append(line)
-                skip_lines(1, True, lambda l: l.strip().startswith('(layer "F.Cu")'))
-                skip_lines(1, True, lambda l: l.strip().startswith('(uuid "'))
-                skip_lines(1, False, lambda l: l.strip().startswith("(at"))
-                angle_r = PART_R * (led_count + 1) + PART_R / 2
-                led_length = length - 27
-                x = math.sin(angle_r) * led_length + center_x
-                y = math.cos(angle_r) * led_length + center_y
-                angle_d = clamp_d(math.degrees(angle_r) + 90)
-                new_lines.append(f"    (at {x:0.4f} {y:0.4f} {int(angle_d)})\n")
-                led_count += 1
-
-                # We also need to find and rotate the pads
-                pad_count = 0
-                while pad_count < 4:
-                    line = next(iterator)
-                    if re.search(r'pad "(\d+)" smd rect', line):
-                        new_lines.append(line)
-                        pad_count += 1
-                        skip_lines(
-                            1, False, lambda line: line.strip().startswith("(at")
-                        )
-                        new_lines.append(
-                            line.replace(r"()?\d+)", f" {int(clamp_d(angle_d + 90))})")
-                        )
-                    else:
-                        new_lines.append(line)
             else:
-                new_lines.append(line)
-
-    except StopIteration:
-        pass
-
-    success = True
-
-    if hole_count != COUNT * 2:
-        message = f"Only processed {hole_count} holes, expected {COUNT * 2}"
-        success = False
+                messages.append("No Edge.Cuts gr_poly outline found, pass --keep-outline to skip it")
+
+    for library_id, (name, prefix) in FOOTPRINT_TO_PART.items():
+        placement = placements[name]
+        for number, footprint in index.numbered(library_id, prefix):
+            # I have more pin headers than just the LED connections, so only the first COUNT get
+            # placed
+            if name == "pin_headers" and number > layout.count:
+                continue
+            if not 1 <= number <= layout.count:
+                messages.append(f"{prefix}{number} is out of range for {layout.count} parts")
+                continue
+            edits += move_footprint(
+                footprint, placement.x[number - 1], placement.y[number - 1], placement.rotation_d[number - 1]
+            )
+            placed[name][number - 1] += 1
+
+    for name, counts in placed.items():
+        if name == "outline":
+            # Every outline point is written for each edge cut, and a missing one is reported above
+            counts = counts[:1]
+            if counts[0] == 0:
+                continue
+        if (counts != 1).any():
+            missing = numpy.flatnonzero(counts == 0)
+            repeated = numpy.flatnonzero(counts > 1)
+            messages.append(
+                f"Placed {int((counts > 0).sum())} of {len(counts)} {name}"
+                + (f", missing {(missing + 1).tolist()}" if len(missing) else "")
+                + (f", repeated {(repeated + 1).tolist()}" if len(repeated) else "")
+            )
+
+    for message in messages:
         print(message)
-
-    # I have a front and back ground plane, I guess? So expect COUNT * 2
-    if ground_plane_count != COUNT * 2:
-        message = f"Processed {ground_plane_count} ground planes, expected {COUNT}"
-        success = False
-        print(message)
-
-    type_to_count = {
-        "edge_cuts": edge_cut_count,
-        "resistors": resistor_count,
-        "pin_headers": pin_header_count,
-        "leds": led_count,
-    }
-    for key, value in type_to_count.items():
-        if value != COUNT:
-            message = f"Only processed {value} {key}, expected {COUNT}"
-            success = False
-            print(message)
-
-    # The original file has multiple "(xy ...)" statements on a single line, but we expand them to
-    # be one per line, so we need to adjust our count
-    expected_line_count = len(lines) - skipped_xy_line_count + COUNT * 2
-    if len(new_lines) != expected_line_count:
-        message = f"Line count differs: old {len(lines)}, new {len(new_lines)}, expected {expected_line_count}"
-        success = False
-        print(message)
-        print(f"Skipped {skipped_xy_line_count} xy lines")
-
-    return new_lines, success
+    return edits, not messages
 
 
 def main() -> None:
@@ -312,35 +176,69 @@ def main() -> None:
         required=True,
         help="The y coordinate of the center",
     )
+    parser.add_argument(
+        "-c", "--count", type=int, default=15, help="The number of sides and strips"
+    )
+    defaults = RadialLayout(count=15, length=0, center_x=0, center_y=0)
+    for field in ("hole_inset", "resistor_inset", "pin_header_inset", "led_inset"):
+        parser.add_argument(
+            f"--{field.replace('_', '-')}",
+            type=float,
+            default=getattr(defaults, field),
+            help=f"How far in from the corners the {field.replace('_inset', '').replace('_', ' ')}s go",
+        )
+    parser.add_argument(
+        "--keep-outline",
+        action="store_true",
+        help="Leave the Edge.Cuts outline alone, e.g. when it has rounded corners",
+    )
+    parser.add_argument(
+        "-i", "--input", type=str, default="piddle.kicad_pcb.backup", help="The input file name"
+    )
     parser.add_argument(
         "-o", "--output", type=str, required=False, help="The output file name"
     )
     args = parser.parse_args()
 
+    layout = RadialLayout(
+        count=args.count,
+        length=args.length,
+        center_x=args.center_x,
+        center_y=args.center_y,
+        hole_inset=args.hole_inset,
+        resistor_inset=args.resistor_inset,
+        pin_header_inset=args.pin_header_inset,
+        led_inset=args.led_inset,
+    )
+
     try:
-        with open("piddle.kicad_pcb.backup", "r") as file:
-            lines = file.readlines()
+        input_file = open(args.input, "rb")
     except FileNotFoundError as exc:
         print(exc)
-        print("Copy piddle.kicad_pcb.backup to piddle.kicad_pcb.backup first")
+        print("Copy piddle.kicad_pcb to piddle.kicad_pcb.backup first")
         raise exc
 
-    lines = sort_lines(lines)
-    lines, success = arrange_components(
-        lines, args.length, args.center_x, args.center_y
-    )
-
-    output_file_name = args.output
-    if success and not args.output:
-        output_file_name = "piddle.kicad_pcb"
+    with input_file, mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = time.perf_counter()
+        index = Index(data)
+        print(f"Indexed {len(index.footprints)} footprints in {(time.perf_counter() - start) * 1000:0.0f} ms")
+        edits, success = arrange_components(index, layout, args.keep_outline)
+
+        output_file_name = args.output
+        if success and not args.output:
+            output_file_name = "piddle.kicad_pcb"
+
+        if output_file_name is not None:
+            print(f"Writing updated file, {len(edits)} edits")
+            # Write next to the output first, in case it's also the input
+            temporary_name = output_file_name + ".new"
+            with open(temporary_name, "wb") as file:
+                apply_edits(data, edits, file)
+        else:
+            print("Not writing updated file because of validation errors")
 
     if output_file_name is not None:
-        print("Writing updated file")
-        with open(output_file_name, "w") as file:
-            for line in lines:
-                file.write(line)
-    else:
-        print("Not writing updated file because of validation errors")
+        os.replace(temporary_name, output_file_name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+"""Streaming S-expression parser and footprint index for .kicad_pcb files.
+
+Tokens are matched straight out of the file's bytes, which can be an mmap, and every list keeps the
+byte range it came from. Edits replace byte ranges and are written out around the untouched bytes,
+so nothing depends on how KiCad happens to break lines.
+"""
+
+import mmap
+import re
+import typing
+
+Data = typing.Union[bytes, mmap.mmap]
+
+# Lists, quoted strings with backslash escapes, and bare atoms. A lone quote is an unterminated string.
+TOKEN_REGEX = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+|"')
+ESCAPE_REGEX = re.compile(r"\\(.)")
+# Footprint references, e.g. R12
+REFERENCE_REGEX = re.compile(r"^([A-Za-z]+)(\d+)$")
+
+
+class Node:
+    """A list, e.g. (at 1 2 90). atoms are the strings directly in it, unquoted, and children are the
+    lists in it, both in order. start and end are its byte range, including the parentheses.
+    """
+
+    __slots__ = ("name", "start", "end", "atoms", "children")
+
+    def __init__(self, start: int) -> None:
+        self.name = ""
+        self.start = start
+        self.end = -1
+        self.atoms: typing.List[str] = []
+        self.children: typing.List["Node"] = []
+
+    def find(self, name: str) -> typing.Optional["Node"]:
+        """The first child called name."""
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def find_all(self, name: str) -> typing.List["Node"]:
+        return [child for child in self.children if child.name == name]
+
+    def walk(self) -> typing.Iterator["Node"]:
+        """This and every list under it, depth first."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def __repr__(self) -> str:
+        return f"Node({self.name!r}, {self.start}..{self.end}, {self.atoms!r})"
+
+
+class Edit(typing.NamedTuple):
+    start: int
+    end: int
+    text: str
+
+
+def tokenize(data: Data) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    """Yields the offset and bytes of each token."""
+    for match in TOKEN_REGEX.finditer(data):
+        token = match.group()
+        if token == b'"':
+            raise ValueError(f"Unterminated string at byte {match.start()}")
+        yield match.start(), token
+
+
+def unquote(token: bytes) -> str:
+    text = token.decode("utf-8")
+    if text.startswith('"'):
+        return ESCAPE_REGEX.sub(r"\1", text[1:-1])
+    return text
+
+
+def quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def parse(data: Data) -> Node:
+    """Parses every top level list in one pass. Returns a node with no name that holds them."""
+    root = Node(0)
+    stack = [root]
+    for offset, token in tokenize(data):
+        if token == b"(":
+            node = Node(offset)
+            stack[-1].children.append(node)
+            stack.append(node)
+        elif token == b")":
+            if len(stack) == 1:
+                raise ValueError(f"Unmatched ) at byte {offset}")
+            stack.pop().end = offset + 1
+        else:
+            node = stack[-1]
+            if node is root:
+                raise ValueError(f"Atom outside of a list at byte {offset}")
+            if node.name or node.atoms or node.children:
+                node.atoms.append(unquote(token))
+            else:
+                node.name = unquote(token)
+    if len(stack) > 1:
+        raise ValueError(f"Unclosed ( at byte {stack[-1].start}")
+    root.end = len(data)
+    return root
+
+
+def reference(footprint: Node) -> typing.Optional[str]:
+    """A footprint's reference designator, from KiCad 8+ (property "Reference" ...) or older
+    (fp_text reference ...).
+    """
+    for child in footprint.children:
+        if child.name == "property" and len(child.atoms) >= 2 and child.atoms[0] == "Reference":
+            return child.atoms[1]
+        if child.name == "fp_text" and len(child.atoms) >= 2 and child.atoms[0] == "reference":
+            return child.atoms[1]
+    return None
+
+
+class Index:
+    """Footprints of a board, in file order and by reference, and the other top level items."""
+
+    def __init__(self, data: Data) -> None:
+        self.data = data
+        self.root = parse(data)
+        if len(self.root.children) != 1 or self.root.children[0].name != "kicad_pcb":
+            raise ValueError("Not a kicad_pcb file")
+        self.board = self.root.children[0]
+        self.footprints = self.board.find_all("footprint")
+        self.by_reference: typing.Dict[str, Node] = {}
+        for footprint in self.footprints:
+            designator = reference(footprint)
+            if designator is not None:
+                self.by_reference[designator] = footprint
+
+    def footprints_of(self, library_id: str) -> typing.List[Node]:
+        return [footprint for footprint in self.footprints if footprint.atoms[:1] == [library_id]]
+
+    def numbered(self, library_id: str, prefix: str) -> typing.List[typing.Tuple[int, Node]]:
+        """Footprints of library_id with references like prefix#, and their numbers."""
+        numbered = []
+        for footprint in self.footprints_of(library_id):
+            match = REFERENCE_REGEX.match(reference(footprint) or "")
+            if match and match.group(1) == prefix:
+                numbered.append((int(match.group(2)), footprint))
+        return numbered
+
+    def line_indent(self, node: Node) -> str:
+        """The whitespace before node on its line."""
+        line_start = self.data.rfind(b"\n", 0, node.start) + 1
+        prefix = bytes(self.data[line_start : node.start])
+        return prefix.decode("utf-8") if not prefix.strip() else ""
+
+
+def apply_edits(data: Data, edits: typing.List[Edit], file: typing.BinaryIO) -> None:
+    """Writes data to file with each edit's byte range replaced by its text."""
+    view = memoryview(data)
+    position = 0
+    for edit in sorted(edits):
+        if edit.start < position:
+            raise ValueError(f"Edits overlap at byte {edit.start}")
+        file.write(view[position : edit.start])
+        file.write(edit.text.encode("utf-8"))
+        position = edit.end
+    file.write(view[position:])
@@ -0,0 +1,85 @@
+"""Placement math for N-fold radial boards, like the piddle PCB.
+
+Angles are measured from +y towards +x, so part 0 is straight down in KiCad's coordinates. Every
+part type is computed in one vectorized pass, so it's cheap to try different sizes and counts.
+"""
+
+import dataclasses
+import math
+import typing
+
+import numpy
+
+
+@dataclasses.dataclass
+class RadialLayout:
+    count: int  # Sides of the board, and strips
+    length: float  # Center to corner
+    center_x: float
+    center_y: float
+    # How far in from the corners each part type goes
+    hole_inset: float = 10.0
+    resistor_inset: float = 28.0
+    pin_header_inset: float = 20.0
+    led_inset: float = 27.0
+    # Each corner gets 2 holes, this far either side of it
+    hole_spread_d: float = 4.0
+
+
+class Placements(typing.NamedTuple):
+    x: numpy.ndarray
+    y: numpy.ndarray
+    # Whole degrees, None for parts that aren't rotated
+    rotation_d: typing.Optional[numpy.ndarray]
+
+
+def clamp_d(angle_d: numpy.ndarray) -> numpy.ndarray:
+    """Clamp angles to -180..180"""
+    # Whole turns, so that angles already in range come out exactly the same
+    turns = numpy.where(
+        angle_d > 180, numpy.ceil((angle_d - 180) / 360), -numpy.ceil(numpy.maximum(-180 - angle_d, 0) / 360)
+    )
+    return angle_d - 360 * turns
+
+
+def place(layout: RadialLayout) -> typing.Dict[str, Placements]:
+    """Returns the placements of each part type, in reference order: "outline", the corners of the
+    board, "holes", "resistors", "pin_headers" and "leds".
+    """
+    part_r = math.radians(360 / layout.count)
+    parts = numpy.arange(layout.count)
+    # Corner 0 is the first outline point, and part i goes on or after corner i + 1
+    corners_r = part_r * (parts + 1)
+    sides_r = corners_r + part_r / 2
+    # Hole i goes by corner i + 1, alternating sides. With an odd count, the second lap of holes
+    # lands on the other side of each corner from the first.
+    holes = numpy.arange(layout.count * 2)
+    hole_spread_r = math.radians(layout.hole_spread_d)
+    holes_r = part_r * (holes + 1) + numpy.where(holes % 2 == 0, -hole_spread_r, hole_spread_r)
+
+    # (angle in radians, distance from the center, rotation in degrees)
+    parts_angles: typing.Dict[str, typing.Tuple[numpy.ndarray, float, typing.Optional[numpy.ndarray]]] = {
+        "outline": (part_r * parts, layout.length, None),
+        "holes": (holes_r, layout.length - layout.hole_inset, None),
+        "resistors": (corners_r, layout.length - layout.resistor_inset, numpy.degrees(corners_r) + 90 + 180),
+        # The position of the headers is one of the side pins, not the center, so bump it a bit
+        # more to keep it centered
+        "pin_headers": (sides_r + part_r / 8, layout.length - layout.pin_header_inset, numpy.degrees(sides_r) - 90),
+        "leds": (sides_r, layout.length - layout.led_inset, numpy.degrees(sides_r) + 90),
+    }
+
+    angles_r = numpy.concatenate([angles for angles, _length, _rotation in parts_angles.values()])
+    lengths = numpy.concatenate([numpy.full(len(angles), length) for angles, length, _rotation in parts_angles.values()])
+    xs = numpy.sin(angles_r) * lengths + layout.center_x
+    ys = numpy.cos(angles_r) * lengths + layout.center_y
+    splits = numpy.cumsum([len(angles) for angles, _length, _rotation in parts_angles.values()])[:-1]
+
+    placements = {}
+    for (name, (_angles, _length, rotation_d)), x, y in zip(
+        parts_angles.items(), numpy.split(xs, splits), numpy.split(ys, splits)
+    ):
+        if rotation_d is not None:
+            # Truncate like int()
+            rotation_d = numpy.trunc(clamp_d(rotation_d)).astype(int)
+        placements[name] = Placements(x, y, rotation_d)
+    return placements
@@ -1,6 +1,8 @@
 """Testing some parameters to see how much the solar panel and batteries can last"""
 
+import json
 import math
+import os
 import re
 import sys
 import time
@@ -17,6 +19,14 @@ try:
 except:
     pass
 
+has_numpy = False
+try:
+    import numpy
+
+    has_numpy = True
+except:
+    pass
+
 
 def get_sunlight_percentage(hour: int, minute: int, std_dev: float) -> float:
     """Returns the percent of solar energy the solar panels produce at a time of day."""
@@ -47,6 +57,10 @@ def get_sunlight_percentage(hour: int, minute: int, std_dev: float) -> float:
 
 
 DEFAULT_STD_DEV = 2.3
+# I have 300 W of panels, but because of Colorado's latitude, they'll likely only produce ~90% of
+# their rated power
+RATED_SOLAR_W = 300
+SOLAR_DERATE = 0.9
 assert get_sunlight_percentage(5, 0, DEFAULT_STD_DEV) < 0.01
 assert get_sunlight_percentage(7, 0, DEFAULT_STD_DEV) < 0.2
 assert get_sunlight_percentage(12, 0, DEFAULT_STD_DEV) == 1
@@ -56,6 +70,65 @@ assert get_sunlight_percentage(11, 0, DEFAULT_STD_DEV) == get_sunlight_percentag
 
 DAYS = ("Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat")
 
+# The voltage monitor and Phonic Bloom each use about 0.5 W
+ARDUINO_W = 1.0
+
+# These match voltageMonitor.ino. The sliders map 0-100 to 12.0-13.1 V.
+VOLTAGE_SLIDER_MIN_V = 12.0
+VOLTAGE_SLIDER_MAX_V = 13.1
+DEFAULT_OFF_VOLTAGE_SLIDER = 45
+DEFAULT_RESUME_VOLTAGE_SLIDER = 85
+MINIMUM_OFF_V = 11.98
+RELAY_TOGGLE_DELAY_MINUTES = 3
+# voltageToPercent as (lower V, upper V, percent at lower, percent at upper), highest first. Note
+# that 40% to 50% are all 13.0 V.
+VOLTAGE_TO_PERCENT_SEGMENTS = (
+    (13.4, 13.6, 90.0, 100.0),
+    (13.0, 13.4, 50.0, 90.0),
+    (12.8, 13.0, 20.0, 40.0),
+    (12.0, 12.8, 10.0, 20.0),
+    (10.0, 12.0, 0.0, 10.0),
+)
+# Battery internal resistance plus wiring, for voltage sag under load. This is a guess; fit it to
+# logs from the voltage monitor.
+DEFAULT_INTERNAL_RESISTANCE_OHM = 0.015
+
+
+def slider_to_voltage(slider: int) -> float:
+    return slider / 100 * (VOLTAGE_SLIDER_MAX_V - VOLTAGE_SLIDER_MIN_V) + VOLTAGE_SLIDER_MIN_V
+
+
+def voltage_to_percent(voltage: float) -> float:
+    """Same as voltageToPercent in voltageMonitor.ino."""
+    for lower_v, upper_v, lower_p, upper_p in VOLTAGE_TO_PERCENT_SEGMENTS:
+        if voltage >= lower_v:
+            break
+    return (voltage - lower_v) / (upper_v - lower_v) * (upper_p - lower_p) + lower_p
+
+
+def percent_to_voltage(percent: float) -> float:
+    """The inverse of voltage_to_percent, i.e. the open circuit voltage at a state of charge."""
+    for index, (lower_v, upper_v, lower_p, upper_p) in enumerate(VOLTAGE_TO_PERCENT_SEGMENTS):
+        if percent >= lower_p:
+            break
+    voltage = (percent - lower_p) / (upper_p - lower_p) * (upper_v - lower_v) + lower_v
+    # Only the top segment extrapolates, the rest are capped where the next one starts
+    return voltage if index == 0 else min(voltage, upper_v)
+
+
+def terminal_voltage(percent: float, net_load_w: float, internal_resistance_ohm: float) -> float:
+    """Battery voltage at a state of charge, sagging under load or rising while charging."""
+    open_circuit_v = percent_to_voltage(percent)
+    return open_circuit_v - net_load_w / open_circuit_v * internal_resistance_ohm
+
+
+assert abs(voltage_to_percent(13.6) - 100) < 0.001
+assert abs(voltage_to_percent(13.3) - 80) < 0.001
+assert abs(voltage_to_percent(12.9) - 30) < 0.001
+assert abs(voltage_to_percent(12.0) - 10) < 0.001
+assert abs(percent_to_voltage(voltage_to_percent(12.3)) - 12.3) < 0.001
+assert percent_to_voltage(45) == 13.0
+
 
 def get_day(index: int) -> str:
     return DAYS[(index + 700) % 7]
@@ -76,6 +149,17 @@ class Options:
     day_charge_until_hour: int | None
     day_charge_until_minute: int | None
     always_day_charge: bool
+    # Watts used by the project for each minute it's on, looped. Overrides project_w.
+    load_profile_w: typing.List[float] | None = None
+    # Switch the relay like voltageMonitor.ino does, from the battery voltage every few minutes,
+    # instead of instantly from off_battery_wh and resume_battery_wh
+    voltage_model: bool = False
+    off_v: float = slider_to_voltage(DEFAULT_OFF_VOLTAGE_SLIDER)
+    resume_v: float = slider_to_voltage(DEFAULT_RESUME_VOLTAGE_SLIDER)
+    internal_resistance_ohm: float = DEFAULT_INTERNAL_RESISTANCE_OHM
+    relay_toggle_delay_minutes: int = RELAY_TOGGLE_DELAY_MINUTES
+    # Always on, whether or not the project is
+    arduino_w: float = ARDUINO_W
 
 
 @dataclass
@@ -89,9 +173,6 @@ class TogglePower:
 
 def run_simulation_data(options: Options):
     """Pure computation: runs the simulation and returns all data without printing or plotting."""
-    # The voltage monitor and Phonic Bloom each use about 0.5 W
-    ARDUINO_W = 1.0
-
     battery_wh = options.max_battery_wh
 
     STEP = 1  # minutes per simulation tick
@@ -115,6 +196,9 @@ def run_simulation_data(options: Options):
     increasing = False
 
     total_minutes = 0
+    on_minutes = 0
+    relay_toggle_minute = 0
+    voltage = 0.0
     battery_wh_by_minute = []
     toggle_power_times: typing.List[TogglePower] = [TogglePower(0, True, False, False)]
     annotations = []
@@ -142,9 +226,15 @@ def run_simulation_data(options: Options):
         battery_wh_by_minute.extend([battery_wh] * STEP)
         previous_battery_wh = battery_wh
 
+        project_w = 0.0
         if on and not day_charge:
-            battery_wh -= options.project_w * STEP / 60
-        battery_wh -= ARDUINO_W * STEP / 60
+            if options.load_profile_w:
+                project_w = options.load_profile_w[on_minutes % len(options.load_profile_w)]
+                on_minutes += STEP
+            else:
+                project_w = options.project_w
+            battery_wh -= project_w * STEP / 60
+        battery_wh -= options.arduino_w * STEP / 60
         solar_wh_increment = (
             get_sunlight_percentage(hour, minute, options.std_dev)
             * options.solar_w
@@ -158,19 +248,39 @@ def run_simulation_data(options: Options):
             battery_wh += solar_wh_increment
             limited = False
         else:
-            battery_wh += options.max_charge_w * STEP / 60
+            solar_wh_increment = options.max_charge_w * STEP / 60
+            battery_wh += solar_wh_increment
             limited = True
 
         maxed = False
-        if battery_wh < options.off_battery_wh:
-            on = False
-        elif battery_wh > options.max_battery_wh:
-            battery_wh = options.max_battery_wh
-            maxed = True
+        if options.voltage_model:
+            # The BMS cuts off the battery before it's empty
+            battery_wh = max(battery_wh, 0.0)
+            if battery_wh > options.max_battery_wh:
+                battery_wh = options.max_battery_wh
+                maxed = True
+            net_load_w = project_w + options.arduino_w - solar_wh_increment * 60 / STEP
+            voltage = terminal_voltage(
+                battery_wh / options.max_battery_wh * 100, net_load_w, options.internal_resistance_ohm
+            )
+            # The relay is only checked every few minutes, whether or not it toggles
+            if total_minutes - relay_toggle_minute >= options.relay_toggle_delay_minutes:
+                relay_toggle_minute = total_minutes
+                if on and voltage < options.off_v:
+                    on = False
+                elif not on and voltage > options.resume_v and not options.always_day_charge:
+                    on = True
+                    day_charge = False
+        else:
+            if battery_wh < options.off_battery_wh:
+                on = False
+            elif battery_wh > options.max_battery_wh:
+                battery_wh = options.max_battery_wh
+                maxed = True
 
-        if battery_wh > options.resume_battery_wh and not options.always_day_charge:
-            on = True
-            day_charge = False
+            if battery_wh > options.resume_battery_wh and not options.always_day_charge:
+                on = True
+                day_charge = False
 
         increasing = battery_wh > previous_battery_wh
 
@@ -229,6 +339,8 @@ def run_simulation_data(options: Options):
             msg = f"{get_day(day)} {hour:02d}:{minute:02d}"
             pct = int(battery_wh / options.max_battery_wh * 100)
             msg += f" {battery_wh:>7.2f} Wh {pct:>3.0f}%"
+            if options.voltage_model:
+                msg += f" {voltage:0.2f} V"
             if maxed:
                 msg += " maxed"
             msg += " on" if on else " off"
@@ -248,6 +360,8 @@ def run_simulation_data(options: Options):
     msg = f"{get_day(day)} {hour:02d}:{minute:02d}"
     pct = int(battery_wh / options.max_battery_wh * 100)
     msg += f" {battery_wh:>7.2f} Wh {pct:>3.0f}%"
+    if options.voltage_model:
+        msg += f" {voltage:0.2f} V"
     if maxed:
         msg += " maxed"
     msg += " on" if on else " off"
@@ -523,6 +637,13 @@ def run_simulation(options: Options) -> None:
             day_charge_until_minute=options.day_charge_until_minute,
             always_day_charge=options.always_day_charge,
             max_charge_w=slider_max_charge.val if slider_max_charge.val > 0 else None,
+            load_profile_w=options.load_profile_w,
+            voltage_model=options.voltage_model,
+            off_v=options.off_v,
+            resume_v=options.resume_v,
+            internal_resistance_ohm=options.internal_resistance_ohm,
+            relay_toggle_delay_minutes=options.relay_toggle_delay_minutes,
+            arduino_w=options.arduino_w,
         )
 
     def update(_) -> None:
@@ -569,6 +690,152 @@ IDLE_A_PER_STRIP = 1.614 / 5
 DEFAULT_W = DEFAULT_A_PER_STRIP * 15 * 12
 IDLE_W = IDLE_A_PER_STRIP * 15 * 12
 
+# FastLED's WS2812B power model, which the firmware uses to limit brightness: mA per channel at full
+# brightness, and per LED when dark, at 5 V
+WS2812B_RED_MA = 16
+WS2812B_GREEN_MA = 11
+WS2812B_BLUE_MA = 15
+WS2812B_DARK_MA = 1
+LED_VOLTAGE = 5.0
+# The LEDs are powered by a 12 V to 5 V converter
+CONVERTER_EFFICIENCY = 0.9
+# How many frames to read from a frame file at once
+FRAME_CHUNK_SIZE = 4096
+
+
+def frames_to_w(frames) -> "numpy.ndarray":
+    """Returns the power that each rendered frame draws from the battery. frames is
+    (frame count, ..., 3) uint8 RGB.
+    """
+    channel_sums = frames.reshape(len(frames), -1, 3).sum(axis=1, dtype=numpy.int64)
+    led_count = frames[0].size // 3 if len(frames) > 0 else 0
+    channel_ma = numpy.array([WS2812B_RED_MA, WS2812B_GREEN_MA, WS2812B_BLUE_MA]) / 255
+    ma = channel_sums @ channel_ma + WS2812B_DARK_MA * led_count
+    return ma / 1000 * LED_VOLTAGE / CONVERTER_EFFICIENCY
+
+
+def load_profile_from_frames(
+    paths: typing.List[str], default_frame_ms: float
+) -> typing.List[float]:
+    """Reads rendered frame files from render_song.py in order, as if they were a playlist, and
+    returns the average power for each minute. Frames are read in chunks, so the files can be much
+    larger than memory.
+    """
+    minute_w_sums = numpy.zeros(0)
+    minute_frame_counts = numpy.zeros(0)
+    start_ms = 0.0
+    for path in paths:
+        frame_ms = default_frame_ms
+        if os.path.exists(path + ".json"):
+            with open(path + ".json") as file:
+                frame_ms = json.load(file).get("frame_ms", default_frame_ms)
+
+        frames = numpy.load(path, mmap_mode="r")
+        for chunk_start in range(0, len(frames), FRAME_CHUNK_SIZE):
+            frame_w = frames_to_w(frames[chunk_start : chunk_start + FRAME_CHUNK_SIZE])
+            frame_ms_offsets = (chunk_start + numpy.arange(len(frame_w))) * frame_ms
+            minutes = ((start_ms + frame_ms_offsets) // 60_000).astype(numpy.intp)
+            length = max(len(minute_w_sums), minutes[-1] + 1)
+            minute_w_sums = numpy.pad(minute_w_sums, (0, length - len(minute_w_sums)))
+            minute_frame_counts = numpy.pad(minute_frame_counts, (0, length - len(minute_frame_counts)))
+            minute_w_sums += numpy.bincount(minutes, weights=frame_w, minlength=length)
+            minute_frame_counts += numpy.bincount(minutes, minlength=length)
+        start_ms += len(frames) * frame_ms
+
+    # A partial last minute is still a fair sample of that minute's power
+    played = minute_frame_counts > 0
+    return (minute_w_sums[played] / minute_frame_counts[played]).tolist()
+
+
+def sunlight_percentage_array(hours: "numpy.ndarray", std_dev: "numpy.ndarray") -> "numpy.ndarray":
+    """Same as get_sunlight_percentage, for arrays of fractional hours and std devs."""
+    scaled_value = numpy.exp(-0.5 * ((hours - 12) / std_dev) ** 2)
+    return numpy.where(scaled_value < 0.05, 0.0, scaled_value)
+
+
+def voltage_to_percent_array(voltage: "numpy.ndarray") -> "numpy.ndarray":
+    """Same as voltage_to_percent, for an array of voltages."""
+    voltage = numpy.asarray(voltage)
+    segments = numpy.array(VOLTAGE_TO_PERCENT_SEGMENTS).reshape(-1, 4, *([1] * voltage.ndim))
+    lower_v, upper_v, lower_p, upper_p = (segments[:, i] for i in range(4))
+    percents = (voltage - lower_v) / (upper_v - lower_v) * (upper_p - lower_p) + lower_p
+    conditions = [voltage >= v for v in lower_v[:-1]]
+    return numpy.select(conditions, list(percents[:-1]), default=percents[-1])
+
+
+def percent_to_voltage_array(percent: "numpy.ndarray") -> "numpy.ndarray":
+    """Same as percent_to_voltage, for an array of percents."""
+    percent = numpy.asarray(percent)
+    segments = numpy.array(VOLTAGE_TO_PERCENT_SEGMENTS).reshape(-1, 4, *([1] * percent.ndim))
+    lower_v, upper_v, lower_p, upper_p = (segments[:, i] for i in range(4))
+    voltages = (percent - lower_p) / (upper_p - lower_p) * (upper_v - lower_v) + lower_v
+    voltages[1:] = numpy.minimum(voltages[1:], upper_v[1:])
+    conditions = [percent >= p for p in lower_p[:-1]]
+    return numpy.select(conditions, list(voltages[:-1]), default=voltages[-1])
+
+
+def sweep_voltage_model(
+    options: Options,
+    max_battery_wh: "numpy.ndarray",
+    solar_w: "numpy.ndarray",
+    project_w: "numpy.ndarray",
+) -> typing.Dict[str, "numpy.ndarray"]:
+    """Runs the voltage model for many configurations at once. max_battery_wh, solar_w and
+    project_w are broadcast together, and everything else comes from options. Day charging isn't
+    modeled. Returns arrays of:
+    - on_fraction: fraction of the time the project was on
+    - min_v: the lowest battery voltage
+    - toggles: how many times the relay switched
+    - final_percent: the state of charge at the end
+    """
+    max_battery_wh, solar_w, project_w = numpy.broadcast_arrays(
+        numpy.asarray(max_battery_wh, dtype=numpy.float64),
+        numpy.asarray(solar_w, dtype=numpy.float64),
+        numpy.asarray(project_w, dtype=numpy.float64),
+    )
+    # The same minutes as run_simulation_data, from noon on the start day to 18:00 on the last
+    START_HOUR = 12
+    END_DAY = 8 if options.start_day == 0 else 7
+    minute_count = (END_DAY - options.start_day) * 24 * 60 + (18 - START_HOUR) * 60 + 1
+    hours = (START_HOUR * 60 + numpy.arange(minute_count)) // 60 % 24
+    minutes = numpy.arange(minute_count) % 60
+    sunlight = [
+        get_sunlight_percentage(int(hour), int(minute), options.std_dev)
+        for hour, minute in zip(hours, minutes)
+    ]
+    profile = numpy.array(options.load_profile_w) if options.load_profile_w else None
+
+    battery_wh = max_battery_wh.copy()
+    on = numpy.ones(battery_wh.shape, dtype=bool)
+    on_minutes = numpy.zeros(battery_wh.shape, dtype=numpy.int64)
+    toggles = numpy.zeros(battery_wh.shape, dtype=numpy.int64)
+    min_v = numpy.full(battery_wh.shape, numpy.inf)
+    max_charge_w = numpy.inf if options.max_charge_w is None else options.max_charge_w
+    for total_minutes in range(1, minute_count + 1):
+        if profile is not None:
+            load_w = numpy.where(on, profile[on_minutes % len(profile)], 0.0) + options.arduino_w
+        else:
+            load_w = numpy.where(on, project_w, 0.0) + options.arduino_w
+        on_minutes += on
+        charge_w = numpy.minimum(sunlight[total_minutes - 1] * solar_w, max_charge_w)
+        net_load_w = load_w - charge_w
+        battery_wh = numpy.clip(battery_wh - net_load_w / 60, 0.0, max_battery_wh)
+
+        open_circuit_v = percent_to_voltage_array(battery_wh / max_battery_wh * 100)
+        voltage = open_circuit_v - net_load_w / open_circuit_v * options.internal_resistance_ohm
+        numpy.minimum(min_v, voltage, out=min_v)
+        if total_minutes % options.relay_toggle_delay_minutes == 0:
+            new_on = numpy.where(on, voltage >= options.off_v, voltage > options.resume_v)
+            toggles += new_on != on
+            on = new_on
+
+    return {
+        "on_fraction": on_minutes / minute_count,
+        "min_v": min_v,
+        "toggles": toggles,
+        "final_percent": battery_wh / max_battery_wh * 100,
+    }
+
 
 def make_parser() -> ArgumentParser:
     """Makes a parser."""
@@ -588,7 +855,7 @@ def make_parser() -> ArgumentParser:
         type=float,
         help="The solar power in W. I have 300 W, but because of Colorado's latitude, they'll likely only produce ~90%% of their rated power.",
         # 90% because we're not at the equator
-        default=300 * 0.9,
+        default=RATED_SOLAR_W * SOLAR_DERATE,
     )
     parser.add_argument(
         "--max-charge-w",
@@ -628,6 +895,20 @@ def make_parser() -> ArgumentParser:
         help=f"The number of Watts the project uses. From testing, it uses {DEFAULT_W:0.0f} W at full brightness while responding to music and {IDLE_W:0.0f} W at idle.",
         default=None,
     )
+    parser.add_argument(
+        "--frames",
+        "-f",
+        type=str,
+        nargs="+",
+        help="Frame files rendered by render_song.py. The project power follows their per-minute power, looped like a playlist, instead of -p or -w.",
+        default=None,
+    )
+    parser.add_argument(
+        "--frame-ms",
+        type=float,
+        help="Milliseconds per frame for frame files that don't have a .json from render_song.py",
+        default=20,
+    )
     parser.add_argument(
         "--start-day",
         "-d",
@@ -658,6 +939,50 @@ def make_parser() -> ArgumentParser:
         help="Always day charge, even if the battery is above the resume percentage",
         action="store_true",
     )
+    parser.add_argument(
+        "--voltage-model",
+        "-v",
+        help="Switch the relay like the voltage monitor does, from the battery voltage every few minutes, instead of from -m and -r",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--off-v",
+        type=float,
+        help="Voltage monitor off voltage",
+        default=slider_to_voltage(DEFAULT_OFF_VOLTAGE_SLIDER),
+    )
+    parser.add_argument(
+        "--resume-v",
+        type=float,
+        help="Voltage monitor resume voltage",
+        default=slider_to_voltage(DEFAULT_RESUME_VOLTAGE_SLIDER),
+    )
+    parser.add_argument(
+        "--internal-resistance",
+        type=float,
+        help="Battery and wiring resistance in ohms, for voltage sag under load",
+        default=DEFAULT_INTERNAL_RESISTANCE_OHM,
+    )
+    parser.add_argument(
+        "--arduino-w",
+        type=float,
+        help="Watts used by the voltage monitor and Phonic Bloom, which are always on",
+        default=ARDUINO_W,
+    )
+    parser.add_argument(
+        "--sweep-battery-wh",
+        type=float,
+        nargs="+",
+        help="Instead of plotting, run the voltage model for each of these battery capacities and print a table",
+        default=None,
+    )
+    parser.add_argument(
+        "--sweep-solar-w",
+        type=float,
+        nargs="+",
+        help="Instead of plotting, run the voltage model for each of these solar powers and print a table",
+        default=None,
+    )
     return parser
 
 
@@ -740,7 +1065,34 @@ if __name__ == "__main__":
     if namespace.brightness < 2:  # Check < 2 in case someone enters .5 instead of 50
         print_error(f"Brightness too low: {namespace.brightness}")
 
-    if namespace.project_w is not None:
+    if namespace.frames is not None and (
+        namespace.project_w is not None or namespace.brightness != 100
+    ):
+        print_error("Can only specify one of frames, project-w and brightness")
+    if namespace.frames is not None and not has_numpy:
+        print_error("numpy is required for frames")
+
+    sweep = namespace.sweep_battery_wh is not None or namespace.sweep_solar_w is not None
+    if sweep and not has_numpy:
+        print_error("numpy is required for sweeps")
+    if sweep and day_charge_hour is not None:
+        print_error("Sweeps don't model day charging")
+    if not MINIMUM_OFF_V <= namespace.off_v < namespace.resume_v:
+        print_error(
+            f"Off voltage ({namespace.off_v}) needs to be at least {MINIMUM_OFF_V} and less than resume voltage ({namespace.resume_v})"
+        )
+    if namespace.internal_resistance < 0:
+        print_error(f"Internal resistance should not be negative, got {namespace.internal_resistance}")
+    if namespace.arduino_w < 0:
+        print_error(f"Arduino power should not be negative, got {namespace.arduino_w}")
+
+    load_profile_w = None
+    if namespace.frames is not None:
+        load_profile_w = load_profile_from_frames(namespace.frames, namespace.frame_ms)
+        if not load_profile_w:
+            print_error("No frames found")
+        project_w = sum(load_profile_w) / len(load_profile_w)
+    elif namespace.project_w is not None:
         project_w = namespace.project_w
     else:
         project_w = (DEFAULT_W - IDLE_W) * namespace.brightness / 100 + IDLE_W
@@ -763,8 +1115,33 @@ if __name__ == "__main__":
         day_charge_until_minute=day_charge_until_minute,
         always_day_charge=namespace.always_day_charge,
         max_charge_w=namespace.max_charge_w,
+        load_profile_w=load_profile_w,
+        voltage_model=namespace.voltage_model or sweep,
+        off_v=namespace.off_v,
+        resume_v=namespace.resume_v,
+        internal_resistance_ohm=namespace.internal_resistance,
+        arduino_w=namespace.arduino_w,
     )
 
+    if sweep:
+        battery_values = numpy.array(namespace.sweep_battery_wh or [namespace.battery_wh])
+        solar_values = numpy.array(namespace.sweep_solar_w or [namespace.solar_w])
+        battery_grid, solar_grid = numpy.meshgrid(battery_values, solar_values, indexing="ij")
+        start = time.time()
+        results = sweep_voltage_model(options, battery_grid, solar_grid, numpy.array(options.project_w))
+        print(
+            f"Ran {battery_grid.size} configurations in {time.time() - start:0.2f} s,"
+            f" off {options.off_v:0.2f} V, resume {options.resume_v:0.2f} V"
+        )
+        print(f"{'battery Wh':>10} {'solar W':>8} {'on':>6} {'min V':>6} {'toggles':>7} {'final':>6}")
+        for index in numpy.ndindex(battery_grid.shape):
+            print(
+                f"{battery_grid[index]:10.0f} {solar_grid[index]:8.0f}"
+                f" {results['on_fraction'][index]:6.1%} {results['min_v'][index]:6.2f}"
+                f" {results['toggles'][index]:7d} {results['final_percent'][index]:5.0f}%"
+            )
+        sys.exit()
+
     # https://www.turbinegenerator.org/solar/colorado/ claims that southern
     # Colorado's peak summer sun hours per day is 5.72
     max_solar_hours = 5.72
@@ -777,16 +1154,27 @@ if __name__ == "__main__":
         sys.stderr.flush()
     print("Running simulation with:")
     print(f"- Battery capacity: {options.max_battery_wh:0.0f} Wh")
-    percent = options.off_battery_wh / options.max_battery_wh * 100
-    print(f"- Off battery: {percent:0.0f}% / {options.off_battery_wh:0.0f} Wh")
-    percent = options.resume_battery_wh / options.max_battery_wh * 100
-    print(f"- Resume battery: {percent:0.0f}% / {options.resume_battery_wh:0.0f} Wh")
+    if options.voltage_model:
+        print(f"- Off voltage: {options.off_v:0.2f} V / {voltage_to_percent(options.off_v):0.0f}%")
+        print(f"- Resume voltage: {options.resume_v:0.2f} V / {voltage_to_percent(options.resume_v):0.0f}%")
+        print(f"- Internal resistance: {options.internal_resistance_ohm:0.3f} ohm")
+    else:
+        percent = options.off_battery_wh / options.max_battery_wh * 100
+        print(f"- Off battery: {percent:0.0f}% / {options.off_battery_wh:0.0f} Wh")
+        percent = options.resume_battery_wh / options.max_battery_wh * 100
+        print(f"- Resume battery: {percent:0.0f}% / {options.resume_battery_wh:0.0f} Wh")
     if day_charge_hour is not None:
         print(f"- Charging during the day starting at {namespace.day_charge}")
     print(f"- Solar power: {options.solar_w:0.0f} W")
     print(f"- Max charging speed: {options.max_charge_w:0.0f} W")
     print(f"- Solar power std dev: {options.std_dev:0.2f}")
     percent = (options.project_w - IDLE_W) / (DEFAULT_W - IDLE_W) * 100
-    print(f"- Project power: {percent:0.0f}% brightness / {options.project_w:0.2f} W")
+    if load_profile_w is not None:
+        print(
+            f"- Project power: {len(load_profile_w)} minute profile from frames,"
+            f" {options.project_w:0.2f} W average, {max(load_profile_w):0.2f} W max"
+        )
+    else:
+        print(f"- Project power: {percent:0.0f}% brightness / {options.project_w:0.2f} W")
     print(f"- Start day: {get_day(options.start_day)}")
     run_simulation(options)
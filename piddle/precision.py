@@ -0,0 +1,310 @@
+"""Measures how much precision each stage of the spectrum analyzer needs.
+
+Reruns the processDSP pipeline with each stage narrowed from float64 to float32, Q31 or Q15, and
+reports how far the note values and rendered LED levels move from the float64 pipeline. This is to
+find which stages of the ESP32 FFT path can move to fixed point without changing the visuals.
+
+The FFT is a vectorized radix-2 FFT that rounds after every butterfly stage. Fixed point values
+are modeled as float64 multiples of their step size, with the scale halved every FFT stage like
+the usual fixed point FFTs, and truncated and saturated like >> and SSAT on the ESP32.
+"""
+
+import argparse
+import dataclasses
+import sys
+import typing
+
+import numpy
+
+import dsp
+import regression
+from steps import make_note_buckets
+
+STAGES = ("window", "fft", "power", "weighting", "normalize")
+# Full scale, in the float pipeline's units, of the values going into each stage
+SAMPLE_FULL_SCALE = 32768.0
+# A-weighting is up to about +2 dB, so give it 1 integer bit
+WEIGHTING_FULL_SCALE = 2.0
+NORMALIZED_FULL_SCALE = 2.0
+
+
+@dataclasses.dataclass
+class Representation:
+    name: str
+    # Fractional bits for fixed point, or None for floating point
+    fraction_bits: typing.Optional[int] = None
+    float_dtype: typing.Type = numpy.float64
+    saturated: int = 0
+    total: int = 0
+
+    def quantize(self, values: numpy.ndarray, full_scale: float, is_constant: bool = False) -> numpy.ndarray:
+        """Rounds values to this representation, where full_scale is the largest magnitude that the
+        fixed point format can hold. Constants like 1.0 saturating to 0x7FFF... is expected, so
+        they aren't counted.
+        """
+        if self.fraction_bits is None:
+            return values.astype(self.float_dtype).astype(numpy.float64)
+        step = full_scale / 2**self.fraction_bits
+        steps = numpy.floor(values / step)
+        limit = 2**self.fraction_bits
+        if not is_constant:
+            self.saturated += int(((steps < -limit) | (steps > limit - 1)).sum())
+            self.total += values.size
+        return numpy.clip(steps, -limit, limit - 1) * step
+
+
+def make_representations() -> typing.Dict[str, Representation]:
+    return {
+        "float64": Representation("float64"),
+        "float32": Representation("float32", float_dtype=numpy.float32),
+        "q31": Representation("q31", fraction_bits=31),
+        "q15": Representation("q15", fraction_bits=15),
+    }
+
+
+def bit_reverse(count: int) -> numpy.ndarray:
+    """Returns the bit reversed index permutation for a radix-2 FFT of count values."""
+    bits = count.bit_length() - 1
+    indexes = numpy.arange(count)
+    reversed_indexes = numpy.zeros(count, dtype=numpy.intp)
+    for bit in range(bits):
+        reversed_indexes |= ((indexes >> bit) & 1) << (bits - 1 - bit)
+    return reversed_indexes
+
+
+def radix2_fft(
+    values: numpy.ndarray, representation: Representation
+) -> typing.Tuple[numpy.ndarray, numpy.ndarray]:
+    """FFT of each real row, rounding the twiddles and every butterfly stage to representation.
+    Returns the real and imaginary parts, in the same units as numpy.fft.fft.
+    """
+    frame_count, count = values.shape
+    real = values[:, bit_reverse(count)]
+    imaginary = numpy.zeros_like(real)
+    full_scale = SAMPLE_FULL_SCALE
+    half = 1
+    while half < count:
+        angles = -numpy.pi * numpy.arange(half) / half
+        twiddle_real = representation.quantize(numpy.cos(angles), 1.0, is_constant=True)
+        twiddle_imaginary = representation.quantize(numpy.sin(angles), 1.0, is_constant=True)
+
+        real = real.reshape(frame_count, count // (2 * half), 2, half)
+        imaginary = imaginary.reshape(frame_count, count // (2 * half), 2, half)
+        product_real = representation.quantize(
+            real[:, :, 1] * twiddle_real - imaginary[:, :, 1] * twiddle_imaginary, full_scale
+        )
+        product_imaginary = representation.quantize(
+            real[:, :, 1] * twiddle_imaginary + imaginary[:, :, 1] * twiddle_real, full_scale
+        )
+        # Fixed point FFTs halve every stage to avoid overflow, so full scale doubles
+        full_scale *= 2
+        real = representation.quantize(
+            numpy.stack((real[:, :, 0] + product_real, real[:, :, 0] - product_real), axis=2), full_scale
+        ).reshape(frame_count, count)
+        imaginary = representation.quantize(
+            numpy.stack((imaginary[:, :, 0] + product_imaginary, imaginary[:, :, 0] - product_imaginary), axis=2),
+            full_scale,
+        ).reshape(frame_count, count)
+        half *= 2
+    return real, imaginary
+
+
+@dataclasses.dataclass
+class Pipeline:
+    """Which representation each stage uses."""
+    stages: typing.Dict[str, Representation]
+    windowing_constants: numpy.ndarray
+    weighting_constants: numpy.ndarray
+    note_to_output_index: numpy.ndarray
+
+    def quantize(self, stage: str, values: numpy.ndarray, full_scale: float) -> numpy.ndarray:
+        return self.stages[stage].quantize(values, full_scale)
+
+
+def make_pipeline(stages: typing.Dict[str, Representation]) -> Pipeline:
+    """Makes a pipeline with float64 constants, rounded by the stages that use them."""
+    offsets = numpy.arange(dsp.SAMPLE_COUNT)
+    frequencies = dsp.SAMPLE_RATE / dsp.SAMPLE_COUNT * (offsets + 1.0)
+    return Pipeline(
+        stages=stages,
+        windowing_constants=stages["window"].quantize(
+            dsp.windowing_multiplier(offsets, dsp.SAMPLE_COUNT, numpy.float64), 1.0, is_constant=True
+        ),
+        weighting_constants=stages["weighting"].quantize(
+            dsp.a_weighting_multiplier(frequencies, numpy.float64), WEIGHTING_FULL_SCALE, is_constant=True
+        ),
+        note_to_output_index=dsp.NOTE_TO_OUTPUT_INDEX,
+    )
+
+
+def process(pipeline: Pipeline, frames: numpy.ndarray, sensitivity_p: int) -> numpy.ndarray:
+    """processDSP with each stage rounded to its representation. frames is (frame count,
+    SAMPLE_COUNT) int16. Returns (frame count, NOTE_COUNT) float64 note values.
+    """
+    sample_count = dsp.SAMPLE_COUNT
+    half = sample_count // 2
+    windowed = pipeline.quantize(
+        "window", frames.astype(numpy.float64) * pipeline.windowing_constants, SAMPLE_FULL_SCALE
+    )
+    real, imaginary = radix2_fft(windowed, pipeline.stages["fft"])
+
+    # The same layout as dsp.compute_power_spectra
+    fft_full_scale = SAMPLE_FULL_SCALE * sample_count
+    output = numpy.zeros((len(frames), sample_count))
+    output[:, 2::2] = real[:, 1:half]
+    output[:, 3::2] = imaginary[:, 1:half]
+    output[:, sample_count - 1] = 0.0
+    power_full_scale = fft_full_scale**2
+    output[:, :half] = pipeline.quantize(
+        "power", dsp.square(output[:, 0::2]) + dsp.square(output[:, 1::2]), power_full_scale
+    )
+
+    # The raw FFT values in the second half have a different scale than the power
+    output *= pipeline.weighting_constants
+    output[:, :half] = pipeline.quantize(
+        "weighting", output[:, :half], power_full_scale * WEIGHTING_FULL_SCALE
+    )
+    output[:, half:] = pipeline.quantize(
+        "weighting", output[:, half:], fft_full_scale * WEIGHTING_FULL_SCALE
+    )
+
+    output -= output.min(axis=1, keepdims=True)
+    divisor = numpy.maximum(output.max(axis=1, keepdims=True), float(dsp.minimum_divisor(sensitivity_p)))
+    # Normalized values include 1.0, so they need an integer bit
+    output = pipeline.quantize("normalize", output / divisor, NORMALIZED_FULL_SCALE)
+    indexes = pipeline.note_to_output_index
+    return numpy.maximum.reduceat(output[:, : indexes[-1] + 1], indexes, axis=1)
+
+
+def led_levels(note_values: numpy.ndarray) -> numpy.ndarray:
+    """The value that renderFft truncates each note to."""
+    return numpy.minimum(note_values * 254, 255).astype(numpy.int16)
+
+
+@dataclasses.dataclass
+class ErrorStats:
+    """Note value error against the float64 pipeline, accumulated over batches."""
+    max_error: numpy.ndarray = dataclasses.field(default_factory=lambda: numpy.zeros(dsp.NOTE_COUNT))
+    error_sum: numpy.ndarray = dataclasses.field(default_factory=lambda: numpy.zeros(dsp.NOTE_COUNT))
+    level_mismatches: numpy.ndarray = dataclasses.field(default_factory=lambda: numpy.zeros(dsp.NOTE_COUNT))
+    max_level_error: int = 0
+    frame_count: int = 0
+
+    def add(self, reference: numpy.ndarray, note_values: numpy.ndarray) -> None:
+        error = numpy.abs(note_values - reference)
+        self.max_error = numpy.maximum(self.max_error, error.max(axis=0))
+        self.error_sum += error.sum(axis=0)
+        level_error = numpy.abs(led_levels(note_values) - led_levels(reference))
+        self.level_mismatches += (level_error > 0).sum(axis=0)
+        self.max_level_error = max(self.max_level_error, int(level_error.max(initial=0)))
+        self.frame_count += len(reference)
+
+
+def make_configurations() -> typing.List[typing.Tuple[str, str, Pipeline]]:
+    """Returns (representation, narrowed stage, pipeline) for narrowing each stage on its own,
+    and for narrowing every stage at once.
+    """
+    configurations = []
+    for name in ("float32", "q31", "q15"):
+        for stage in STAGES + ("all",):
+            representations = make_representations()
+            stages = {
+                each: representations[name] if stage in (each, "all") else representations["float64"]
+                for each in STAGES
+            }
+            configurations.append((name, stage, make_pipeline(stages)))
+    return configurations
+
+
+def load_corpus(audio_files: typing.List[str], hop: int) -> typing.List[typing.Tuple[str, numpy.ndarray]]:
+    """Returns (name, frames) for each audio file, or for the regression.py signals if there
+    aren't any.
+    """
+    if audio_files:
+        return [(path, dsp.frame_audio(dsp.load_audio(path), hop)) for path in audio_files]
+    return [
+        (case.name, dsp.frame_audio(regression.to_samples(case.signal()), hop))
+        for case in regression.CASES
+        if case.signal is not regression.silence_signal
+    ]
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Measures the note value error from narrowing each DSP stage.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "audio_files", nargs="*", help="Audio files, anything ffmpeg can decode. Uses synthetic signals if none."
+    )
+    parser.add_argument("--hop", type=int, default=1024, help="Samples between frames")
+    parser.add_argument("--sensitivity", "-s", type=int, default=50, help="Sensitivity, 0-100")
+    parser.add_argument("--batch-size", type=int, default=256, help="Frames per batch")
+    parser.add_argument(
+        "--max-level-error",
+        type=int,
+        default=1,
+        help="Largest change in a rendered note level that's still considered safe",
+    )
+    parser.add_argument(
+        "--per-note",
+        type=str,
+        choices=("float32", "q31", "q15"),
+        help="Print the error for each note for this representation, with every stage narrowed"
+    )
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+    if not 0 <= args.sensitivity <= 100:
+        sys.stderr.write(f"Error: sensitivity should be 0-100, got {args.sensitivity}\n")
+        sys.exit(1)
+
+    reference_pipeline = make_pipeline(
+        {stage: make_representations()["float64"] for stage in STAGES}
+    )
+    configurations = make_configurations()
+    stats = [ErrorStats() for _ in configurations]
+    for _name, frames in load_corpus(args.audio_files, args.hop):
+        for _start, batch in dsp.iterate_batches(frames, args.batch_size):
+            reference = process(reference_pipeline, batch, args.sensitivity)
+            for (_representation, _stage, pipeline), stat in zip(configurations, stats):
+                stat.add(reference, process(pipeline, batch, args.sensitivity))
+
+    print(f"Error against float64 over {stats[0].frame_count} frames")
+    print(
+        f"{'format':>8} {'stage':>10} {'max error':>10} {'mean error':>10} {'levels off':>10}"
+        f" {'max level':>9} {'saturated':>9}  safe"
+    )
+    for (representation, stage, pipeline), stat in zip(configurations, stats):
+        representations = {id(each): each for each in pipeline.stages.values()}.values()
+        saturated = sum(each.saturated for each in representations)
+        total = sum(each.total for each in representations)
+        note_count = stat.frame_count * dsp.NOTE_COUNT
+        safe = stat.max_level_error <= args.max_level_error and saturated == 0
+        print(
+            f"{representation:>8} {stage:>10} {stat.max_error.max():10.2e}"
+            f" {stat.error_sum.sum() / max(note_count, 1):10.2e}"
+            f" {stat.level_mismatches.sum() / max(note_count, 1):10.2%} {stat.max_level_error:9d}"
+            f" {saturated / max(total, 1):9.2%}  {'yes' if safe else 'no'}"
+        )
+
+    if args.per_note:
+        names = [" ".join(bucket[3]) for bucket in make_note_buckets(dsp.SAMPLE_COUNT, dsp.SAMPLE_RATE, True).buckets]
+        print(f"\nPer note error for {args.per_note} with every stage narrowed")
+        print(f"{'note':>16} {'max error':>10} {'mean error':>10} {'levels off':>10}")
+        for (representation, stage, _pipeline), stat in zip(configurations, stats):
+            if representation != args.per_note or stage != "all":
+                continue
+            for note, name in enumerate(names):
+                print(
+                    f"{name:>16} {stat.max_error[note]:10.2e} {stat.error_sum[note] / max(stat.frame_count, 1):10.2e}"
+                    f" {stat.level_mismatches[note] / max(stat.frame_count, 1):10.2%}"
+                )
+
+
+if __name__ == "__main__":
+    main()
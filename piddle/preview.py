@@ -0,0 +1,400 @@
+"""Renders LED frames to an MP4 or GIF preview, like sim/display.cpp draws them.
+
+Frames can be a .npy from render_song.py or an ArtNet capture, as (frame count, strip count, LEDs
+per strip, 3) or (frame count, LED count, 3) RGB, or a vest .anim from vest/video/video.py. Each
+LED is drawn with a precomputed splat mask, all at once for a batch of frames, in a pool of
+workers, and the frames are piped to ffmpeg in order.
+
+Usage:
+    python3 preview.py song.npy -o song.mp4
+    python3 preview.py ../vest/video/movie.anim --geometry vest -o movie.gif
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import subprocess
+import sys
+import time
+import typing
+
+import numpy
+
+# These match sim/display.cpp
+DOME_IMAGE_SIZE = 750
+DOME_START_RADIUS = 20
+DOT_RADIUS = 4
+CENTER_COLOR = (40, 40, 40)
+VEST_DOT_SPACING = 20
+DEFAULT_FRAME_MS = 20
+DEFAULT_BATCH_SIZE = 64
+# Browsers slow down GIFs faster than this
+MAX_GIF_FPS = 25
+
+
+@dataclasses.dataclass
+class Geometry:
+    """Where each LED is drawn."""
+    width: int
+    height: int
+    # (LED count, 2) x, y pixel centers
+    positions: numpy.ndarray
+    # Which LED in a (frame count, LED count, 3) frame each position shows
+    led_indexes: numpy.ndarray
+    dot_radius: int = DOT_RADIUS
+    center_radius: int = 0
+
+
+def dome_geometry(strip_count: int, leds_per_strip: int, size: int = DOME_IMAGE_SIZE) -> Geometry:
+    """Radial strips at equal angles, starting at the top and going clockwise, like the sim.
+    Dots are spaced to fit the image.
+    """
+    center = size // 2
+    spacing = max(1.0, (center - DOME_START_RADIUS - DOT_RADIUS) / leds_per_strip)
+    dot_radius = max(1, min(DOT_RADIUS, int(spacing * 0.4)))
+    angles = numpy.radians(90.0 - numpy.arange(strip_count) * (360.0 / strip_count))
+    radii = DOME_START_RADIUS + numpy.arange(leds_per_strip) * spacing
+    x = center + (radii[numpy.newaxis, :] * numpy.cos(angles)[:, numpy.newaxis]).astype(int)
+    y = center - (radii[numpy.newaxis, :] * numpy.sin(angles)[:, numpy.newaxis]).astype(int)
+    return Geometry(
+        width=size,
+        height=size,
+        positions=numpy.stack((x.ravel(), y.ravel()), axis=1),
+        led_indexes=numpy.arange(strip_count * leds_per_strip),
+        dot_radius=dot_radius,
+        center_radius=DOME_START_RADIUS - 8,
+    )
+
+
+def grid_geometry(column_count: int, row_count: int, spacing: int = VEST_DOT_SPACING) -> Geometry:
+    """Row-major grid, with row 0 at the top."""
+    rows, columns = numpy.divmod(numpy.arange(row_count * column_count), column_count)
+    return Geometry(
+        width=column_count * spacing,
+        height=row_count * spacing,
+        positions=numpy.stack((columns * spacing + spacing // 2, rows * spacing + spacing // 2), axis=1),
+        led_indexes=numpy.arange(row_count * column_count),
+        dot_radius=spacing * 2 // 5,
+    )
+
+
+def load_vest_layout():
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "vest"))
+    import offsets
+
+    return offsets.VestLayout.load()
+
+
+def vest_geometry(spacing: int = VEST_DOT_SPACING) -> Geometry:
+    """Physical vest LEDs in leds[] order, placed with the offsets.py layout. Unused LEDs aren't
+    drawn.
+    """
+    layout = load_vest_layout()
+    grid = grid_geometry(layout.column_count, layout.row_count, spacing)
+    led_to_pixel = layout.led_to_pixel
+    used = numpy.flatnonzero(led_to_pixel >= 0)
+    grid.positions = grid.positions[led_to_pixel[used]]
+    grid.led_indexes = used
+    return grid
+
+
+def make_splat(radius: int) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Returns the (dy, dx, weight) offsets of an antialiased filled circle, weight out of 256."""
+    dy, dx = numpy.mgrid[-radius - 1 : radius + 2, -radius - 1 : radius + 2]
+    distance = numpy.sqrt(dy * dy + dx * dx)
+    weight = numpy.clip(radius + 0.5 - distance, 0.0, 1.0)
+    inside = weight > 0
+    return dy[inside], dx[inside], numpy.round(weight[inside] * 256).astype(numpy.uint16)
+
+
+@dataclasses.dataclass
+class Splats:
+    """Flat pixel indexes and weights for every LED's splat, precomputed once."""
+    # (LED count * splat size) flat pixel indexes
+    pixels: numpy.ndarray
+    # (splat size,) weights out of 256
+    weights: numpy.ndarray
+    background: numpy.ndarray
+    # Splats of close LEDs overlap, so they're composited with a max: order sorts pixels, and each
+    # of unique_pixels starts a run of equal pixels at starts
+    order: numpy.ndarray
+    unique_pixels: numpy.ndarray
+    starts: numpy.ndarray
+
+
+def make_splats(geometry: Geometry) -> Splats:
+    dy, dx, weights = make_splat(geometry.dot_radius)
+    x = numpy.clip(geometry.positions[:, 0:1] + dx, 0, geometry.width - 1)
+    y = numpy.clip(geometry.positions[:, 1:2] + dy, 0, geometry.height - 1)
+    background = numpy.zeros((geometry.height, geometry.width, 3), dtype=numpy.uint8)
+    if geometry.center_radius > 0:
+        cy, cx, center_weights = make_splat(geometry.center_radius)
+        center = (geometry.height // 2 + cy, geometry.width // 2 + cx)
+        background[center] = (numpy.array(CENTER_COLOR) * center_weights[:, numpy.newaxis] >> 8).astype(numpy.uint8)
+    pixels = (y * geometry.width + x).ravel()
+    order = numpy.argsort(pixels, kind="stable")
+    unique_pixels, starts = numpy.unique(pixels[order], return_index=True)
+    return Splats(
+        pixels=pixels,
+        weights=weights,
+        background=background,
+        order=order,
+        unique_pixels=unique_pixels,
+        starts=starts,
+    )
+
+
+def rasterize(frames: numpy.ndarray, geometry: Geometry, splats: Splats) -> numpy.ndarray:
+    """Draws a batch of (frame count, LED count, 3) RGB frames. Returns (frame count, height,
+    width, 3) uint8.
+    """
+    colors = frames[:, geometry.led_indexes].astype(numpy.uint16)
+    # (frame count, LED count, splat size, 3), flattened to match splats.pixels
+    splatted = (colors[:, :, numpy.newaxis, :] * splats.weights[:, numpy.newaxis]) >> 8
+    images = numpy.repeat(splats.background[numpy.newaxis], len(frames), axis=0)
+    flat = images.reshape(len(frames), -1, 3)
+    # Brightest splat wins, so the dim edges of one LED don't cover the center of the next
+    ordered = splatted.reshape(len(frames), -1, 3)[:, splats.order].astype(numpy.uint8)
+    brightest = numpy.maximum.reduceat(ordered, splats.starts, axis=1)
+    flat[:, splats.unique_pixels] = numpy.maximum(flat[:, splats.unique_pixels], brightest)
+    return images
+
+
+@dataclasses.dataclass
+class FrameFile:
+    """Fixed size frames in a file, so workers can memory map them."""
+    path: str
+    offset: int
+    frame_count: int
+    led_count: int
+    # Bytes per LED, and which of those bytes are R, G and B
+    channels: int
+    rgb_order: typing.Tuple[int, int, int]
+    frame_ms: float
+
+    def open(self) -> numpy.ndarray:
+        """Returns (frame count, LED count, channels) uint8 memory mapped."""
+        return numpy.memmap(
+            self.path,
+            dtype=numpy.uint8,
+            mode="r",
+            offset=self.offset,
+            shape=(self.frame_count, self.led_count, self.channels),
+        )
+
+
+def load_npy(path: str, default_frame_ms: float) -> typing.Tuple[FrameFile, typing.Tuple[int, ...]]:
+    """Reads a .npy header and the render_song.py .json if there is one. Returns the frame file
+    and the shape of each frame.
+    """
+    with open(path, "rb") as file:
+        version = numpy.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if dtype != numpy.uint8 or fortran_order or shape[-1] != 3:
+        raise ValueError(f"{path} should be C order uint8 RGB frames, got {dtype} {shape}")
+    frame_ms = default_frame_ms
+    if os.path.exists(path + ".json"):
+        with open(path + ".json") as file:
+            frame_ms = json.load(file).get("frame_ms", default_frame_ms)
+    frame_file = FrameFile(path, offset, shape[0], math.prod(shape[1:-1]), 3, (0, 1, 2), frame_ms)
+    return frame_file, shape[1:]
+
+
+def load_anim(path: str, physical_led_count: int, anim_format: str) -> FrameFile:
+    """Reads a vest .anim header. Grid files start with width and height bytes and have BGRx
+    pixels. Physical files only have the frame time and are RGB in leds[] order.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        header = file.read(4)
+    if anim_format == "auto":
+        width, height = header[0], header[1]
+        is_grid = width > 0 and height > 0 and (size - 4) % (width * height * 4) == 0
+        anim_format = "grid" if is_grid else "physical"
+    if anim_format == "grid":
+        width, height = header[0], header[1]
+        frame_ms = int.from_bytes(header[2:4], "little")
+        frame_count = (size - 4) // (width * height * 4)
+        return FrameFile(path, 4, frame_count, width * height, 4, (2, 1, 0), frame_ms)
+    frame_ms = int.from_bytes(header[0:2], "little")
+    frame_count = (size - 2) // (physical_led_count * 3)
+    return FrameFile(path, 2, frame_count, physical_led_count, 3, (0, 1, 2), frame_ms)
+
+
+# Per worker state, set by init_worker
+_worker_state: typing.Dict[str, typing.Any] = {}
+
+
+def init_worker(frame_file: FrameFile, geometry: Geometry, step: int) -> None:
+    _worker_state["frames"] = frame_file.open()
+    _worker_state["frame_file"] = frame_file
+    _worker_state["geometry"] = geometry
+    _worker_state["splats"] = make_splats(geometry)
+    _worker_state["step"] = step
+
+
+def rasterize_batch(bounds: typing.Tuple[int, int]) -> bytes:
+    """Rasterizes frames[start:stop:step] in a worker, and returns raw RGB24 bytes."""
+    start, stop = bounds
+    frame_file = _worker_state["frame_file"]
+    frames = _worker_state["frames"][start : stop : _worker_state["step"]]
+    rgb = frames[:, :, list(frame_file.rgb_order)]
+    return rasterize(rgb, _worker_state["geometry"], _worker_state["splats"]).tobytes()
+
+
+def ffmpeg_command(output: str, width: int, height: int, fps: float) -> typing.List[str]:
+    command = [
+        "ffmpeg", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", f"{fps:g}", "-i", "-",
+    ]
+    if output.lower().endswith(".gif"):
+        command += ["-vf", "split[a][b];[a]palettegen[p];[b][p]paletteuse"]
+    else:
+        # yuv420p needs even dimensions
+        command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p"]
+    return command + [output]
+
+
+def render_preview(
+    frame_file: FrameFile,
+    geometry: Geometry,
+    output: str,
+    processes: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_fps: typing.Optional[float] = None,
+) -> int:
+    """Rasterizes every frame in a pool of workers and encodes them with ffmpeg. Returns how many
+    frames were written.
+    """
+    fps = 1000 / frame_file.frame_ms
+    step = 1
+    if max_fps is not None and fps > max_fps:
+        step = math.ceil(fps / max_fps)
+    # Batches start on a multiple of step so skipping frames is consistent across batches
+    batch_frames = batch_size * step
+    bounds = [
+        (start, min(start + batch_frames, frame_file.frame_count))
+        for start in range(0, frame_file.frame_count, batch_frames)
+    ]
+
+    encoder = subprocess.Popen(
+        ffmpeg_command(output, geometry.width, geometry.height, fps / step), stdin=subprocess.PIPE
+    )
+    frame_bytes = geometry.width * geometry.height * 3
+    written = 0
+    pool = None
+    try:
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(frame_file, geometry, step))
+            batches = pool.imap(rasterize_batch, bounds)
+        else:
+            # Sending frames back from a single worker would only add copies
+            init_worker(frame_file, geometry, step)
+            batches = map(rasterize_batch, bounds)
+        for data in batches:
+            encoder.stdin.write(data)
+            written += len(data) // frame_bytes
+    finally:
+        if pool is not None:
+            pool.terminate()
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with {encoder.returncode}")
+    return written
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Renders LED frames to an MP4 or GIF preview.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("frames", help=".npy frames, or a vest .anim")
+    parser.add_argument("--output", "-o", type=str, required=True, help="Output .mp4 or .gif")
+    parser.add_argument(
+        "--geometry",
+        "-g",
+        type=str,
+        choices=("dome", "vest"),
+        help="LED layout. Defaults to vest for .anim files and dome otherwise.",
+    )
+    parser.add_argument(
+        "--anim-format",
+        type=str,
+        choices=("auto", "grid", "physical"),
+        default="auto",
+        help="Vest .anim format, grid from video.py or physical from video.py --physical",
+    )
+    parser.add_argument("--strip-count", type=int, default=15, help="Dome strips, for (frame count, LED count, 3) frames")
+    parser.add_argument("--size", type=int, default=DOME_IMAGE_SIZE, help="Dome image size in pixels")
+    parser.add_argument("--frame-ms", type=float, default=DEFAULT_FRAME_MS, help="Milliseconds per frame for .npy files without a .json")
+    parser.add_argument("--max-fps", type=float, help=f"Skip frames to stay under this. Defaults to {MAX_GIF_FPS} for GIFs.")
+    parser.add_argument("--processes", "-j", type=int, default=os.cpu_count() or 1, help="Rasterizing workers")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Frames per batch")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.processes < 1:
+        print_error(f"Processes should be positive, got {args.processes}")
+    is_anim = args.frames.endswith(".anim")
+    geometry_name = args.geometry or ("vest" if is_anim else "dome")
+
+    if is_anim:
+        layout = load_vest_layout()
+        frame_file = load_anim(args.frames, layout.led_count, args.anim_format)
+    else:
+        frame_file, frame_shape = load_npy(args.frames, args.frame_ms)
+
+    if geometry_name == "dome":
+        if is_anim:
+            print_error("Vest .anim files can't be drawn as a dome")
+        if len(frame_shape) == 3:
+            strip_count, leds_per_strip = frame_shape[0], frame_shape[1]
+        elif frame_file.led_count % args.strip_count == 0:
+            strip_count, leds_per_strip = args.strip_count, frame_file.led_count // args.strip_count
+        else:
+            print_error(f"{frame_file.led_count} LEDs don't divide into {args.strip_count} strips")
+        geometry = dome_geometry(strip_count, leds_per_strip, args.size)
+    elif frame_file.channels == 4:
+        # Grid .anim files are row-major
+        width = int(numpy.fromfile(args.frames, dtype=numpy.uint8, count=1)[0])
+        geometry = grid_geometry(width, frame_file.led_count // width)
+    else:
+        geometry = vest_geometry()
+        if frame_file.led_count < geometry.led_indexes.max() + 1:
+            print_error(f"Frames have {frame_file.led_count} LEDs, but the vest has {len(geometry.led_indexes)}")
+
+    max_fps = args.max_fps
+    if max_fps is None and args.output.lower().endswith(".gif"):
+        max_fps = MAX_GIF_FPS
+
+    start = time.time()
+    written = render_preview(frame_file, geometry, args.output, args.processes, args.batch_size, max_fps)
+    elapsed = time.time() - start
+    seconds = frame_file.frame_count * frame_file.frame_ms / 1000
+    print(
+        f"Wrote {written} frames from {seconds:0.1f} s of LEDs in {elapsed:0.2f} s"
+        f" ({seconds / max(elapsed, 1e-9):0.0f}x real time) to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Golden frame regression checks for the DSP and renderer.
+
+Feeds fixed synthetic signals through the NumPy ports in dsp.py and renderer.py, and optionally
+through the C++ sim (sim/golden.cpp), and diffs the note values and LED frames against goldens
+saved in golden/. Each stage is timed, so the hot path can be optimized without silently changing
+what the dome looks like.
+
+Usage:
+    python3 regression.py                        Check the NumPy ports
+    python3 regression.py --sim build/golden     Also check the C++ sim
+    python3 regression.py --sim build/golden --update
+                                                 Regenerate the goldens from the C++ sim
+"""
+
+import argparse
+import dataclasses
+import os
+import subprocess
+import sys
+import time
+import typing
+
+import numpy
+
+import dsp
+import renderer
+import render_song
+import steps
+
+GOLDEN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+FRAME_MS = 20
+AMPLITUDE = 8000
+# Float differences between esp32-fft and numpy are around 1e-6
+NOTE_TOLERANCE = 1e-5
+# ...which can occasionally move a truncated note value by 1, and gamma correction doubles that
+LED_TOLERANCE = 2
+LED_MISMATCH_FRACTION = 0.01
+
+
+def sweep_signal() -> numpy.ndarray:
+    """Logarithmic sine sweep over the note range."""
+    seconds = 4.0
+    t = numpy.arange(int(dsp.SAMPLE_RATE * seconds)) / dsp.SAMPLE_RATE
+    start, end = 30.0, 8000.0
+    rate = numpy.log(end / start) / seconds
+    phase = 2 * numpy.pi * start * (numpy.exp(rate * t) - 1) / rate
+    return numpy.sin(phase) * AMPLITUDE
+
+
+def notes_signal() -> numpy.ndarray:
+    """Each note from the steps.py table in turn."""
+    note_seconds = 0.06
+    t = numpy.arange(int(dsp.SAMPLE_RATE * note_seconds)) / dsp.SAMPLE_RATE
+    return numpy.concatenate(
+        [numpy.sin(2 * numpy.pi * frequency * t) * AMPLITUDE for frequency, _name in steps.notes]
+    )
+
+
+def noise_signal() -> numpy.ndarray:
+    """Seeded white noise with a few louder bursts."""
+    seconds = 3.0
+    rng = numpy.random.default_rng(0)
+    noise = rng.normal(0, AMPLITUDE / 4, int(dsp.SAMPLE_RATE * seconds))
+    bursts = (numpy.arange(len(noise)) // (dsp.SAMPLE_RATE // 4)) % 3 == 0
+    return noise * numpy.where(bursts, 3.0, 1.0)
+
+
+def silence_signal() -> numpy.ndarray:
+    return numpy.zeros(dsp.SAMPLE_RATE)
+
+
+def to_samples(signal: numpy.ndarray) -> numpy.ndarray:
+    limits = numpy.iinfo(numpy.int16)
+    return numpy.clip(numpy.round(signal), limits.min, limits.max).astype(numpy.int16)
+
+
+@dataclasses.dataclass(frozen=True)
+class Case:
+    name: str
+    signal: typing.Callable[[], numpy.ndarray]
+    sensitivity_p: int = 50
+    rainbow: bool = False
+    normalize_bands: bool = False
+    pattern_length: int = 24
+    tile_offset: int = 2
+
+
+CASES = (
+    Case("sweep", sweep_signal),
+    Case("sweep_rainbow_normalized", sweep_signal, rainbow=True, normalize_bands=True),
+    Case("notes", notes_signal, sensitivity_p=80, pattern_length=13, tile_offset=7),
+    Case("noise", noise_signal, sensitivity_p=20, normalize_bands=True, pattern_length=50, tile_offset=0),
+    Case("silence", silence_signal),
+)
+
+
+@dataclasses.dataclass
+class Output:
+    note_values: numpy.ndarray
+    leds: numpy.ndarray
+
+
+def case_windows(case: Case) -> numpy.ndarray:
+    """Returns the (frame count, SAMPLE_COUNT) int16 windows for a case."""
+    samples = to_samples(case.signal())
+    starts = render_song.frame_windows(samples, FRAME_MS)
+    return numpy.lib.stride_tricks.sliding_window_view(samples, dsp.SAMPLE_COUNT)[starts]
+
+
+def run_numpy(case: Case, windows: numpy.ndarray, timings: typing.Dict[str, float]) -> Output:
+    """Runs the NumPy ports, adding the time for each stage to timings."""
+    state = dsp.init_dsp()
+    start = time.perf_counter()
+    spectra = dsp.compute_spectra(state, windows)
+    timings["fft"] = timings.get("fft", 0.0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    note_values = dsp.normalize_and_pool(state, spectra, case.sensitivity_p)
+    timings["normalize"] = timings.get("normalize", 0.0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    millis = (numpy.arange(len(windows)) * FRAME_MS).astype(numpy.uint32)
+    leds = renderer.render_fft(
+        renderer.init_renderer(),
+        note_values,
+        case.rainbow,
+        case.normalize_bands,
+        millis,
+        case.pattern_length,
+        case.tile_offset,
+    )
+    timings["render"] = timings.get("render", 0.0) + time.perf_counter() - start
+    return Output(note_values, leds)
+
+
+def run_sim(case: Case, windows: numpy.ndarray, sim: str, timings: typing.Dict[str, float]) -> Output:
+    """Runs the C++ sim DSP and renderer through sim/golden.cpp."""
+    command = [
+        sim,
+        str(case.sensitivity_p),
+        str(int(case.rainbow)),
+        str(int(case.normalize_bands)),
+        str(case.pattern_length),
+        str(case.tile_offset),
+        str(FRAME_MS),
+    ]
+    start = time.perf_counter()
+    result = subprocess.run(command, input=windows.tobytes(), stdout=subprocess.PIPE, check=True)
+    timings["sim"] = timings.get("sim", 0.0) + time.perf_counter() - start
+
+    led_count = renderer.STRIP_COUNT * renderer.LEDS_PER_STRIP * 3
+    frame_dtype = numpy.dtype([("notes", "<f4", dsp.NOTE_COUNT), ("leds", "u1", led_count)])
+    frames = numpy.frombuffer(result.stdout, dtype=frame_dtype)
+    leds = frames["leds"].reshape(len(frames), renderer.STRIP_COUNT, renderer.LEDS_PER_STRIP, 3)
+    return Output(frames["notes"].copy(), leds.copy())
+
+
+def golden_path(case: Case) -> str:
+    return os.path.join(GOLDEN_DIRECTORY, f"{case.name}.npz")
+
+
+def save_golden(case: Case, output: Output) -> None:
+    os.makedirs(GOLDEN_DIRECTORY, exist_ok=True)
+    numpy.savez_compressed(golden_path(case), note_values=output.note_values, leds=output.leds)
+
+
+def load_golden(case: Case) -> Output:
+    with numpy.load(golden_path(case)) as golden:
+        return Output(golden["note_values"], golden["leds"])
+
+
+def compare(expected: Output, actual: Output) -> typing.List[str]:
+    """Returns a description of each difference that's over tolerance."""
+    if expected.leds.shape != actual.leds.shape:
+        return [f"LED shape {actual.leds.shape} != {expected.leds.shape}"]
+    problems = []
+    note_error = float(numpy.abs(expected.note_values - actual.note_values).max(initial=0.0))
+    if note_error > NOTE_TOLERANCE:
+        problems.append(f"note values differ by up to {note_error:0.3g}")
+
+    led_error = numpy.abs(expected.leds.astype(numpy.int16) - actual.leds)
+    if led_error.max(initial=0) > LED_TOLERANCE:
+        frame = int(numpy.argmax(led_error.reshape(len(led_error), -1).max(axis=1)))
+        problems.append(f"LEDs differ by up to {led_error.max()}, first in frame {frame}")
+    mismatch_fraction = float((led_error > 0).mean()) if led_error.size else 0.0
+    if mismatch_fraction > LED_MISMATCH_FRACTION:
+        problems.append(f"{mismatch_fraction:0.2%} of LED channels differ")
+    return problems
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Checks the DSP and renderer against golden frames.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--sim", type=str, help="Path to the golden binary built from sim/")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Regenerate the goldens, from the sim if --sim is given, otherwise from the NumPy ports",
+    )
+    parser.add_argument("--case", "-c", type=str, nargs="+", choices=[case.name for case in CASES], help="Cases to run")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+    cases = [case for case in CASES if args.case is None or case.name in args.case]
+
+    failed = False
+    timings: typing.Dict[str, float] = {}
+    frame_count = 0
+    for case in cases:
+        windows = case_windows(case)
+        frame_count += len(windows)
+        outputs = {"numpy": run_numpy(case, windows, timings)}
+        if args.sim:
+            outputs["sim"] = run_sim(case, windows, args.sim, timings)
+
+        if args.update:
+            save_golden(case, outputs["sim" if args.sim else "numpy"])
+            print(f"{case.name}: saved {len(windows)} frames")
+            continue
+
+        golden = load_golden(case)
+        for source, output in outputs.items():
+            problems = compare(golden, output)
+            print(f"{case.name} {source}: {'FAIL' if problems else 'ok'}")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+
+    print(f"Timing for {frame_count} frames:")
+    for stage, seconds in timings.items():
+        print(f"  {stage}: {seconds * 1000:0.1f} ms, {seconds * 1e6 / max(frame_count, 1):0.1f} us/frame")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
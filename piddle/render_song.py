@@ -0,0 +1,154 @@
+"""Renders a song to LED frames offline, much faster than the SDL sim can play it.
+
+The frames are saved as a (frame count, STRIP_COUNT, LEDS_PER_STRIP, 3) uint8 RGB .npy file that
+can be memory mapped with numpy.load(path, mmap_mode="r"), for ArtNet replay, power estimation and
+regression diffs. The knobs that were used are saved next to it as JSON.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy
+
+import dsp
+import renderer
+
+
+def frame_windows(samples: numpy.ndarray, frame_ms: float, sample_count: int = dsp.SAMPLE_COUNT) -> numpy.ndarray:
+    """Returns the first sample of the window for each frame. Like the sim, each frame uses the
+    most recent sample_count samples, and frames are frame_ms apart.
+    """
+    if len(samples) < sample_count:
+        return numpy.empty(0, dtype=numpy.intp)
+    samples_per_frame = dsp.SAMPLE_RATE * frame_ms / 1000
+    frame_count = int((len(samples) - sample_count) / samples_per_frame) + 1
+    return numpy.round(numpy.arange(frame_count) * samples_per_frame).astype(numpy.intp)
+
+
+def render_song(
+    samples: numpy.ndarray,
+    output: str,
+    frame_ms: float = 20,
+    brightness_p: int = 100,
+    sensitivity_p: int = 50,
+    pattern_length: int = 24,
+    tile_offset: int = 2,
+    rainbow: bool = False,
+    normalize_bands: bool = False,
+    leds_per_strip: int = renderer.LEDS_PER_STRIP,
+    batch_size: int = dsp.DEFAULT_BATCH_SIZE,
+) -> numpy.ndarray:
+    """Renders the samples to a memory mapped .npy file, a batch of frames at a time. Returns the
+    memory mapped frames.
+    """
+    dsp_state = dsp.init_dsp()
+    renderer_state = renderer.init_renderer(leds_per_strip)
+    starts = frame_windows(samples, frame_ms)
+    frames = numpy.lib.format.open_memmap(
+        output,
+        mode="w+",
+        dtype=numpy.uint8,
+        shape=(len(starts), renderer.STRIP_COUNT, leds_per_strip, 3),
+    )
+    windows = numpy.lib.stride_tricks.sliding_window_view(samples, dsp.SAMPLE_COUNT)
+    for start, batch_starts in dsp.iterate_batches(starts, batch_size):
+        note_values = dsp.process_dsp(dsp_state, windows[batch_starts], sensitivity_p)
+        millis = ((start + numpy.arange(len(batch_starts))) * frame_ms).astype(numpy.uint32)
+        leds = renderer.render_fft(
+            renderer_state,
+            note_values,
+            rainbow,
+            normalize_bands,
+            millis,
+            pattern_length,
+            tile_offset,
+        )
+        frames[start : start + len(batch_starts)] = renderer.scale_brightness(leds, brightness_p)
+    frames.flush()
+    return frames
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Renders a song to Phonic Bloom LED frames.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("audio_file", help="Audio file, anything ffmpeg can decode")
+    parser.add_argument("--output", "-o", type=str, required=True, help="Output .npy file")
+    parser.add_argument("--frame-ms", type=float, default=20, help="Milliseconds per frame. The ESP32 delays 100 - speed_p.")
+    parser.add_argument("--brightness", "-b", type=int, default=100, help="brightness_p, 0-100")
+    parser.add_argument("--sensitivity", "-s", type=int, default=50, help="sensitivity_p, 0-100")
+    parser.add_argument("--pattern-length", "-l", type=int, default=24, help="LEDs per repeating tile")
+    parser.add_argument("--tile-offset", "-t", type=int, default=2, help="History positions each tile shifts")
+    parser.add_argument("--rainbow", "-r", action="store_true", help="Rainbow mode")
+    parser.add_argument("--normalize-bands", "-n", action="store_true", help="Normalize bands")
+    parser.add_argument("--leds-per-strip", type=int, default=renderer.LEDS_PER_STRIP, help="LEDs per strip. The dome has 151.")
+    parser.add_argument("--batch-size", type=int, default=dsp.DEFAULT_BATCH_SIZE, help="Frames per batch")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if not 0 <= args.brightness <= 100:
+        print_error(f"Brightness should be 0-100, got {args.brightness}")
+    if not 0 <= args.sensitivity <= 100:
+        print_error(f"Sensitivity should be 0-100, got {args.sensitivity}")
+    if not 5 <= args.pattern_length <= args.leds_per_strip:
+        print_error(f"Pattern length should be 5-{args.leds_per_strip}, got {args.pattern_length}")
+    if not 0 <= args.tile_offset < args.pattern_length:
+        print_error(f"Tile offset should be 0-{args.pattern_length - 1}, got {args.tile_offset}")
+    if args.frame_ms <= 0:
+        print_error(f"Frame ms should be positive, got {args.frame_ms}")
+
+    samples = dsp.load_audio(args.audio_file)
+    start = time.time()
+    frames = render_song(
+        samples,
+        args.output,
+        frame_ms=args.frame_ms,
+        brightness_p=args.brightness,
+        sensitivity_p=args.sensitivity,
+        pattern_length=args.pattern_length,
+        tile_offset=args.tile_offset,
+        rainbow=args.rainbow,
+        normalize_bands=args.normalize_bands,
+        leds_per_strip=args.leds_per_strip,
+        batch_size=args.batch_size,
+    )
+    elapsed = time.time() - start
+
+    with open(args.output + ".json", "w") as file:
+        json.dump(
+            {
+                "audio_file": args.audio_file,
+                "frame_ms": args.frame_ms,
+                "brightness_p": args.brightness,
+                "sensitivity_p": args.sensitivity,
+                "pattern_length": args.pattern_length,
+                "tile_offset": args.tile_offset,
+                "rainbow": args.rainbow,
+                "normalize_bands": args.normalize_bands,
+            },
+            file,
+            indent=2,
+        )
+
+    song_seconds = len(samples) / dsp.SAMPLE_RATE
+    print(
+        f"Rendered {len(frames)} frames from {song_seconds:0.1f} s of audio in {elapsed:0.2f} s"
+        f" ({song_seconds / max(elapsed, 1e-9):0.0f}x real time) to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
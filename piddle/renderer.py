@@ -0,0 +1,192 @@
+"""NumPy port of renderFft from sim/renderer.cpp.
+
+Renders a batch of frames at once. The pattern buffer on the ESP32 slides down by SLIDE_COUNT
+every frame, so LED position p in frame t is just the head color from frame t - p. That means the
+head colors for every frame can be computed at once, and the history only needs to be carried
+between batches. hsv2rgb and quadwave8 are replaced by lookup tables, and the output is bit-exact
+with the C++, including the uint8/uint16 wraparounds.
+"""
+
+import dataclasses
+
+import numpy
+
+# These match sim/sim_constants.h
+STRIP_COUNT = 15
+LEDS_PER_STRIP = 50
+C4_INDEX = 11
+START_NOTE = C4_INDEX - 4
+HUE16_STEP = 256 * 3
+# Same uint16_t wraparound as ESP32. 65536/3 - 768*15*2 = -1195 → 64341 as uint16_t.
+HUE16_STRIP_WRAP_STEP = (65536 // 3 - HUE16_STEP * STRIP_COUNT * 2) % 65536
+
+
+@dataclasses.dataclass
+class RendererState:
+    """The state that renderFft keeps in statics between frames."""
+    # Previous head colors, oldest first, (leds_per_strip - 1, STRIP_COUNT, 3)
+    history: numpy.ndarray
+    rainbow_offset: int = 0
+
+    @property
+    def leds_per_strip(self) -> int:
+        return len(self.history) + 1
+
+
+def init_renderer(leds_per_strip: int = LEDS_PER_STRIP) -> RendererState:
+    """Returns a renderer with a black pattern buffer."""
+    return RendererState(
+        history=numpy.zeros((leds_per_strip - 1, STRIP_COUNT, 3), dtype=numpy.uint8)
+    )
+
+
+def hsv2rgb(hue: numpy.ndarray, saturation: numpy.ndarray, value: numpy.ndarray) -> numpy.ndarray:
+    """Vectorized hsv2rgb. Returns uint8 with a trailing RGB axis."""
+    hue, saturation, value = numpy.broadcast_arrays(
+        *(numpy.asarray(channel, dtype=numpy.int32) for channel in (hue, saturation, value))
+    )
+    region = hue // 43
+    remainder = (hue - region * 43) * 6
+    p = (value * (255 - saturation)) >> 8
+    q = (value * (255 - ((saturation * remainder) >> 8))) >> 8
+    t = (value * (255 - ((saturation * (255 - remainder)) >> 8))) >> 8
+
+    choices = (
+        (value, t, p),
+        (q, value, p),
+        (p, value, t),
+        (p, q, value),
+        (t, p, value),
+        (value, p, q),
+    )
+    region = numpy.minimum(region, 5)
+    rgb = numpy.empty(hue.shape + (3,), dtype=numpy.uint8)
+    for channel in range(3):
+        rgb[..., channel] = numpy.choose(region, [choice[channel] for choice in choices])
+    gray = saturation == 0
+    rgb[gray] = value[gray][:, numpy.newaxis]
+    return rgb
+
+
+def make_value_hue_to_rgb() -> numpy.ndarray:
+    """Returns hsv2rgb with full saturation for every value and hue, (256 * 256, 3), indexed by
+    value * 256 + hue.
+    """
+    value, hue = numpy.divmod(numpy.arange(256 * 256), 256)
+    return hsv2rgb(hue, 255, value)
+
+
+# renderFft always uses full saturation, so a lookup replaces hsv2rgb for every note
+VALUE_HUE_TO_RGB = make_value_hue_to_rgb()
+
+
+def quadwave8(x: numpy.ndarray) -> numpy.ndarray:
+    """quadwave8 approximation: maps 0-255 input to 0-255 sine output."""
+    angle = x.astype(numpy.float32) * numpy.float32(2.0 * numpy.pi) / numpy.float32(256.0)
+    return (numpy.sin(angle) * numpy.float32(127.5) + numpy.float32(127.5)).astype(numpy.uint8)
+
+
+QUADWAVE8 = quadwave8(numpy.arange(256, dtype=numpy.uint8))
+
+
+def hue_starts(
+    state: RendererState, frame_count: int, rainbow: bool, millis: numpy.ndarray
+) -> numpy.ndarray:
+    """Returns the starting hue for each frame, and advances the rainbow offset."""
+    if rainbow:
+        starts = (state.rainbow_offset + 1 + numpy.arange(frame_count)) % 256
+        state.rainbow_offset = (state.rainbow_offset + frame_count) % 256
+        return starts.astype(numpy.uint8)
+    quad_wave_millis_div = 64
+    quad_wave_div = 8
+    x = (numpy.asarray(millis, dtype=numpy.uint32) // quad_wave_millis_div).astype(numpy.uint8)
+    return (QUADWAVE8.take(x) // quad_wave_div - 20).astype(numpy.uint8)
+
+
+def normalize_bands(note_values: numpy.ndarray) -> numpy.ndarray:
+    """Boosts quiet bands. note_values is (frame count, note count) float32."""
+    note_values = note_values.copy()
+    end = START_NOTE + STRIP_COUNT * 3
+    all_max_value = note_values[:, START_NOTE:end].max(axis=1)
+    for band in range(3):
+        start = START_NOTE + STRIP_COUNT * band
+        max_value = note_values[:, start : start + STRIP_COUNT].max(axis=1)
+        # Average the band max and global max so quiet bands get a moderate boost
+        # but a completely silent band isn't boosted to infinity.
+        divisor = numpy.maximum((max_value + all_max_value) * numpy.float32(0.5), numpy.float32(0.001))
+        inverse = numpy.float32(1.0) / divisor
+        note_values[:, start : start + STRIP_COUNT] *= inverse[:, numpy.newaxis]
+    return note_values
+
+
+def head_colors(
+    note_values: numpy.ndarray, starts: numpy.ndarray
+) -> numpy.ndarray:
+    """Returns the colors added to the head of each strip, (frame count, STRIP_COUNT, 3)."""
+    frame_count, note_count = note_values.shape
+    notes = numpy.arange(note_count - 1 - START_NOTE)
+    note_hue16 = HUE16_STEP * notes + HUE16_STRIP_WRAP_STEP * (notes // STRIP_COUNT)
+    hue16 = (starts.astype(numpy.int64)[:, numpy.newaxis] * 256 + note_hue16) % 65536
+    hues = hue16 >> 8
+
+    int_values = (note_values[:, START_NOTE : note_count - 1] * 254).astype(numpy.uint8)
+    gamma_corrected = int_values.astype(numpy.uint16) * int_values // 255
+    colors = VALUE_HUE_TO_RGB.take(gamma_corrected.astype(numpy.intp) * 256 + hues, axis=0)
+
+    # Notes wrap around the strips, so sum them up in rows of STRIP_COUNT. CRGB += saturates, and
+    # since the colors are never negative, that's the same as clamping the sum.
+    row_count = -(-len(notes) // STRIP_COUNT)
+    padded = numpy.zeros((frame_count, row_count * STRIP_COUNT, 3), dtype=numpy.uint16)
+    padded[:, : len(notes)] = colors
+    summed = padded.reshape(frame_count, row_count, STRIP_COUNT, 3).sum(axis=1)
+    return numpy.minimum(summed, 255).astype(numpy.uint8)
+
+
+def buffer_positions(leds_per_strip: int, pattern_length: int, tile_offset: int) -> numpy.ndarray:
+    """Returns which pattern buffer position each LED shows, with each tile offset into the
+    history.
+    """
+    j = numpy.arange(leds_per_strip)
+    tile_index = j // pattern_length
+    return numpy.minimum((j % pattern_length) + tile_index * tile_offset, leds_per_strip - 1)
+
+
+def render_fft(
+    state: RendererState,
+    note_values: numpy.ndarray,
+    rainbow: bool,
+    normalize: bool,
+    millis: numpy.ndarray,
+    pattern_length: int,
+    tile_offset: int,
+) -> numpy.ndarray:
+    """Batched renderFft. note_values is (frame count, note count) and millis is the time of each
+    frame. Returns (frame count, STRIP_COUNT, leds_per_strip, 3) uint8 RGB.
+    """
+    frame_count = len(note_values)
+    leds_per_strip = state.leds_per_strip
+    if normalize:
+        note_values = normalize_bands(note_values)
+    heads = head_colors(note_values, hue_starts(state, frame_count, rainbow, millis))
+
+    # Position p of frame t shows the head from frame t - p. Gather (frame, strip, LED) at once
+    # from the history flattened to (frame * strip) rows of RGB.
+    history = numpy.concatenate((state.history, heads))
+    positions = buffer_positions(leds_per_strip, pattern_length, tile_offset)
+    history_frames = numpy.arange(frame_count)[:, numpy.newaxis] + (leds_per_strip - 1) - positions
+    strips = numpy.arange(STRIP_COUNT)[:, numpy.newaxis]
+    indexes = history_frames[:, numpy.newaxis, :] * STRIP_COUNT + strips
+    leds = history.reshape(-1, 3).take(indexes, axis=0)
+    state.history = history[len(history) - (leds_per_strip - 1) :]
+
+    # Dim the diode LED at physical position 0
+    leds[:, :, 0] //= 3
+    return leds
+
+
+def scale_brightness(leds: numpy.ndarray, brightness_p: int) -> numpy.ndarray:
+    """Applies the brightness scale like the sim does before drawing."""
+    if brightness_p == 100:
+        return leds
+    scale = numpy.float32(brightness_p) / numpy.float32(100.0)
+    return (leds * scale).astype(numpy.uint8)
@@ -0,0 +1,37 @@
+// Runs the sim DSP and renderer without SDL, for regression.py.
+// Reads SAMPLE_COUNT int16 samples per frame from stdin, and writes NOTE_COUNT floats followed by
+// STRIP_COUNT * LEDS_PER_STRIP RGB bytes per frame to stdout.
+// Usage: golden sensitivity_p rainbow normalizeBands patternLength tileOffset frameMs
+
+#include "dsp.h"
+#include "renderer.h"
+#include "sim_constants.h"
+
+#include <cstdio>
+#include <cstdlib>
+
+int main(int argc, char** argv) {
+    if (argc != 7) {
+        fprintf(stderr, "Usage: %s sensitivity_p rainbow normalizeBands patternLength tileOffset frameMs\n", argv[0]);
+        return 1;
+    }
+    const uint8_t sensitivity_p  = atoi(argv[1]);
+    const bool    rainbow        = atoi(argv[2]);
+    const bool    normalizeBands = atoi(argv[3]);
+    const int     patternLength  = atoi(argv[4]);
+    const int     tileOffset     = atoi(argv[5]);
+    const int     frameMs        = atoi(argv[6]);
+
+    DSPState* dsp = initDSP();
+    static int16_t window[SAMPLE_COUNT];
+    static float   noteValues[NOTE_COUNT];
+    static CRGB    leds[STRIP_COUNT][LEDS_PER_STRIP];
+    for (uint32_t frame = 0; fread(window, sizeof(window), 1, stdin) == 1; ++frame) {
+        processDSP(dsp, window, sensitivity_p, noteValues);
+        renderFft(leds, noteValues, rainbow, normalizeBands, frame * frameMs, patternLength, tileOffset);
+        fwrite(noteValues, sizeof(noteValues), 1, stdout);
+        fwrite(leds, sizeof(leds), 1, stdout);
+    }
+    destroyDSP(dsp);
+    return 0;
+}
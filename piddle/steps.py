@@ -1,61 +1,157 @@
 """Generates the frequency range buckets for notes."""
 import argparse
+import bisect
+import dataclasses
+import itertools
 import sys
+import typing
+
+
+@dataclasses.dataclass
+class NoteBuckets:
+    """The FFT output buckets that have notes in them, for one configuration."""
+    sample_count: int
+    sample_rate: float
+    sharps: bool
+    # (bucket index, lower frequency, upper frequency, note names) for each bucket that has notes
+    buckets: typing.List[typing.Tuple[int, float, float, typing.List[str]]]
+    c4_index: int
+
+    @property
+    def note_to_output_index(self) -> typing.List[int]:
+        return [bucket[0] for bucket in self.buckets]
+
+    @property
+    def name(self) -> str:
+        return f"notes_{self.sample_count}_{self.sample_rate:g}{'_sharps' if self.sharps else ''}".replace(".", "_")
+
+    @property
+    def command(self) -> str:
+        return f"python3 steps.py {self.sample_count} {float(self.sample_rate)} {'-s' if self.sharps else ''}"
+
+
+def is_power_of_two(value: int) -> bool:
+    return value > 0 and value & (value - 1) == 0
+
+
+def make_note_buckets(sample_count: int, sample_rate: float, sharps: bool) -> NoteBuckets:
+    """Finds which FFT output buckets each note falls in."""
+    if not is_power_of_two(sample_count):
+        raise ValueError(f"sample_count ({sample_count}) must be a power of 2")
+
+    selected = [note for note in notes if sharps or "#" not in note[1]]
+    frequencies = [note[0] for note in selected]
+
+    step_size = sample_rate / sample_count
+    lower = 0
+    buckets = []
+    c4_index = None
+    for index in range(sample_count):
+        upper = lower + step_size
+        # Everything after this is above the note range
+        if lower > frequencies[-1]:
+            break
+        first = bisect.bisect_left(frequencies, lower)
+        last = bisect.bisect_right(frequencies, upper)
+        if first < last:
+            found = [note[1] for note in selected[first:last]]
+            if "C4" in found:
+                c4_index = len(buckets)
+            buckets.append((index, lower, upper, found))
+        lower = upper
+
+    if c4_index is None:
+        raise ValueError(f"C4 not found for {sample_count} samples at {sample_rate} Hz")
+    return NoteBuckets(sample_count, sample_rate, sharps, buckets, c4_index)
+
+
+def format_header(all_buckets: typing.Iterable[NoteBuckets]) -> str:
+    """Formats a header with one namespace per configuration."""
+    lines = ["#pragma once", "", "#include <stdint.h>", ""]
+    for buckets in all_buckets:
+        lines += [
+            f"// Generated from {buckets.command}",
+            f"namespace {buckets.name} {{",
+            f"static const int SAMPLE_COUNT = {buckets.sample_count};",
+            f"static const int SAMPLE_RATE = {buckets.sample_rate:d};",
+            "static constexpr uint16_t NOTE_TO_OUTPUT_INDEX[] = {",
+            f"  {', '.join((str(s) for s in buckets.note_to_output_index))}",
+            "};",
+            f"static const int c4Index = {buckets.c4_index};",
+            "}",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def print_buckets(buckets: NoteBuckets) -> None:
+    """Prints the buckets and the lookup table for one configuration."""
+    if buckets.buckets[0][0] > 0:
+        for index in range(buckets.buckets[0][0]):
+            print(f"Bucket {index} has no notes")
+    for index, lower, upper, found in buckets.buckets:
+        print(f"Bucket {index} {lower:0.1f}-{upper:0.1f} has {' '.join(found)}")
+    print("Remaining buckets are empty because they're above note range")
+    print()
+    print(f"// Generated from {buckets.command}")
+    print(f"static const int SAMPLE_COUNT = {buckets.sample_count};")
+    print("static constexpr uint16_t NOTE_TO_OUTPUT_INDEX[] = {")
+    print(f"  {', '.join((str(s) for s in buckets.note_to_output_index))}")
+    print("};")
+    print(f"const int c4Index = {buckets.c4_index};")
+
 
 def main():
     parser = argparse.ArgumentParser(
         prog="Steps",
         description="Generate note steps",
     )
-    parser.add_argument("bucket_count", type=int)
-    parser.add_argument("sample_frequency", type=float)
+    parser.add_argument("bucket_count", type=int, nargs="?")
+    parser.add_argument("sample_frequency", type=float, nargs="?")
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("-s", "--sharps", action="store_true", help="include half step notes")
+    parser.add_argument(
+        "-n",
+        "--sample-counts",
+        type=int,
+        nargs="+",
+        help="Generate a header for every combination of these sample counts and --sample-rates",
+    )
+    parser.add_argument(
+        "-r",
+        "--sample-rates",
+        type=int,
+        nargs="+",
+        default=[44100],
+        help="Sample rates in whole Hz to use with --sample-counts",
+    )
+    parser.add_argument(
+        "-b",
+        "--both",
+        action="store_true",
+        help="With --sample-counts, generate tables both with and without half step notes",
+    )
     args = parser.parse_args()
 
-    bucket_count = args.bucket_count
-    if bucket_count not in (2**n for n in range(20)):
-        print(f"bucket_count ({bucket_count}) must be a power of 2")
-        sys.exit()
-    frequency = args.sample_frequency
+    if args.sample_counts is None and (args.bucket_count is None or args.sample_frequency is None):
+        parser.error("either bucket_count and sample_frequency or --sample-counts is required")
 
-    step_size = frequency / bucket_count
-    lower = 0
-    empty = []
-    skips = []
-    for index in range(bucket_count):
-        # Find which notes
-        upper = lower + step_size
-        found = []
-        for note in notes:
-            if not args.sharps and "#" in note[1]:
-                continue
-            if lower <= note[0] <= upper:
-                found.append(note[1])
-
-        if upper < notes[0][0]:
-            print(f"Bucket {index} has no notes")
+    if args.sample_counts is not None:
+        sharps_options = (False, True) if args.both else (args.sharps,)
+        configurations = itertools.product(args.sample_counts, args.sample_rates, sharps_options)
+    else:
+        configurations = [(args.bucket_count, args.sample_frequency, args.sharps)]
 
-        if len(found) == 0:
-            empty.append(index)
-        else:
-            if len(empty) > 0:
-                #print(f"Buckets {' '.join((str(b) for b in empty))} were empty")
-                empty = []
-            skips.append(index)
-            print(f"Bucket {index} {lower:0.1f}-{upper:0.1f} has {' '.join(found)}")
-            if "C4" in found:
-                c4 = index
+    try:
+        all_buckets = [make_note_buckets(*configuration) for configuration in configurations]
+    except ValueError as exc:
+        print(exc)
+        sys.exit()
 
-        lower = upper
-    print("Remaining buckets are empty because they're above note range")
-    print()
-    print(f"// Generated from python3 steps.py {bucket_count} {frequency} {'-s' if args.sharps else ''}")
-    print(f"static const int SAMPLE_COUNT = {bucket_count};")
-    print("static constexpr uint16_t NOTE_TO_OUTPUT_INDEX[] = {")
-    print(f"  {', '.join((str(s) for s in skips))}")
-    print("};")
-    print(f"const int c4Index = {skips.index(c4)};")
+    if args.sample_counts is not None:
+        sys.stdout.write(format_header(all_buckets))
+    else:
+        print_buckets(all_buckets[0])
 
 # From https://pages.mtu.edu/~suits/notefreqs.html
 notes = (
@@ -0,0 +1,235 @@
+"""Scores spectrum analyzer settings over a corpus of songs.
+
+The FFT power spectra for each song are computed once and cached on disk as .npy files, which are
+memory mapped for every trial. Only normalization, pooling and band normalization are redone for
+each combination of settings, and the trials are run in parallel.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import typing
+
+import numpy
+
+import dsp
+import renderer
+
+DEFAULT_CACHE_DIRECTORY = "__pycache__"
+DEFAULT_HOP = 1024
+
+
+def a_weighting_constants(state: dsp.DSPState) -> numpy.ndarray:
+    """The ESP32 weighting, which uses the frequency of the bucket above."""
+    return state.weighting_constants
+
+
+def centered_a_weighting_constants(state: dsp.DSPState) -> numpy.ndarray:
+    """A-weighting at the frequency of each bucket."""
+    offsets = numpy.arange(state.sample_count)
+    # Bucket 0 is DC, which is zeroed anyway, so avoid log(0)
+    frequencies = numpy.float32(state.sample_rate) / numpy.float32(state.sample_count) * numpy.maximum(offsets, 1)
+    return dsp.a_weighting_multiplier(frequencies)
+
+
+def no_weighting_constants(state: dsp.DSPState) -> numpy.ndarray:
+    return numpy.ones(state.sample_count, dtype=numpy.float32)
+
+
+WEIGHTINGS: typing.Dict[str, typing.Callable[[dsp.DSPState], numpy.ndarray]] = {
+    "a": a_weighting_constants,
+    "a-centered": centered_a_weighting_constants,
+    "none": no_weighting_constants,
+}
+
+
+def cache_path(audio_file: str, hop: int, cache_directory: str) -> str:
+    """Returns where the spectra for audio_file are cached. The key changes when the file does."""
+    status = os.stat(audio_file)
+    key = json.dumps(
+        [os.path.abspath(audio_file), status.st_size, status.st_mtime, hop, dsp.SAMPLE_COUNT]
+    )
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(cache_directory, f"spectra_{digest}.npy")
+
+
+def cache_spectra(
+    audio_file: str, hop: int, cache_directory: str, batch_size: int = dsp.DEFAULT_BATCH_SIZE
+) -> str:
+    """Computes the unweighted power spectra for audio_file if they aren't cached yet. Returns the
+    cache path.
+    """
+    path = cache_path(audio_file, hop, cache_directory)
+    if os.path.exists(path):
+        return path
+
+    state = dsp.init_dsp()
+    frames = dsp.frame_audio(dsp.load_audio(audio_file), hop)
+    os.makedirs(cache_directory, exist_ok=True)
+    # Write then rename so that an interrupted run never leaves a partial cache
+    temp_path = f"{path}.{os.getpid()}.tmp.npy"
+    spectra = numpy.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=numpy.float32, shape=(len(frames), dsp.SAMPLE_COUNT)
+    )
+    for start, batch in dsp.iterate_batches(frames, batch_size):
+        spectra[start : start + len(batch)] = dsp.compute_power_spectra(state, batch)
+    spectra.flush()
+    del spectra
+    os.replace(temp_path, path)
+    return path
+
+
+class Trial(typing.NamedTuple):
+    sensitivity_p: int
+    normalize_bands: bool
+    weighting: str
+
+
+def score_trial(
+    trial: Trial, spectra_paths: typing.List[str], batch_size: int
+) -> typing.Dict[str, float]:
+    """Runs one trial over every cached song. Returns the metrics averaged over all frames:
+    - brightness: mean rendered note value, after gamma correction, 0-1
+    - clipped: fraction of rendered notes at full value
+    - flicker: mean absolute change in rendered note value between frames, 0-1
+    """
+    state = dsp.init_dsp()
+    state.weighting_constants = WEIGHTINGS[trial.weighting](state)
+    brightness_sum = 0.0
+    clipped_count = 0
+    flicker_sum = 0.0
+    frame_count = 0
+    flicker_frame_count = 0
+    for path in spectra_paths:
+        spectra = numpy.load(path, mmap_mode="r")
+        previous = None
+        for _, batch in dsp.iterate_batches(spectra, batch_size):
+            note_values = dsp.normalize_and_pool(
+                state, batch * state.weighting_constants, trial.sensitivity_p
+            )
+            if trial.normalize_bands:
+                note_values = renderer.normalize_bands(note_values)
+            # The same notes and gamma correction as renderFft
+            rendered = note_values[:, renderer.START_NOTE : -1]
+            int_values = numpy.minimum(rendered * 254, 255).astype(numpy.uint16)
+            brightness = (int_values * int_values // 255).astype(numpy.float32) / 255
+
+            brightness_sum += float(brightness.mean(axis=1).sum())
+            clipped_count += int((rendered >= 1.0).sum())
+            if previous is not None:
+                brightness = numpy.concatenate((previous, brightness))
+            flicker_sum += float(numpy.abs(numpy.diff(brightness, axis=0)).mean(axis=1).sum())
+            flicker_frame_count += len(brightness) - 1
+            previous = brightness[-1:]
+            frame_count += len(batch)
+    note_count = dsp.NOTE_COUNT - 1 - renderer.START_NOTE
+    return {
+        "brightness": brightness_sum / max(frame_count, 1),
+        "clipped": clipped_count / max(frame_count * note_count, 1),
+        "flicker": flicker_sum / max(flicker_frame_count, 1),
+    }
+
+
+def _score_trial_star(arguments: typing.Tuple[Trial, typing.List[str], int]) -> typing.Dict[str, float]:
+    return score_trial(*arguments)
+
+
+def run_trials(
+    trials: typing.List[Trial], spectra_paths: typing.List[str], batch_size: int, processes: int
+) -> typing.List[typing.Dict[str, float]]:
+    """Scores every trial, in parallel."""
+    arguments = [(trial, spectra_paths, batch_size) for trial in trials]
+    if processes == 1:
+        return [_score_trial_star(argument) for argument in arguments]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_score_trial_star, arguments, chunksize=1)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Scores spectrum analyzer settings over a corpus of songs.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("audio_files", nargs="+", help="Audio files, anything ffmpeg can decode")
+    parser.add_argument("--hop", type=int, default=DEFAULT_HOP, help="Samples between frames")
+    parser.add_argument(
+        "--sensitivity", "-s", type=int, nargs="+", default=[30, 50, 70], help="Sensitivities to try, 0-100"
+    )
+    parser.add_argument(
+        "--normalize-bands",
+        "-n",
+        type=str,
+        nargs="+",
+        choices=("off", "on"),
+        default=["off", "on"],
+        help="Normalize bands settings to try",
+    )
+    parser.add_argument(
+        "--weighting",
+        "-w",
+        type=str,
+        nargs="+",
+        choices=tuple(WEIGHTINGS),
+        default=list(WEIGHTINGS),
+        help="Weightings to try. a is what the ESP32 does.",
+    )
+    parser.add_argument("--cache-directory", type=str, default=DEFAULT_CACHE_DIRECTORY, help="Where to cache spectra")
+    parser.add_argument("--processes", "-j", type=int, default=os.cpu_count() or 1, help="Trials to run at once")
+    parser.add_argument("--batch-size", type=int, default=dsp.DEFAULT_BATCH_SIZE, help="Frames per batch")
+    parser.add_argument(
+        "--sort", type=str, choices=("brightness", "clipped", "flicker"), default="flicker", help="Metric to sort by"
+    )
+    parser.add_argument("--json", type=str, help="Also save the results as JSON")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    for sensitivity in args.sensitivity:
+        if not 0 <= sensitivity <= 100:
+            print_error(f"Sensitivity should be 0-100, got {sensitivity}")
+    if args.processes < 1:
+        print_error(f"Processes should be positive, got {args.processes}")
+
+    start = time.time()
+    spectra_paths = [cache_spectra(audio_file, args.hop, args.cache_directory, args.batch_size) for audio_file in args.audio_files]
+    frame_count = sum(len(numpy.load(path, mmap_mode="r")) for path in spectra_paths)
+    print(f"Spectra for {frame_count} frames ready in {time.time() - start:0.2f} s")
+
+    trials = [
+        Trial(sensitivity, normalize == "on", weighting)
+        for sensitivity, normalize, weighting in itertools.product(
+            args.sensitivity, args.normalize_bands, args.weighting
+        )
+    ]
+    start = time.time()
+    results = run_trials(trials, spectra_paths, args.batch_size, args.processes)
+    print(f"Ran {len(trials)} trials in {time.time() - start:0.2f} s")
+
+    rows = sorted(zip(trials, results), key=lambda row: row[1][args.sort])
+    print(f"{'sensitivity':>11} {'normalize':>9} {'weighting':>10} {'brightness':>10} {'clipped':>8} {'flicker':>8}")
+    for trial, result in rows:
+        print(
+            f"{trial.sensitivity_p:11d} {str(trial.normalize_bands):>9} {trial.weighting:>10}"
+            f" {result['brightness']:10.4f} {result['clipped']:8.4f} {result['flicker']:8.4f}"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump([{**trial._asdict(), **result} for trial, result in rows], file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
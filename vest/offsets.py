@@ -1,6 +1,12 @@
 """Generates C code for various things."""
+import argparse
 import dataclasses
+import hashlib
+import json
 import math
+import numpy
+import os
+import pathlib
 import sys
 import typing
 
@@ -20,34 +26,49 @@ def debug_print(s: str) -> None:
         print(s)
 
 
-def print_luts() -> None:
-    """Print the lookup tables. Returns """
-    # Stage right goes from x:[0-10] and y:[4-14]
-    # Central goes from x:[11-23] and y:[0-14]
-    # Stage left goes from x:[24-31] and y:[4-14]
-    # White GPIO17 central upper stage left
-    # Blue GPIO21 stage right
-    # Red GPIO4 central upper stage right
-    # Green GPIO0 central lower
-    # Black GPIO15 stage left
-    # Formatting here: n for skip, then x,y pairs with an optional inclusive range for one of x or y
-    max_expected_x = 31
-    max_expected_y = 14
-    formats = {
-        "white": "n, n, n, n, n, (23-17:8), (17:9-14), n, (18:14-9), n, (19:9-14), n, (20:14-9), n, (21:9-14), n, (22:14-9),(23:9)",
-        "blue": "n, n, (23-11:4), (10-0:3), (0:4-9), n, (1:9-4), n, (2:4-11), n, (3:11-4), n, (4:4-13), n, (5:13-4), n, (6:4-6), n, (7:6-5), (8-23:5)",
-        "red": "n, n, n, n, (23-11:6), (11:7-8), n, (12:8-7), n, (13:7-14), n, (14:14-7), n, (15:7-14), n, (16:14-7), (17-23:7)",
-        "green": "n, n, n, n, n, (23-12:3), n, (12-22:2), n, (22-12:1), n, (12-23:0), (23:1-2)",
-        "black": "n, (24:5-7), n, (25:7-5), n, (26:5-14), n, (27:14-5), n, (28:5-11), (29:11-5), n, (30:5-9), n, (31:9-4), (30-25:4)",
-    }
-    expected_skips = {
-        "white": 5,
-        "blue": 2,
-        "red": 4,
-        "green": 5,
-        "black": 1,
-    }
-
+# Stage right goes from x:[0-10] and y:[4-14]
+# Central goes from x:[11-23] and y:[0-14]
+# Stage left goes from x:[24-31] and y:[4-14]
+# White GPIO17 central upper stage left
+# Blue GPIO21 stage right
+# Red GPIO4 central upper stage right
+# Green GPIO0 central lower
+# Black GPIO15 stage left
+# Formatting here: n for skip, then x,y pairs with an optional inclusive range for one of x or y
+MAX_EXPECTED_X = 31
+MAX_EXPECTED_Y = 14
+FORMATS = {
+    "white": "n, n, n, n, n, (23-17:8), (17:9-14), n, (18:14-9), n, (19:9-14), n, (20:14-9), n, (21:9-14), n, (22:14-9),(23:9)",
+    "blue": "n, n, (23-11:4), (10-0:3), (0:4-9), n, (1:9-4), n, (2:4-11), n, (3:11-4), n, (4:4-13), n, (5:13-4), n, (6:4-6), n, (7:6-5), (8-23:5)",
+    "red": "n, n, n, n, (23-11:6), (11:7-8), n, (12:8-7), n, (13:7-14), n, (14:14-7), n, (15:7-14), n, (16:14-7), (17-23:7)",
+    "green": "n, n, n, n, n, (23-12:3), n, (12-22:2), n, (22-12:1), n, (12-23:0), (23:1-2)",
+    "black": "n, (24:5-7), n, (25:7-5), n, (26:5-14), n, (27:14-5), n, (28:5-11), (29:11-5), n, (30:5-9), n, (31:9-4), (30-25:4)",
+}
+EXPECTED_SKIPS = {
+    "white": 5,
+    "blue": 2,
+    "red": 4,
+    "green": 5,
+    "black": 1,
+}
+COLOR_TO_STRIP = {
+    "white": 0,
+    "blue": 1,
+    "red": 2,
+    "green": 3,
+    "black": 4,
+}
+UNUSED_LED = 65535
+# __pycache__ is already ignored by git
+CACHE_DIRECTORY = pathlib.Path(__file__).resolve().parent / "__pycache__"
+
+
+def build_grid(
+    formats: typing.Dict[str, str], expected_skips: typing.Dict[str, int]
+) -> typing.Tuple[typing.Dict[typing.Tuple[int, int], PixelInfo], typing.Dict[str, int], int]:
+    """Parses the formats. Returns a map of (x,y) to PixelInfo, the LED count for each strand
+    color, and the total LED count.
+    """
     # Map of (x,y) to (color,LED)
     def get_range(start: typing.Union[str, int], end: typing.Union[str, int]):
         start = int(start)
@@ -75,9 +96,9 @@ def print_luts() -> None:
         )
         coordinate = (x, y)
 
-        if not (0 <= x <= max_expected_x and 0 <= y <= max_expected_y):
+        if not (0 <= x <= MAX_EXPECTED_X and 0 <= y <= MAX_EXPECTED_Y):
             print(f"Tried to add {coordinate} for {value} LED count {strand_led_count} but out of range")
-            assert 0 <= x <= max_expected_x and 0 <= y <= max_expected_y
+            assert 0 <= x <= MAX_EXPECTED_X and 0 <= y <= MAX_EXPECTED_Y
         if coordinate not in grid:
             grid[coordinate] = value
             strand_led_count += 1
@@ -135,41 +156,125 @@ def print_luts() -> None:
         debug_print(f"{total_active_led_count} active LEDs of {total_led_count} total")
 
     fill_grid()
-    min_x = min(coordinate[0] for coordinate in grid)
-    max_x = max(coordinate[0] for coordinate in grid)
-    min_y = min(coordinate[1] for coordinate in grid)
-    max_y = max(coordinate[1] for coordinate in grid)
-    assert max_x == max_expected_x
-    assert max_y == max_expected_y
-    assert min_x == 0
-    assert min_y == 0
-    debug_print(f"{min_x=} {max_x=} {min_y=} {max_y=}")
-
-    array: typing.List[typing.List[typing.Union[PixelInfo, None]]] = []
-    for y in range(max_x + 1):
-        array.append([None] * (max_y + 1))
-
-    for key, value in grid.items():
-        x, y = key
-        assert array[x][y] is None
-        array[x][y] = value
-
-    color_to_strip = {
-        "white": 0,
-        "blue": 1,
-        "red": 2,
-        "green": 3,
-        "black": 4,
-    }
+    return grid, color_to_count, total_led_count
+
+
+@dataclasses.dataclass
+class VestLayout:
+    """The parsed vest layout. Everything that needs the geometry (the C header, video.py, previews)
+    should use this instead of parsing the formats themselves.
+    """
+    # [x][y] offset into leds[], or UNUSED_LED. y = 0 is the bottom of the vest.
+    xy_to_offset: numpy.ndarray
+    # Indexed by strip
+    strand_led_counts: numpy.ndarray
+    linear_led_indexes: numpy.ndarray
+
+    @property
+    def column_count(self) -> int:
+        return self.xy_to_offset.shape[0]
+
+    @property
+    def row_count(self) -> int:
+        return self.xy_to_offset.shape[1]
+
+    @property
+    def led_count(self) -> int:
+        return int(self.strand_led_counts.sum())
+
+    @property
+    def strand_count(self) -> int:
+        return len(self.strand_led_counts)
+
+    @property
+    def active_led_count(self) -> int:
+        return int(numpy.count_nonzero(self.xy_to_offset != UNUSED_LED))
+
+    @property
+    def led_to_pixel(self) -> numpy.ndarray:
+        """The permutation from leds[] to row-major frames. Each entry is the index of the pixel
+        that LED displays in a row_count x column_count frame whose first row is the top of the
+        vest, or -1 for the unused LEDs.
+        """
+        led_to_pixel = numpy.full(self.led_count, -1, dtype=numpy.int32)
+        xs, ys = numpy.nonzero(self.xy_to_offset != UNUSED_LED)
+        # y = 0 is the bottom of the vest, but the first row of a frame is the top
+        led_to_pixel[self.xy_to_offset[xs, ys]] = (self.row_count - 1 - ys) * self.column_count + xs
+        return led_to_pixel
+
+    @classmethod
+    def parse(
+        cls,
+        formats: typing.Dict[str, str] = FORMATS,
+        expected_skips: typing.Dict[str, int] = EXPECTED_SKIPS,
+    ) -> "VestLayout":
+        """Parses and validates the formats."""
+        grid, color_to_count, _ = build_grid(formats, expected_skips)
+        min_x = min(coordinate[0] for coordinate in grid)
+        max_x = max(coordinate[0] for coordinate in grid)
+        min_y = min(coordinate[1] for coordinate in grid)
+        max_y = max(coordinate[1] for coordinate in grid)
+        assert max_x == MAX_EXPECTED_X
+        assert max_y == MAX_EXPECTED_Y
+        assert min_x == 0
+        assert min_y == 0
+        debug_print(f"{min_x=} {max_x=} {min_y=} {max_y=}")
+
+        xy_to_offset = numpy.full((max_x + 1, max_y + 1), UNUSED_LED, dtype=numpy.uint16)
+        for (x, y), value in grid.items():
+            xy_to_offset[x, y] = value.total_offset
+
+        strand_led_counts = numpy.array(
+            [color_to_count[color] for color in sorted(COLOR_TO_STRIP, key=COLOR_TO_STRIP.get)],
+            dtype=numpy.int32,
+        )
+        linear_led_indexes = numpy.concatenate(([0], numpy.cumsum(strand_led_counts)[:-1]))
+        return cls(
+            xy_to_offset=xy_to_offset,
+            strand_led_counts=strand_led_counts,
+            linear_led_indexes=linear_led_indexes.astype(numpy.int32),
+        )
 
+    @classmethod
+    def load(
+        cls,
+        formats: typing.Dict[str, str] = FORMATS,
+        expected_skips: typing.Dict[str, int] = EXPECTED_SKIPS,
+    ) -> "VestLayout":
+        """Returns the layout for the formats, only parsing them if they or this file changed since
+        the last time the layout was cached.
+        """
+        key = json.dumps([formats, expected_skips, COLOR_TO_STRIP], sort_keys=True)
+        # This file is hashed too, so that changes to the parser invalidate the cache
+        digest = hashlib.sha1(key.encode("utf-8") + pathlib.Path(__file__).read_bytes()).hexdigest()[:16]
+        cache_path = CACHE_DIRECTORY / f"vest_layout_{digest}.npz"
+        try:
+            with numpy.load(cache_path) as cached:
+                return cls(**{field.name: cached[field.name] for field in dataclasses.fields(cls)})
+        except (OSError, KeyError, ValueError):
+            pass
+
+        layout = cls.parse(formats, expected_skips)
+        try:
+            CACHE_DIRECTORY.mkdir(exist_ok=True)
+            # Write then rename so that a concurrent reader never sees a partial file
+            temp_path = cache_path.with_suffix(f".{os.getpid()}.npz")
+            numpy.savez(temp_path, **dataclasses.asdict(layout))
+            temp_path.replace(cache_path)
+        except OSError as exc:
+            debug_print(f"Unable to cache layout: {exc}")
+        return layout
+
+
+def print_luts() -> typing.Optional[typing.Tuple[int, int]]:
+    """Print the lookup tables. Returns the row and column counts."""
     if debug:
+        # Always parse so that the debug messages are printed
+        VestLayout.parse()
         return
 
-    unused = "65535"
-    led_count_per_strand = [
-        color_to_count[i[1]] for i in
-            sorted([(v, k) for k, v in color_to_strip.items()])
-    ]
+    layout = VestLayout.load()
+    unused = str(UNUSED_LED)
     print(f"""
 #include <stdint.h>
 const uint16_t UNUSED_LED = {unused};
@@ -179,50 +284,128 @@ const uint16_t UNUSED_LED = {unused};
 static_assert(FASTLED_NRF52_MAXIMUM_PIXELS_PER_STRING >= LED_COUNT, "You need to edit clockless_arm_nrf52.h and increase FASTLED_NRF52_MAXIMUM_PIXELS_PER_STRING");
 #endif
 
-const int LED_COLUMN_COUNT = {max_x + 1};
-const int LED_ROW_COUNT = {max_y + 1};
-constexpr int STRAND_TO_LED_COUNT[] = {{ {", ".join((str(i) for i in led_count_per_strand))} }};
-constexpr int LINEAR_LED_INDEXES[] = {{ {", ".join(str(sum(led_count_per_strand[:i])) for i in range(0, len(led_count_per_strand)))} }};
-const int LED_COUNT = {total_led_count};
-const int STRAND_COUNT = {len(formats)};
+const int LED_COLUMN_COUNT = {layout.column_count};
+const int LED_ROW_COUNT = {layout.row_count};
+constexpr int STRAND_TO_LED_COUNT[] = {{ {", ".join((str(i) for i in layout.strand_led_counts))} }};
+constexpr int LINEAR_LED_INDEXES[] = {{ {", ".join(str(i) for i in layout.linear_led_indexes)} }};
+const int LED_COUNT = {layout.led_count};
+const int STRAND_COUNT = {layout.strand_count};
 
 // x first then y, starting at lower left corner
 """)
 
     print(f"const uint16_t XY_TO_OFFSET[LED_COLUMN_COUNT][LED_ROW_COUNT] = {{")
-    for x in range(max_x + 1):
-        joined = ", ".join((unused if i is None else str(i.total_offset) for i in array[x]))
+    for column in layout.xy_to_offset:
+        joined = ", ".join(str(i) for i in column)
         print(f"    {{{joined}}},")
     print("};")
 
-    return max_y, max_x
-
-
-def print_precomputed_bidoulle_v3(row_count: int, column_count: int) -> None:
-    """Prints the precomputed Bidoulle v3 values."""
-    print("const uint8_t bidoulleV3rings[LED_COLUMN_COUNT * 2][LED_ROW_COUNT * 2] = {")
-
-    for x in range(-column_count // 2, 3 * column_count // 2):
-        sys.stdout.write("  {")
-        for y in range(-row_count // 2, 3 * row_count // 2):
-            xSqr = (x - column_count // 2) ** 2
-            ySqr = (y - row_count // 2) ** 2
-            value = round((math.sin(math.sqrt(0.1 * (xSqr + ySqr) + 1.0)) + 1.0) * 127)
-            sys.stdout.write(f"{value}, ")
-        print("},")
-    print("};")
+    return layout.row_count, layout.column_count
+
+
+def rings_effect(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+    """Bidoulle v3 rings."""
+    return numpy.sin(numpy.sqrt(0.1 * (x ** 2 + y ** 2) + 1.0))
+
+
+def plasma_effect(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+    """Classic sum of sines plasma."""
+    return (
+        numpy.sin(x / 4.0)
+        + numpy.sin(y / 3.0)
+        + numpy.sin((x + y) / 5.0)
+        + numpy.sin(numpy.sqrt(x ** 2 + y ** 2) / 3.0)
+    ) / 4.0
+
+
+def radial_distance_effect(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+    """Distance from the center, -1 at the center and 1 at the farthest corner."""
+    distance = numpy.sqrt(x ** 2 + y ** 2)
+    return distance / distance.max() * 2.0 - 1.0
+
+
+def angle_effect(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+    """Angle around the center, counterclockwise from the positive x axis."""
+    return numpy.arctan2(y, x) / math.pi
+
+
+# Takes x and y offsets from the center and returns values in [-1, 1]
+EffectFunction = typing.Callable[[numpy.ndarray, numpy.ndarray], numpy.ndarray]
+# Effect name to C table name and function
+EFFECTS: typing.Dict[str, typing.Tuple[str, EffectFunction]] = {
+    "rings": ("bidoulleV3rings", rings_effect),
+    "plasma": ("plasmaTable", plasma_effect),
+    "radial": ("radialDistanceTable", radial_distance_effect),
+    "angle": ("angleTable", angle_effect),
+}
+BITS_TO_C_TYPE = {8: "uint8_t", 16: "uint16_t"}
+
+
+def make_effect_table(
+    effect: EffectFunction, row_count: int, column_count: int, bits: int = 8
+) -> numpy.ndarray:
+    """Computes a precomputed effect table, indexed [x][y]. Given the vest's row and column counts,
+    the table is [column_count * 2][row_count * 2], matching the declared C array, so that
+    animations can move the center around. Values in [-1, 1] are
+    scaled to [0, 2 * (2 ** (bits - 1) - 1)], e.g. [0, 254] for 8 bits like the original rings.
+    """
+    if bits not in BITS_TO_C_TYPE:
+        raise ValueError(f"Unsupported bit depth {bits}, expected one of {list(BITS_TO_C_TYPE)}")
+    xs = numpy.arange(-column_count // 2, 3 * column_count // 2) - column_count // 2
+    ys = numpy.arange(-row_count // 2, 3 * row_count // 2) - row_count // 2
+    x, y = numpy.meshgrid(xs.astype(numpy.float64), ys.astype(numpy.float64), indexing="ij")
+    values = numpy.round((effect(x, y) + 1.0) * (2 ** (bits - 1) - 1))
+    return values.astype(numpy.dtype(f"uint{bits}"))
+
+
+def format_c_array(name: str, table: numpy.ndarray, bits: int) -> str:
+    """Formats a table as a C array."""
+    lines = [f"const {BITS_TO_C_TYPE[bits]} {name}[LED_COLUMN_COUNT * 2][LED_ROW_COUNT * 2] = {{"]
+    for column in table:
+        lines.append("  {" + "".join(f"{value}, " for value in column.tolist()) + "},")
+    lines.append("};")
+    return "\n".join(lines) + "\n"
+
+
+def print_effect_tables(
+    effect_names: typing.Iterable[str], row_count: int, column_count: int, bits: int = 8
+) -> None:
+    """Prints the precomputed effect tables in one write."""
+    output = []
+    for effect_name in effect_names:
+        table_name, effect = EFFECTS[effect_name]
+        table = make_effect_table(effect, row_count, column_count, bits)
+        output.append(format_c_array(table_name, table, bits))
+    sys.stdout.write("".join(output))
 
 
 def main() -> None:
     global debug
-    if len(sys.argv) > 1:
-        debug = True
+    parser = argparse.ArgumentParser(description="Generates offsets.hpp for the vest.")
+    parser.add_argument("-d", "--debug", action="store_true", help="Only print debug information")
+    parser.add_argument(
+        "-e",
+        "--effect",
+        action="append",
+        choices=EFFECTS.keys(),
+        help="Precomputed effect tables to include. Can be specified multiple times. Defaults to rings.",
+    )
+    parser.add_argument(
+        "-b",
+        "--bits",
+        type=int,
+        choices=BITS_TO_C_TYPE.keys(),
+        default=8,
+        help="Bit depth of the effect tables",
+    )
+    args = parser.parse_args()
+    debug = args.debug
 
     if debug:
         print_luts()
     else:
         row_count, column_count = print_luts()
-        print_precomputed_bidoulle_v3(row_count, column_count)
+        print_effect_tables(args.effect or ["rings"], row_count, column_count, args.bits)
 
 
 if __name__ == "__main__":
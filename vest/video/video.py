@@ -1,15 +1,19 @@
 """Processes video and outputs header files."""
 
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import argparse
 import cv2
 import numpy
 import pathlib
 import re
+import sys
 
-# TODO: Import these instead of copy/paste?
-LED_COLUMN_COUNT = 32
-LED_ROW_COUNT = 15
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import offsets
+
+# OpenCV stores pixels as BGR. The color lookup table is 3 blocks of 256, one per channel in that
+# order, so adding these offsets to a pixel gives the index into the table for each channel.
+CHANNEL_OFFSETS = numpy.array([0, 256, 512], dtype=numpy.uint16)
 
 
 def debug_print(s: str) -> None:
@@ -17,7 +21,48 @@ def debug_print(s: str) -> None:
     print(s)
 
 
-def process(arguments: argparse.Namespace) -> None:
+def make_color_lut(
+    gamma: float, white_balance: Tuple[float, float, float], brightness: int
+) -> numpy.ndarray:
+    """Returns a flat 768 entry lookup table that applies gamma correction, white balance and a
+    brightness cap. white_balance is R,G,B multipliers and brightness is out of 255.
+    """
+    values = numpy.arange(256, dtype=numpy.float64) / 255
+    corrected = numpy.power(values, gamma)
+    # Convert to BGR to match OpenCV
+    blue, green, red = white_balance[2], white_balance[1], white_balance[0]
+    multipliers = numpy.array([blue, green, red]) * brightness
+    lut = numpy.outer(multipliers, corrected)
+    return numpy.clip(numpy.round(lut), 0, 255).astype(numpy.uint8).reshape(-1)
+
+
+def parse_white_balance(white_balance: str) -> Tuple[float, float, float]:
+    """Parses a R,G,B white balance string, e.g. 1,0.8,0.7."""
+    parts = white_balance.split(",")
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f"White balance should be R,G,B, got {white_balance}")
+    try:
+        red, green, blue = (float(part) for part in parts)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"White balance should be R,G,B, got {white_balance}")
+    return red, green, blue
+
+
+def make_led_to_sample(
+    layout: offsets.VestLayout, column_offset: int, target_width: int, target_height: int
+) -> numpy.ndarray:
+    """Returns the index of the sample that each LED in leds[] displays, for row-major
+    target_width x target_height frames that start at column_offset on the vest. LEDs that are
+    unused or outside of the frame get index target_width * target_height, which should be black.
+    """
+    led_to_pixel = layout.led_to_pixel
+    rows, columns = numpy.divmod(led_to_pixel, layout.column_count)
+    columns -= column_offset
+    visible = (led_to_pixel >= 0) & (0 <= columns) & (columns < target_width) & (rows < target_height)
+    return numpy.where(visible, rows * target_width + columns, target_width * target_height)
+
+
+def process(arguments: argparse.Namespace, layout: offsets.VestLayout) -> None:
     """Save outputs."""
     output_file_name_str = arguments.out if arguments.out else re.sub("\.[^.]+$", ".anim", arguments.video_file)
     output_name = pathlib.Path(output_file_name_str)
@@ -27,21 +72,25 @@ def process(arguments: argparse.Namespace) -> None:
 
     debug_print(f"Writing to {output_name}")
     try:
-        process_inner(arguments, output_name)
+        process_inner(arguments, output_name, layout)
     except Exception as exc:
         output_name.unlink()
         raise
 
 
-def process_inner(arguments: argparse.Namespace, output_name: pathlib.Path) -> None:
+def process_inner(
+    arguments: argparse.Namespace, output_name: pathlib.Path, layout: offsets.VestLayout
+) -> None:
     """Save outputs."""
     if arguments.center:
         center_index = 8
-        target_width = (LED_COLUMN_COUNT // 2 - center_index) * 2
-        target_height = LED_ROW_COUNT
+        target_width = (layout.column_count // 2 - center_index) * 2
+        target_height = layout.row_count
+        column_offset = center_index
     else:
-        target_width = LED_COLUMN_COUNT
-        target_height = LED_ROW_COUNT
+        target_width = layout.column_count
+        target_height = layout.row_count
+        column_offset = 0
 
     capture = cv2.VideoCapture(arguments.video_file)
     video_fps = capture.get(cv2.CAP_PROP_FPS)
@@ -55,11 +104,10 @@ def process_inner(arguments: argparse.Namespace, output_name: pathlib.Path) -> N
     height = len(image)
     width = len(image[0])
 
-    def sample_to_int(sample: List[numpy.uint8]) -> int:
-        """Converts a sample to int."""
-        value = (sample[2] << 16) + (sample[1] << 8) + sample[0]
-        return int(value)
-
+    lut = make_color_lut(arguments.gamma, arguments.white_balance, arguments.brightness)
+    debug_print(
+        f"gamma:{arguments.gamma} white_balance:{arguments.white_balance} brightness:{arguments.brightness}"
+    )
 
     video_ratio = width / height
     target_ratio = target_width / target_height
@@ -87,11 +135,23 @@ def process_inner(arguments: argparse.Namespace, output_name: pathlib.Path) -> N
     debug_print(f"width:{width} height:{height}")
     debug_print(f"w_indexes:{w_indexes} h_indexes:{h_indexes}")
 
+    rows_columns = numpy.ix_(h_indexes, w_indexes)
+    if arguments.physical:
+        # Samples are RGB to match CRGB, plus one extra black sample for the unused LEDs
+        samples = numpy.zeros((target_height * target_width + 1, 3), dtype=numpy.uint8)
+        led_to_sample = make_led_to_sample(layout, column_offset, target_width, target_height)
+    else:
+        # Samples are 4 bytes, BGR plus an unused byte, so that they read as little endian
+        # 0x00RRGGBB uint32s
+        samples = numpy.zeros((target_height, target_width, 4), dtype=numpy.uint8)
+
     count = 0
     with open(output_name, "wb") as file:
-        # First, write info
-        file.write(target_width.to_bytes(1, "little"))
-        file.write(target_height.to_bytes(1, "little"))
+        # First, write info. Physical frames are read straight into leds[], so the firmware only
+        # needs the frame time.
+        if not arguments.physical:
+            file.write(target_width.to_bytes(1, "little"))
+            file.write(target_height.to_bytes(1, "little"))
         # Then milliseonds per frame. This probably won't ever exceed 255, but
         # use 2 bytes just in case.
         file.write(int(1000 / video_fps).to_bytes(2, "little"))
@@ -100,11 +160,14 @@ def process_inner(arguments: argparse.Namespace, output_name: pathlib.Path) -> N
             success, image = capture.read()
             if not success:
                 break
-            for h_index in h_indexes:
-                for w_index in w_indexes:
-                    # Write 4-byte samples? I don't know if it's worth trying to do 3
-                    sample_int = sample_to_int(image[h_index][w_index])
-                    file.write(sample_int.to_bytes(4, "little"))
+            colors = lut.take(image[rows_columns] + CHANNEL_OFFSETS)
+            if arguments.physical:
+                samples[:-1] = colors.reshape(-1, 3)[:, ::-1]
+                file.write(samples.take(led_to_sample, axis=0).tobytes())
+            else:
+                # Write 4-byte samples? I don't know if it's worth trying to do 3
+                samples[:, :, :3] = colors
+                file.write(samples.tobytes())
 
             count += 1
 
@@ -123,12 +186,42 @@ def make_parser() -> argparse.ArgumentParser:
         help="Center and crop the video to the back of the vest.",
         default=False,
     )
+    parser.add_argument(
+        "-p",
+        "--physical",
+        action="store_true",
+        help="Write frames in physical LED order as RGB, so they can be read straight into leds[].",
+        default=False,
+    )
     parser.add_argument(
         "-o",
         "--out",
         type=str,
         help="Output file name",
     )
+    parser.add_argument(
+        "-g",
+        "--gamma",
+        type=float,
+        help="Gamma correction to bake into the colors. The firmware's gamma8 table is about 2.8.",
+        default=1.0,
+    )
+    parser.add_argument(
+        "-w",
+        "--white-balance",
+        type=parse_white_balance,
+        help="R,G,B multipliers for white balance, e.g. 1,0.8,0.7",
+        default=(1.0, 1.0, 1.0),
+    )
+    parser.add_argument(
+        "-b",
+        "--brightness",
+        type=int,
+        choices=range(0, 256),
+        metavar="[0-255]",
+        help="Global brightness cap, out of 255.",
+        default=255,
+    )
     parser.add_argument("video_file", help="The video to read data from.")
     return parser
 
@@ -138,7 +231,8 @@ def main() -> None:
 
     parser = make_parser()
     arguments = parser.parse_args()
-    process(arguments)
+    # Loaded here rather than on import, since it may write the layout cache
+    process(arguments, offsets.VestLayout.load())
 
 
 if __name__ == "__main__":
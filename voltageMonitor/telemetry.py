@@ -0,0 +1,456 @@
+"""Ingests voltageMonitor.ino serial output into a columnar store, and reports on it.
+
+The store is a directory of raw binary files, one per column, which are appended to as lines are
+parsed and memory mapped for queries, so a week of once per second readings never has to fit in
+memory or be reparsed.
+
+Usage:
+    python3 telemetry.py ingest playa.log --start "2024-08-25 12:00"   Ingest a captured log
+    python3 telemetry.py ingest --serial /dev/ttyUSB0                   Stream from the monitor
+    python3 telemetry.py report                                         Daily summary
+
+The firmware doesn't print timestamps. Lines that start with one, e.g. from `ts "%Y-%m-%d %H:%M:%S"`
+or a terminal logger, use it. Otherwise readings are assumed to be 1 s apart from --start, or from
+the end of the store. Lines read from a serial port are stamped as they arrive. Times are stored as
+local seconds since 1970, so days split at local midnight.
+"""
+
+import argparse
+import datetime
+import os
+import re
+import sys
+import time
+import typing
+
+import numpy
+
+has_serial = False
+try:
+    import serial
+
+    has_serial = True
+except:
+    pass
+
+DEFAULT_STORE = "telemetry"
+SAMPLE_PERIOD_S = 1.0
+# Longer gaps between readings mean the monitor or the logger was off, so they aren't counted
+MAX_GAP_S = 10.0
+CHUNK_BYTES = 1 << 22
+FLUSH_ROWS = 4096
+FLUSH_SECONDS = 5.0
+SECONDS_PER_DAY = 24 * 60 * 60
+# Default off voltage slider, see sliderToVoltage
+DEFAULT_OFF_V = 45 / 100 * (13.1 - 12.0) + 12.0
+
+SAMPLE_COLUMNS = {
+    "time_s": numpy.float64,
+    "battery_v": numpy.float32,
+    "adc": numpy.float32,
+    "adc_v": numpy.float32,
+    "raw_v": numpy.float32,
+}
+EVENT_COLUMNS = {
+    "time_s": numpy.float64,
+    "on": numpy.uint8,
+    "battery_v": numpy.float32,
+    "threshold_v": numpy.float32,
+}
+
+# Matches the two Serial.printf formats in voltageMonitor.ino that we care about, each optionally
+# preceded by a timestamp
+LINE_PATTERN = re.compile(
+    rb"^(?:\[?(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d(?:\.\d+)?|\d{9,10}(?:\.\d+)?)\]?[ \t]*)?"
+    rb"(?:Corrected batV:(-?[\d.]+) \(adc:(-?[\d.]+) adcV:(-?[\d.]+), batV:(-?[\d.]+)\)"
+    rb"|Turning (on|off) strips, V=(-?[\d.]+)[<>](-?[\d.]+))",
+    re.MULTILINE,
+)
+
+
+class Table:
+    """Columns of one table, each in its own append-only file."""
+
+    def __init__(self, directory: str, columns: typing.Dict[str, typing.Any]) -> None:
+        self.directory = directory
+        self.columns = {name: numpy.dtype(dtype) for name, dtype in columns.items()}
+        os.makedirs(directory, exist_ok=True)
+        # An interrupted append can leave some columns longer than others
+        sizes = [os.path.getsize(self.path(name)) if os.path.exists(self.path(name)) else 0 for name in self.columns]
+        self.row_count = min(size // dtype.itemsize for size, dtype in zip(sizes, self.columns.values()))
+        for (name, dtype), size in zip(self.columns.items(), sizes):
+            if size != self.row_count * dtype.itemsize:
+                with open(self.path(name), "ab") as file:
+                    file.truncate(self.row_count * dtype.itemsize)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.{self.columns[name].str.lstrip('<>=|')}")
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def append(self, rows: typing.Dict[str, numpy.ndarray]) -> None:
+        count = len(rows["time_s"])
+        if count == 0:
+            return
+        for name, dtype in self.columns.items():
+            with open(self.path(name), "ab") as file:
+                file.write(numpy.ascontiguousarray(rows[name], dtype=dtype).tobytes())
+        self.row_count += count
+
+    def read(self) -> typing.Dict[str, numpy.ndarray]:
+        """Returns read only memory maps of every column."""
+        if self.row_count == 0:
+            return {name: numpy.zeros(0, dtype=dtype) for name, dtype in self.columns.items()}
+        return {
+            name: numpy.memmap(self.path(name), dtype=dtype, mode="r", shape=(self.row_count,))
+            for name, dtype in self.columns.items()
+        }
+
+
+class Store:
+    def __init__(self, directory: str) -> None:
+        self.samples = Table(os.path.join(directory, "samples"), SAMPLE_COLUMNS)
+        self.events = Table(os.path.join(directory, "events"), EVENT_COLUMNS)
+
+    def end_time_s(self) -> typing.Optional[float]:
+        if len(self.samples) == 0:
+            return None
+        return float(self.samples.read()["time_s"][-1])
+
+
+def local_seconds(moment: typing.Optional[datetime.datetime] = None) -> float:
+    """Local wall clock time as seconds since 1970, ignoring time zones."""
+    moment = moment or datetime.datetime.now()
+    return (moment - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def stamps_to_seconds(stamps: numpy.ndarray) -> numpy.ndarray:
+    """Converts timestamp strings, either dates or seconds, to seconds. Empty ones become NaN."""
+    seconds = numpy.full(len(stamps), numpy.nan)
+    present = stamps != b""
+    is_date = present & (numpy.char.find(stamps, b"-") > 0)
+    is_number = present & ~is_date
+    if is_date.any():
+        dates = stamps[is_date].astype("U").astype("datetime64[ms]")
+        seconds[is_date] = dates.astype(numpy.int64) / 1000
+    if is_number.any():
+        seconds[is_number] = stamps[is_number].astype(numpy.float64)
+    return seconds
+
+
+class Parser:
+    """Turns chunks of serial output into sample and event rows. Keeps the clock for unstamped
+    lines between chunks.
+    """
+
+    def __init__(self, start_s: typing.Optional[float]) -> None:
+        self.next_sample_s = start_s
+        self.last_stamp_s: typing.Optional[float] = None
+
+    def parse(self, data: bytes) -> typing.Tuple[typing.Dict[str, numpy.ndarray], typing.Dict[str, numpy.ndarray]]:
+        """Parses complete lines."""
+        matches = LINE_PATTERN.findall(data)
+        if not matches:
+            return empty_rows(SAMPLE_COLUMNS), empty_rows(EVENT_COLUMNS)
+        fields = numpy.array(matches, dtype=bytes)
+
+        times = stamps_to_seconds(fields[:, 0])
+        if numpy.isnan(times).all() and self.last_stamp_s is None:
+            is_sample = fields[:, 1] != b""
+            if self.next_sample_s is None:
+                raise ValueError("Lines have no timestamps, so a start time is needed")
+            # Events are printed right after the reading that caused them
+            sample_index = numpy.cumsum(is_sample) - 1
+            times = self.next_sample_s + sample_index * SAMPLE_PERIOD_S
+        else:
+            # Lines without a timestamp get the previous one
+            if numpy.isnan(times[0]):
+                times[0] = self.last_stamp_s if self.last_stamp_s is not None else numpy.nan
+            stamped = numpy.where(numpy.isnan(times), 0, numpy.arange(len(times)))
+            times = times[numpy.maximum.accumulate(stamped)]
+            self.last_stamp_s = float(times[-1])
+            # Drop anything before the first timestamp
+            fields = fields[~numpy.isnan(times)]
+            times = times[~numpy.isnan(times)]
+        is_sample = fields[:, 1] != b""
+        if is_sample.any():
+            self.next_sample_s = float(times[is_sample][-1]) + SAMPLE_PERIOD_S
+
+        samples = fields[is_sample]
+        events = fields[~is_sample]
+        sample_rows = {
+            "time_s": times[is_sample],
+            "battery_v": samples[:, 1].astype(numpy.float32),
+            "adc": samples[:, 2].astype(numpy.float32),
+            "adc_v": samples[:, 3].astype(numpy.float32),
+            "raw_v": samples[:, 4].astype(numpy.float32),
+        }
+        event_rows = {
+            "time_s": times[~is_sample],
+            "on": (events[:, 5] == b"on").astype(numpy.uint8),
+            "battery_v": events[:, 6].astype(numpy.float32),
+            "threshold_v": events[:, 7].astype(numpy.float32),
+        }
+        return sample_rows, event_rows
+
+
+def empty_rows(columns: typing.Dict[str, typing.Any]) -> typing.Dict[str, numpy.ndarray]:
+    return {name: numpy.zeros(0, dtype=dtype) for name, dtype in columns.items()}
+
+
+def ingest_file(store: Store, parser: Parser, path: str, follow: bool) -> int:
+    """Appends the readings from a log file in chunks. With follow, keeps reading as the file
+    grows, like tail -f. Returns the number of readings added.
+    """
+    added = 0
+    with open(path, "rb") as file:
+        remainder = b""
+        while True:
+            data = file.read(CHUNK_BYTES)
+            if not data:
+                if not follow:
+                    break
+                time.sleep(FLUSH_SECONDS)
+                continue
+            data = remainder + data
+            # Only parse whole lines, the rest waits for the next chunk
+            end = data.rfind(b"\n") + 1
+            data, remainder = data[:end], data[end:]
+            sample_rows, event_rows = parser.parse(data)
+            store.samples.append(sample_rows)
+            store.events.append(event_rows)
+            added += len(sample_rows["time_s"])
+        sample_rows, event_rows = parser.parse(remainder)
+        store.samples.append(sample_rows)
+        store.events.append(event_rows)
+        added += len(sample_rows["time_s"])
+    return added
+
+
+def ingest_serial(store: Store, parser: Parser, device: str) -> int:
+    """Appends readings from the voltage monitor as they arrive, until interrupted."""
+    added = 0
+    lines = []
+    flush_time = time.monotonic() + FLUSH_SECONDS
+    with serial.Serial(device, 115200, timeout=1) as port:
+        try:
+            while True:
+                line = port.readline()
+                if line.endswith(b"\n"):
+                    # Stamp each line on arrival, since a flush can be seconds later
+                    stamp = datetime.datetime.now().isoformat(sep=" ", timespec="milliseconds")
+                    lines.append(stamp.encode() + b" " + line)
+                if len(lines) >= FLUSH_ROWS or time.monotonic() > flush_time:
+                    sample_rows, event_rows = parser.parse(b"".join(lines))
+                    store.samples.append(sample_rows)
+                    store.events.append(event_rows)
+                    added += len(sample_rows["time_s"])
+                    lines = []
+                    flush_time = time.monotonic() + FLUSH_SECONDS
+        except KeyboardInterrupt:
+            sample_rows, event_rows = parser.parse(b"".join(lines))
+            store.samples.append(sample_rows)
+            store.events.append(event_rows)
+            added += len(sample_rows["time_s"])
+    return added
+
+
+def relay_on_at(
+    samples: typing.Dict[str, numpy.ndarray], events: typing.Dict[str, numpy.ndarray]
+) -> numpy.ndarray:
+    """Whether the strips were on at each reading. Before the first event, the relay is assumed to
+    be in the state that event switched it out of, or on if there are none.
+    """
+    event_on = numpy.asarray(events["on"], dtype=bool)
+    initial = not event_on[0] if len(event_on) else True
+    states = numpy.concatenate(([initial], event_on))
+    return states[numpy.searchsorted(events["time_s"], samples["time_s"], side="right")]
+
+
+def reading_durations_s(times_s: numpy.ndarray) -> numpy.ndarray:
+    """How long each reading stands for, until the next one, not counting gaps in the log."""
+    durations = numpy.diff(times_s, append=times_s[-1] + SAMPLE_PERIOD_S) if len(times_s) else numpy.zeros(0)
+    return numpy.where((durations >= 0) & (durations <= MAX_GAP_S), durations, 0.0)
+
+
+class DailySummary(typing.NamedTuple):
+    days: numpy.ndarray
+    min_v: numpy.ndarray
+    max_v: numpy.ndarray
+    duty_cycle: numpy.ndarray
+    off_count: numpy.ndarray
+
+
+def daily_summary(
+    samples: typing.Dict[str, numpy.ndarray], events: typing.Dict[str, numpy.ndarray]
+) -> DailySummary:
+    """Minimum and maximum voltage, fraction of the time the strips were on and the number of
+    times they turned off, for each day. Readings must be in time order.
+    """
+    times = samples["time_s"]
+    day_numbers = (times // SECONDS_PER_DAY).astype(numpy.int64)
+    starts = numpy.flatnonzero(numpy.diff(day_numbers, prepend=-1))
+    days = day_numbers[starts]
+    voltages = samples["battery_v"]
+    if len(times) == 0:
+        empty = numpy.zeros(0)
+        return DailySummary(days, empty, empty, empty, numpy.zeros(0, dtype=numpy.int64))
+
+    durations = reading_durations_s(times)
+    on = relay_on_at(samples, events)
+    day_indexes = numpy.repeat(numpy.arange(len(days)), numpy.diff(starts, append=len(times)))
+    logged_s = numpy.bincount(day_indexes, weights=durations, minlength=len(days))
+    on_s = numpy.bincount(day_indexes, weights=durations * on, minlength=len(days))
+    off_days = (events["time_s"][events["on"] == 0] // SECONDS_PER_DAY).astype(numpy.int64)
+    return DailySummary(
+        days=days,
+        min_v=numpy.minimum.reduceat(voltages, starts),
+        max_v=numpy.maximum.reduceat(voltages, starts),
+        duty_cycle=on_s / numpy.maximum(logged_s, 1e-9),
+        off_count=numpy.searchsorted(off_days, days, side="right") - numpy.searchsorted(off_days, days),
+    )
+
+
+def on_durations_s(
+    samples: typing.Dict[str, numpy.ndarray], events: typing.Dict[str, numpy.ndarray]
+) -> numpy.ndarray:
+    """How long the strips ran before each time they turned off, from the previous turn on or the
+    start of the log.
+    """
+    event_times = numpy.asarray(events["time_s"])
+    event_on = numpy.asarray(events["on"], dtype=bool)
+    if len(event_times) == 0 or len(samples["time_s"]) == 0:
+        return numpy.zeros(0)
+    off_indexes = numpy.flatnonzero(~event_on)
+    # The last turn on before each turn off
+    on_indexes = numpy.where(event_on, numpy.arange(len(event_on)), -1)
+    previous_on = numpy.maximum.accumulate(on_indexes)[off_indexes]
+    on_times = numpy.where(previous_on >= 0, event_times[numpy.maximum(previous_on, 0)], numpy.nan)
+    if not event_on[0]:
+        on_times[0] = samples["time_s"][0]
+    durations = event_times[off_indexes] - on_times
+    return durations[~numpy.isnan(durations)]
+
+
+def time_to_off_s(
+    samples: typing.Dict[str, numpy.ndarray], off_v: float, window_s: float = 60 * 60
+) -> typing.Optional[float]:
+    """Estimates when the battery will reach off_v, from a line fit to the last window_s of
+    readings. Returns None if it isn't going down.
+    """
+    times = samples["time_s"]
+    if len(times) < 2:
+        return None
+    start = numpy.searchsorted(times, times[-1] - window_s)
+    recent_times = numpy.asarray(times[start:]) - times[-1]
+    if len(recent_times) < 2:
+        return None
+    slope, intercept = numpy.polyfit(recent_times, numpy.asarray(samples["battery_v"][start:], dtype=numpy.float64), 1)
+    if slope >= 0:
+        return None
+    return max(0.0, (off_v - intercept) / slope)
+
+
+def format_duration(seconds: float) -> str:
+    return f"{int(seconds // 3600)}:{int(seconds % 3600 // 60):02d}"
+
+
+def print_report(store: Store, off_v: float) -> None:
+    samples = store.samples.read()
+    events = store.events.read()
+    if len(samples["time_s"]) == 0:
+        print("No readings")
+        return
+    summary = daily_summary(samples, events)
+    print(f"{len(samples['time_s'])} readings, {len(events['time_s'])} relay events")
+    print(f"{'day':>10} {'min V':>6} {'max V':>6} {'on':>6} {'offs':>4}")
+    for day, min_v, max_v, duty_cycle, off_count in zip(*summary):
+        date = numpy.datetime64(int(day), "D")
+        print(f"{str(date):>10} {min_v:6.2f} {max_v:6.2f} {duty_cycle:6.1%} {off_count:4d}")
+
+    durations = on_durations_s(samples, events)
+    if len(durations):
+        print(
+            f"Ran {format_duration(float(numpy.median(durations)))} before turning off (median),"
+            f" {format_duration(float(durations.min()))} to {format_duration(float(durations.max()))}"
+        )
+    latest = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=float(samples["time_s"][-1]))
+    print(f"Latest: {samples['battery_v'][-1]:0.2f} V at {latest:%Y-%m-%d %H:%M:%S}")
+    remaining = time_to_off_s(samples, off_v)
+    if remaining is not None:
+        print(f"Estimated time to {off_v:0.2f} V: {format_duration(remaining)}")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Makes a parser."""
+    parser = argparse.ArgumentParser(
+        description="Ingests and reports on voltage monitor serial output.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--store", type=str, default=DEFAULT_STORE, help="Store directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Append readings to the store")
+    ingest.add_argument("logs", nargs="*", help="Captured serial logs")
+    ingest.add_argument("--serial", type=str, help="Read from a serial device instead, needs pyserial")
+    ingest.add_argument("--follow", "-f", action="store_true", help="Keep reading the log as it grows")
+    ingest.add_argument("--start", type=str, help="When the first unstamped reading was, e.g. '2024-08-25 12:00'")
+
+    report = subparsers.add_parser("report", help="Summarize the store")
+    report.add_argument("--off-v", type=float, default=DEFAULT_OFF_V, help="Off voltage for the time to off estimate")
+    return parser
+
+
+def main() -> None:
+    """Main."""
+    args = make_parser().parse_args()
+
+    def print_error(error: str) -> None:
+        sys.stderr.write("Error: " + error + "\n")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    store = Store(args.store)
+    if args.command == "report":
+        print_report(store, args.off_v)
+        return
+
+    if args.serial is None and not args.logs:
+        print_error("Specify log files or --serial")
+    if args.serial is not None and args.logs:
+        print_error("Specify only one of log files and --serial")
+    if args.serial is not None and not has_serial:
+        print_error("pyserial is required for --serial")
+    if args.follow and len(args.logs) != 1:
+        print_error("--follow needs exactly one log file")
+
+    start_s = store.end_time_s()
+    if start_s is not None:
+        start_s += SAMPLE_PERIOD_S
+    elif args.follow:
+        start_s = local_seconds()
+    if args.start is not None:
+        try:
+            start_s = local_seconds(datetime.datetime.fromisoformat(args.start))
+        except ValueError:
+            print_error(f"Bad start time: {args.start}, should be e.g. '2024-08-25 12:00'")
+    parser = Parser(start_s)
+
+    start = time.time()
+    added = 0
+    try:
+        if args.serial is not None:
+            added = ingest_serial(store, parser, args.serial)
+        else:
+            for path in args.logs:
+                added += ingest_file(store, parser, path, args.follow)
+    except ValueError as error:
+        print_error(f"{error}. Pass --start.")
+    except KeyboardInterrupt:
+        pass
+    print(f"Added {added} readings in {time.time() - start:0.2f} s, {len(store.samples)} total")
+
+
+if __name__ == "__main__":
+    main()